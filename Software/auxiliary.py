@@ -12,8 +12,16 @@
 
 # Modules
 import computer_vision as vision
+import tracing
+import metrics
 import numpy as np
+import threading
+import json
 import time
+import os
+
+
+time_skipped = threading.local()     # waiting skipped by sim_time_scale in the calling thread
 
 
 def smaract_is_valid_relative_movement(config, channel_index, absolute_position, relative_movement):
@@ -92,34 +100,114 @@ def pistage_is_valid_speed(config, speed):
     return True
 
 
-def smaract_move_channel_to_position_sleep(smaract, channel_index, absolute_position, speed, sleep_multiplier):
+@tracing.traced('sleep')
+def sleep(config, time_s):
+    # all the waiting of the workers goes through here such that the simulator can run faster than real time
+    time.sleep(time_s * config.sim_time_scale)
+    time_skipped.time_s = getattr(time_skipped, 'time_s', 0) + time_s * (1 - config.sim_time_scale)
+
+
+def get_time():
+    '''
+    time in s of the calling thread as it would be on the rig (the real time plus the waiting skipped by sim_time_scale)
+    '''
+
+    return time.perf_counter() + getattr(time_skipped, 'time_s', 0)
+
+
+@tracing.traced('motion')
+def smaract_move_channel_to_position_sleep(smaract, channel_index, absolute_position, speed, sleep_multiplier, config):
     sleep_time = abs(absolute_position - smaract.get_channel_position(channel_index)) / speed
     smaract.move_channel_to_position(channel_index, absolute_position, speed)
-    time.sleep(sleep_time * sleep_multiplier)
+    sleep(config, sleep_time * sleep_multiplier)
 
 
-def smaract_move_channel_sleep(smaract, channel_index, relative_movement, speed, sleep_multiplier):
+@tracing.traced('motion')
+def smaract_move_channel_sleep(smaract, channel_index, relative_movement, speed, sleep_multiplier, config):
     sleep_time = abs(relative_movement) / speed
     smaract.move_channel(channel_index, relative_movement, speed)
-    time.sleep(sleep_time * sleep_multiplier)
+    sleep(config, sleep_time * sleep_multiplier)
+
+
+def get_calibration_path(config):
+    return config.calibration_directory + 'calibration_' + config.calibration_objective + '.json'
+
+
+def fit_calibration(stage_points, pixel_points):
+    '''
+    fitting the affine transform from the smaract x/y positions (nm) to the pixel positions of the scissor tip
+    returning the 2x3 matrix (pixel = matrix[:, :2] @ stage + matrix[:, 2]) and the rms residual in px
+    '''
+
+    stage_points = np.asarray(stage_points, dtype=np.float64)
+    pixel_points = np.asarray(pixel_points, dtype=np.float64)
+    a_mat = np.hstack([stage_points, np.ones((len(stage_points), 1))])
+    solution, _, _, _ = np.linalg.lstsq(a_mat, pixel_points, rcond=None)
+    residuals = a_mat @ solution - pixel_points
+    return solution.T, np.sqrt(np.mean(np.sum(residuals**2, axis=1)))
+
+
+def save_calibration(config, matrix, residual):
+    os.makedirs(config.calibration_directory, exist_ok=True)
+    with open(get_calibration_path(config), 'w') as file:
+        json.dump({'objective': config.calibration_objective, 'matrix': np.asarray(matrix).tolist(), 'residual_px': float(residual),
+                   'date': time.strftime('%Y_%m_%d_%H_%M_%S', time.localtime())}, file, indent=4)
+    config.calibration_matrix = np.asarray(matrix)
+
+
+def load_calibration(config):
+    '''
+    loading the calibration of the current objective, pixel_to_mili is used for the movements if there is none
+    '''
+
+    config.calibration_matrix = None
+    path = get_calibration_path(config)
+    if not os.path.isfile(path):
+        return False
+    with open(path) as file:
+        config.calibration_matrix = np.array(json.load(file)['matrix'])
+    return True
+
+
+def get_calibration_text(matrix, residual):
+    # scale of both stage axes in px/mm and their angles in the image (deg)
+    scale_x, scale_y = np.linalg.norm(matrix[:, 0]) * 1e6, np.linalg.norm(matrix[:, 1]) * 1e6
+    angle_x, angle_y = np.degrees(np.arctan2(matrix[1, 0], matrix[0, 0])), np.degrees(np.arctan2(matrix[1, 1], matrix[0, 1]))
+    return 'x: {:.1f} px/mm at {:.1f} deg, y: {:.1f} px/mm at {:.1f} deg, residual {:.2f} px'.format(scale_x, angle_x, scale_y, angle_y, residual)
+
+
+def pixel_to_stage(config, dx, dy):
+    '''
+    returning the smaract x/y movement (nm) that moves the scissor tip by (dx, dy) px in the image
+    '''
+
+    if config.calibration_matrix is None:
+        # same scale on both axes and no rotation, the image moves opposite to the stage
+        return -dx * config.pixel_to_mili * config.mili_to_nano, -dy * config.pixel_to_mili * config.mili_to_nano
+    x_movement, y_movement = np.linalg.solve(config.calibration_matrix[:, :2], [dx, dy])
+    return float(x_movement), float(y_movement)
 
 
-def pistage_move_axis_to_position_sleep(pistage, axis_index, absolute_position, speed, sleep_multiplier):
+@tracing.traced('motion')
+def pistage_move_axis_to_position_sleep(pistage, axis_index, absolute_position, speed, sleep_multiplier, config):
     sleep_time = abs(absolute_position - pistage.get_axis_position(axis_index)) / speed
     pistage.move_axis_to_position(axis_index, absolute_position, speed)
-    time.sleep(sleep_time * sleep_multiplier)
+    sleep(config, sleep_time * sleep_multiplier)
 
 
-def pistage_move_axis_sleep(pistage, axis_index, relative_movement, speed, sleep_multiplier):
+@tracing.traced('motion')
+def pistage_move_axis_sleep(pistage, axis_index, relative_movement, speed, sleep_multiplier, config):
     sleep_time = abs(relative_movement) / speed
     pistage.move_axis(axis_index, relative_movement, speed)
-    time.sleep(sleep_time * sleep_multiplier)
+    sleep(config, sleep_time * sleep_multiplier)
 
 
+@tracing.traced('motion')
 def scissor_close(asm, config):
     asm.move(-config.asm_steps_base*config.sequence_cut_num)
         
 
+@tracing.traced('motion')
 def scissor_open(asm, config):
     asm.move(config.asm_steps_base*config.sequence_cut_num)
 
@@ -134,98 +222,268 @@ def clicked_position_is_valid(config, x, y):
     return True
 
 
+@tracing.traced('vision')
 def normalize_image(img, range_min=0, range_max=255):
     img_temp = img.copy()
     return range_min + (img_temp-np.min(img_temp))/(np.max(img_temp)-np.min(img_temp))*(range_max-range_min)
 
 
-def automation_extract_embryo_from_image(img, config):
-    img_temp = img.copy()
-    # blurring
-    img_bl = vision.apply_blurring(img_temp, config.annotation_blurring_kernel_size, config.annotation_blurring_sigma_x)
-    if config.automation_flag_save_image:
-        vision.save_image(img_bl, str(config.automation_counter)+'_emb_bl', config.automation_directory)
-    # thresholding
-    img_th = vision.apply_in_range_threshold(img_bl, config.annotation_scissor_gray_level, config.annotation_embryo_gray_level_1)
+@tracing.traced('vision')
+def automation_preprocess_image(img, config, roi=None, workspace=None):
+    '''
+    blurring the image once and thresholding the blurred image into the embryo and scissor gray-level bands
+    both automation detectors consume the outputs, so the frame is blurred only once per well
+    if a roi (x, y, w, h) is given, only the roi is processed and the outputs are black outside of it
+    the outputs are written into the buffers of the workspace (valid until the next frame)
+    '''
+
+    if workspace is None:
+        workspace = vision.Workspace()
+    img_bl = workspace.get_buffer('bl', img.shape, img.dtype)
+    img_th_emb = workspace.get_buffer('emb_th', img.shape)
+    img_th_scs = workspace.get_buffer('scs_th', img.shape)
+    if roi is None:
+        # blurring
+        vision.apply_blurring(img, config.annotation_blurring_kernel_size, config.annotation_blurring_sigma_x, img_bl)
+        # thresholding (embryo and scissor bands)
+        vision.apply_in_range_threshold(img_bl, config.annotation_scissor_gray_level, config.annotation_embryo_gray_level_1, img_th_emb)
+        vision.apply_in_range_threshold(img_bl, 0, config.annotation_scissor_gray_level, img_th_scs)
+    else:
+        h_img, w_img = img.shape
+        x_roi, y_roi, w_roi, h_roi = roi
+        # blurring (the roi is enlarged by the kernel radius so that the blurred roi is identical to the blurred full frame)
+        radius = config.annotation_blurring_kernel_size // 2
+        x_lower, y_lower = max(x_roi-radius, 0), max(y_roi-radius, 0)
+        x_upper, y_upper = min(x_roi+w_roi+radius, w_img), min(y_roi+h_roi+radius, h_img)
+        img_bl_en = vision.apply_blurring(img[y_lower:y_upper, x_lower:x_upper], config.annotation_blurring_kernel_size, config.annotation_blurring_sigma_x,
+                                          workspace.get_buffer('bl_en', (y_upper-y_lower, x_upper-x_lower), img.dtype))
+        img_bl.fill(0)
+        img_bl[y_roi:y_roi+h_roi, x_roi:x_roi+w_roi] = img_bl_en[y_roi-y_lower:y_roi-y_lower+h_roi, x_roi-x_lower:x_roi-x_lower+w_roi]
+        img_bl_roi = img_bl[y_roi:y_roi+h_roi, x_roi:x_roi+w_roi]
+        # thresholding (embryo and scissor bands)
+        img_th_emb.fill(0)
+        img_th_emb[y_roi:y_roi+h_roi, x_roi:x_roi+w_roi] = vision.apply_in_range_threshold(img_bl_roi, config.annotation_scissor_gray_level, config.annotation_embryo_gray_level_1,
+                                                                                           workspace.get_buffer('th_roi', (h_roi, w_roi)))
+        img_th_scs.fill(0)
+        img_th_scs[y_roi:y_roi+h_roi, x_roi:x_roi+w_roi] = vision.apply_in_range_threshold(img_bl_roi, 0, config.annotation_scissor_gray_level,
+                                                                                           workspace.get_buffer('th_roi', (h_roi, w_roi)))
     if config.automation_flag_save_image:
-        vision.save_image(img_th, str(config.automation_counter)+'_emb_th', config.automation_directory)
-    # seprating embryo from the background
-    labels, areas = vision.find_connected_components(img_th)
-    if len(areas) == 0:
-        return None, None, False, config.annotation_err_no_areas
-    elif np.max(areas) < config.annotation_area_value_min:
-        return None, None, False, config.annotation_err_no_areas
-    area_max_idx = np.argmax(areas)
-    img_desired = np.zeros(labels.shape, dtype=np.uint8)
-    img_desired[labels == area_max_idx + 1] = config.annotation_white_level
+        vision.save_image(img_bl, str(config.automation_counter)+'_bl', config.automation_directory)
+        vision.save_image(img_th_emb, str(config.automation_counter)+'_emb_th', config.automation_directory)
+        vision.save_image(img_th_scs, str(config.automation_counter)+'_scs_th', config.automation_directory)
+    return img_bl, img_th_emb, img_th_scs
+
+
+def automation_extract_embryo_from_image(img_th, config, roi=None, img_desired=None, labels=None):
+    # seprating embryo from the background (the largest blob inside the roi)
+    img_desired, bbox, area = vision.extract_largest_component(img_th, config.annotation_white_level, roi, img_desired, labels)
+    if bbox is None:
+        return None, None, None, False, config.annotation_err_no_areas
+    elif area < config.annotation_area_value_min:
+        return None, None, None, False, config.annotation_err_no_areas
     if config.automation_flag_save_image:
         vision.save_image(img_desired, str(config.automation_counter)+'_emb', config.automation_directory)
-    return img_desired, img_bl, True, None
+    return img_desired, bbox, area, True, None
 
 
-def automation_extract_scissor_from_image(img, config):
-    img_temp = img.copy()
-    # blurring
-    img_bl = vision.apply_blurring(img_temp, config.annotation_blurring_kernel_size, config.annotation_blurring_sigma_x)
-    if config.automation_flag_save_image:
-        vision.save_image(img_bl, str(config.automation_counter)+'_scs_bl', config.automation_directory)
-    # thresholding
-    img_th = vision.apply_in_range_threshold(img_bl, 0, config.annotation_scissor_gray_level)
-    if config.automation_flag_save_image:
-        vision.save_image(img_th, str(config.automation_counter)+'_scs_th', config.automation_directory)
-    # seprating scissor from the background
-    labels, areas = vision.find_connected_components(img_th)
-    if len(areas) == 0:
-        return None, None, False, config.annotation_err_no_areas
-    elif np.max(areas) < config.annotation_area_value_min:
-        return None, None, False, config.annotation_err_no_areas
-    area_max_idx = np.argmax(areas)
-    img_desired = np.zeros(labels.shape, dtype=np.uint8)
-    img_desired[labels == area_max_idx + 1] = config.annotation_white_level
+def automation_extract_scissor_from_image(img_th, config, roi=None, img_desired=None, labels=None):
+    # seprating scissor from the background (the largest blob inside the roi)
+    img_desired, bbox, area = vision.extract_largest_component(img_th, config.annotation_white_level, roi, img_desired, labels)
+    if bbox is None:
+        return None, None, None, False, config.annotation_err_no_areas
+    elif area < config.annotation_area_value_min:
+        return None, None, None, False, config.annotation_err_no_areas
     if config.automation_flag_save_image:
         vision.save_image(img_desired, str(config.automation_counter)+'_scs', config.automation_directory)
-    return img_desired, img_bl, True, None
+    return img_desired, bbox, area, True, None
 
 
-def automation_annotate_embryo(img_cam, config, model):
-    # extracting embryo from the image
-    img_th, img_bl, flag, err = automation_extract_embryo_from_image(img_cam, config)
+@tracing.traced('vision')
+@metrics.annotation('extraction')
+def automation_extract_from_image(img, config, roi_tracker, workspace):
+    '''
+    extracting the embryo and scissor inside the padded roi around their positions in the previous well
+    the full frame is processed instead if the roi is not known yet or the blobs found in the roi are not confident
+    '''
+
+    img_emb = workspace.get_buffer('emb', img.shape)
+    img_scs = workspace.get_buffer('scs', img.shape)
+    roi = roi_tracker.get_roi(img.shape)
+    if roi is not None:
+        img_bl, img_th_emb, img_th_scs = automation_preprocess_image(img, config, roi, workspace)
+        labels = workspace.get_buffer('labels', (roi[3], roi[2]), np.int32)
+        _, bbox_emb, area_emb, flag_emb, _ = automation_extract_embryo_from_image(img_th_emb, config, roi, img_emb, labels)
+        _, bbox_scs, area_scs, flag_scs, _ = automation_extract_scissor_from_image(img_th_scs, config, roi, img_scs, labels)
+        hit = (flag_emb and flag_scs and roi_tracker.is_confident(config.roi_name_embryo, bbox_emb, area_emb, roi, img.shape)
+               and roi_tracker.is_confident(config.roi_name_scissor, bbox_scs, area_scs, roi, img.shape))
+        roi_tracker.register(hit)
+        if hit:
+            roi_tracker.update(config.roi_name_embryo, bbox_emb, area_emb)
+            roi_tracker.update(config.roi_name_scissor, bbox_scs, area_scs)
+            return img_bl, img_emb, bbox_emb, img_scs, bbox_scs, True, None
+    # falling back to the full frame
+    img_bl, img_th_emb, img_th_scs = automation_preprocess_image(img, config, None, workspace)
+    labels = workspace.get_buffer('labels', img.shape, np.int32)
+    _, bbox_emb, area_emb, flag, err = automation_extract_embryo_from_image(img_th_emb, config, None, img_emb, labels)
     if flag == False:
-        return flag, err
+        return None, None, None, None, None, flag, err
+    _, bbox_scs, area_scs, flag, err = automation_extract_scissor_from_image(img_th_scs, config, None, img_scs, labels)
+    if flag == False:
+        return None, None, None, None, None, flag, err
+    roi_tracker.update(config.roi_name_embryo, bbox_emb, area_emb)
+    roi_tracker.update(config.roi_name_scissor, bbox_scs, area_scs)
+    return img_bl, img_emb, bbox_emb, img_scs, bbox_scs, True, None
+
+
+@tracing.traced('vision')
+def calculate_dn_centerline_points(img_out, w_emb, h_emb, config, flag_save_image, name, directory):
+    '''
+    thresholding the output of the deep network and sampling the somite points in the coordinates of the embryo crop
+    the centerline is computed at network resolution and mapped to the crop, the output is upsampled to the size of
+    the crop only for the debug images (or if dn_flag_threshold_before_resize is off).
+    '''
+
+    # the linear upsampling never exceeds the largest output, so an empty output is detected at network resolution
+    if not np.any(img_out > config.dn_threshold):
+        return None, None
+    if flag_save_image or not config.dn_flag_threshold_before_resize:
+        img_out_rs = vision.resize_image_by_size(img_out, w_emb, h_emb)
+        if flag_save_image:
+            vision.save_image(img_out_rs*config.dn_white_level, name+'_dn_out', directory)
+    if config.dn_flag_threshold_before_resize:
+        img_out_th = np.uint8(img_out > config.dn_threshold) * config.dn_white_level_normalized
+        x_arr, y_arr = vision.calculate_centerline_points(img_out_th, config.dn_somite_height_px, (w_emb, h_emb))
+        if flag_save_image:
+            img_out_th = vision.resize_mask_by_size(img_out_th, w_emb, h_emb)
+    else:
+        img_out_th = np.zeros(img_out_rs.shape)
+        img_out_th[img_out_rs > config.dn_threshold] = config.dn_white_level_normalized
+        x_arr, y_arr = vision.calculate_centerline_points(img_out_th, config.dn_somite_height_px)
+    if flag_save_image:
+        vision.save_image(img_out_th*config.dn_white_level, name+'_dn_th', directory)
+        if x_arr is not None:
+            temp_points = [(int(x), int(y), (0, 0, 255)) for x, y in zip(x_arr, y_arr)]
+            img_drawn = vision.draw_points(np.float32(img_out_th*config.dn_white_level), temp_points, config.annotation_point_offset)
+            vision.save_image(img_drawn, name+'_dn_th_ann', directory)
+    return x_arr, y_arr
+
+
+@tracing.traced('vision')
+def detect_embryo_circle(img_ed, x_seed, y_seed, config, flag_save_image):
+    '''
+    detecting the chorion in the edge image of the embryo crop with hough or a circle fit seeded at the blob centroid
+    the detected circle is drawn only if the debug images are saved (otherwise img_crc is None)
+    '''
+
+    if config.annotation_embryo_circle_method == config.annotation_embryo_circle_method_hough:
+        return vision.detect_circles(img_ed, config.annotation_embryo_circle_dp, config.annotation_embryo_circle_param_1,
+                                     config.annotation_embryo_circle_param_2, offset=config.annotation_point_offset, flag_draw=flag_save_image)
+    w = img_ed.shape[1]
+    r_min = config.annotation_embryo_circle_radius_ratio_min*w/2 - config.annotation_embryo_circle_fit_slack
+    r_max = config.annotation_embryo_circle_radius_ratio_max*w/2 + config.annotation_embryo_circle_fit_slack
+    x_circle, y_circle, r_circle = vision.fit_circle(img_ed, x_seed, y_seed, r_min, r_max,
+                                                     config.annotation_embryo_circle_method == config.annotation_embryo_circle_method_ransac,
+                                                     config.annotation_embryo_circle_ransac_iterations, config.annotation_embryo_circle_ransac_tolerance,
+                                                     config.annotation_embryo_circle_points_min, config.annotation_embryo_circle_ransac_points)
+    if x_circle is None:
+        return None, None, None
+    img_crc = None
+    if flag_save_image:
+        img_crc = vision.draw_circle(img_ed, x_circle, y_circle, r_circle, config.annotation_point_offset)
+    return img_crc, x_circle, y_circle
+
+
+@tracing.traced('vision')
+def detect_scissor_tip(img_ed, x_split, x_cropped, y_cropped, config, flag_save_image, flag_store_uncertainty=True):
+    '''
+    detecting the diagonal line of each half of the scissor edges (split at x_split) and intersecting them
+    the lines are detected with hough or fitted by ransac and pca within the slope band, the fit also gives the uncertainty
+    of the intersection (stored in annotation_scissor_tip_uncertainty unless flag_store_uncertainty is False, e.g. in the
+    camera thread). the lines are drawn only if the debug images are saved (otherwise the annotated images are None).
+    returning the annotated halves and the intersection in the full image
+    '''
+
+    img_left = img_ed[:, :x_split]
+    img_right = img_ed[:, x_split:]
+    offset = config.annotation_scissor_diagonal_line_offset
+    if flag_store_uncertainty:
+        config.annotation_scissor_tip_uncertainty = None
+    if config.annotation_scissor_line_method == config.annotation_scissor_line_method_hough:
+        img_left_ann, points_left = vision.detect_lines(img_left, config.annotation_scissor_line_rho, config.annotation_scissor_line_theta,
+                                                        config.annotation_scissor_diagonal_line_vote, config.annotation_scissor_diagonal_line_length_min,
+                                                        config.annotation_scissor_diagonal_line_gap_max, config.annotation_scissor_diagonal_line_slope_min,
+                                                        config.annotation_scissor_diagonal_line_slope_max, flag_save_image)
+        if points_left == None:
+            return None, None, None, None, False, config.annotation_scissor_err_no_line
+        img_right_ann, points_right = vision.detect_lines(img_right, config.annotation_scissor_line_rho, config.annotation_scissor_line_theta,
+                                                          config.annotation_scissor_diagonal_line_vote, config.annotation_scissor_diagonal_line_length_min,
+                                                          config.annotation_scissor_diagonal_line_gap_max, config.annotation_scissor_diagonal_line_slope_min,
+                                                          config.annotation_scissor_diagonal_line_slope_max, flag_save_image)
+        if points_right == None:
+            return img_left_ann, None, None, None, False, config.annotation_scissor_err_no_line
+        # converting the coordinates to match the dimensions of the full image
+        x1 = points_left[0] + offset + x_cropped
+        x2 = points_left[2] + offset + x_cropped
+        y1 = points_left[1] + y_cropped
+        y2 = points_left[3] + y_cropped
+        x3 = points_right[0] - offset + x_split + x_cropped
+        x4 = points_right[2] - offset + x_split + x_cropped
+        y3 = points_right[1] + y_cropped
+        y4 = points_right[3] + y_cropped
+        # calculating the intersection point
+        x_intersection = int(((x1*y2-y1*x2)*(x3-x4) - (x1-x2)*(x3*y4-y3*x4)) / ((x1-x2)*(y3-y4) - (y1-y2)*(x3-x4)))
+        y_intersection = int(((x1*y2-y1*x2)*(y3-y4) - (y1-y2)*(x3*y4-y3*x4)) / ((x1-x2)*(y3-y4) - (y1-y2)*(x3-x4)))
+        return img_left_ann, img_right_ann, x_intersection, y_intersection, True, None
+    lines = []
+    imgs_ann = []
+    for img_half in [img_left, img_right]:
+        line, errors = vision.fit_line(img_half, config.annotation_scissor_diagonal_line_slope_min, config.annotation_scissor_diagonal_line_slope_max,
+                                       config.annotation_scissor_diagonal_line_length_min, config.annotation_scissor_line_ransac_iterations,
+                                       config.annotation_scissor_line_ransac_tolerance, config.annotation_scissor_line_points_min,
+                                       config.annotation_scissor_line_ransac_points)
+        if line is None:
+            return (imgs_ann + [None])[0], None, None, None, False, config.annotation_scissor_err_no_line
+        lines.append((line, errors))
+        imgs_ann.append(vision.draw_line(img_half, line) if flag_save_image else None)
+    # converting the lines to match the dimensions of the full image
+    (x_left, y_left, vx_left, vy_left), errors_left = lines[0]
+    (x_right, y_right, vx_right, vy_right), errors_right = lines[1]
+    line_left = (x_left + offset + x_cropped, y_left + y_cropped, vx_left, vy_left)
+    line_right = (x_right - offset + x_split + x_cropped, y_right + y_cropped, vx_right, vy_right)
+    x_intersection, y_intersection, uncertainty = vision.intersect_lines_with_uncertainty(line_left, errors_left, line_right, errors_right)
+    if x_intersection is None:
+        return imgs_ann[0], imgs_ann[1], None, None, False, config.annotation_scissor_err_no_intersection
+    if flag_store_uncertainty:
+        config.annotation_scissor_tip_uncertainty = uncertainty
+    if uncertainty > config.annotation_scissor_tip_uncertainty_max:
+        return imgs_ann[0], imgs_ann[1], None, None, False, config.annotation_scissor_err_uncertain
+    return imgs_ann[0], imgs_ann[1], int(round(x_intersection)), int(round(y_intersection)), True, None
+
+
+@tracing.traced('vision')
+@metrics.annotation('embryo')
+def automation_annotate_embryo(img_cam, img_bl, img_th, bbox, config, model, gate=None, workspace=None):
     if config.automation_flag_cv_dn:     # deep network
+        # checking the embryo blob before running the deep network (a failed well costs only the extraction)
+        x, y, w, h = bbox
+        area = np.count_nonzero(img_th[y:y+h, x:x+w])
+        if gate is not None and not gate.is_plausible(bbox, area):
+            return False, config.dn_err_gate
         # processing the image to be fed to the deep network
-        img_th_cr, img_cr, x_cropped, y_cropped = vision.crop_image(img_th, img_cam, config.annotation_embryo_crop_offset)
+        img_th_cr, img_cr, x_cropped, y_cropped = vision.crop_image_by_bbox(img_th, img_cam, bbox, config.annotation_embryo_crop_offset)
         h_emb, w_emb = img_cr.shape
         img_rs = vision.resize_image_by_size(img_cr, config.dn_image_size, config.dn_image_size)
         img_in_arr = np.zeros((1, config.dn_image_size, config.dn_image_size, 1), dtype=np.float32)
         img_in_arr[0, :, :, 0] = np.float32(img_rs) / config.dn_white_level
-        img_out_arr = model.predict(img_in_arr, verbose=0)
-        # processing the output of the deep network
-        img_out = img_out_arr[0, :, :, 0]
-        img_out_rs = vision.resize_image_by_size(img_out, w_emb, h_emb)
-        if config.automation_flag_save_image:
-            vision.save_image(img_out_rs*config.dn_white_level, str(config.automation_counter)+'_dn_out', config.automation_directory)
-        img_out_th = np.zeros(img_out_rs.shape)
-        img_out_th[img_out_rs > config.dn_threshold] = config.dn_white_level_normalized
-        if config.automation_flag_save_image:
-            vision.save_image(img_out_th*config.dn_white_level, str(config.automation_counter)+'_dn_th', config.automation_directory)
-        # computing the annotation coordinates
-        ids = np.argwhere(img_out_th == config.dn_white_level_normalized)
-        if ids.size == 0:
+        with tracing.span('inference', 'inference'):
+            img_out_arr = model(img_in_arr)
+        # computing the annotation coordinates from the output of the deep network
+        x_arr, y_arr = calculate_dn_centerline_points(img_out_arr[0, :, :, 0], w_emb, h_emb, config, config.automation_flag_save_image,
+                                                      str(config.automation_counter), config.automation_directory)
+        if x_arr is None:
             return False, config.dn_err_empty
-        top = ids[:, 0].min()
-        bottom = ids[:, 0].max()
-        y_arr = np.arange(bottom, top, -int(config.dn_somite_height_px))
-        x_arr = np.zeros(y_arr.shape, dtype=int)
-        for i in range(len(y_arr)):
-            y = y_arr[i]
-            id_closest = np.abs(ids[:, 0] - y).argmin()
-            y_closest = ids[id_closest, 0]
-            x_arr[i] = int(np.mean(ids[ids[:, 0]==y_closest][:, 1]))
-        if config.automation_flag_save_image:
-            temp_points = [(int(x), int(y), (0, 0, 255)) for x, y in zip(x_arr, y_arr)]
-            img_drawn = vision.draw_points(np.float32(img_out_th*config.dn_white_level), temp_points, config.annotation_point_offset)
-            vision.save_image(img_drawn, str(config.automation_counter)+'_dn_th_ann', config.automation_directory)
+        if gate is not None:
+            gate.update(bbox, area)
         # converting the coordinates to match the dimensions of the full image
         x_arr = x_arr + x_cropped
         y_arr = y_arr + y_cropped
@@ -235,18 +493,22 @@ def automation_annotate_embryo(img_cam, config, model):
         config.annotation_points = config.annotation_points + config.annotation_embryo_points
         return True, None
     else:   # computer vision   
+        if workspace is None:
+            workspace = vision.Workspace()
         # cropping
-        img_th_cr, img_bl_cr, x_cropped, y_cropped = vision.crop_image(img_th, img_bl, config.annotation_embryo_crop_offset)
+        img_th_cr, img_bl_cr, x_cropped, y_cropped = vision.crop_image_by_bbox(img_th, img_bl, bbox, config.annotation_embryo_crop_offset)
         h_full, w_full = img_th_cr.shape
         if config.automation_flag_save_image:
             vision.save_image(img_th_cr, str(config.automation_counter)+'_emb_th_cr', config.automation_directory)
             vision.save_image(img_bl_cr, str(config.automation_counter)+'_emb_bl_cr', config.automation_directory)
         # filling
-        img_fl = vision.fill_image(img_th_cr, config.annotation_embryo_fill_offset, config.annotation_white_level)
+        img_fl = vision.fill_image(img_th_cr, config.annotation_embryo_fill_offset, config.annotation_white_level, workspace.get_buffer('emb_fl', img_th_cr.shape),
+                                   workspace.get_buffer('emb_fl_mask', (h_full+config.annotation_embryo_fill_offset, w_full+config.annotation_embryo_fill_offset)))
         if config.automation_flag_save_image:
             vision.save_image(img_fl, str(config.automation_counter)+'_emb_fl', config.automation_directory)
         # closing
-        img_cl = vision.apply_closing(img_fl, config.annotation_closing_kernel_size, config.annotation_closing_iterations)
+        img_cl = vision.apply_closing(img_fl, config.annotation_closing_kernel_size, config.annotation_closing_iterations, workspace.get_buffer('emb_cl', img_fl.shape),
+                                      workspace.get_kernel(config.annotation_closing_kernel_size))
         if config.automation_flag_save_image:
             vision.save_image(img_cl, str(config.automation_counter)+'_emb_cl', config.automation_directory)
         # calculating the centroid of the full embryo
@@ -254,12 +516,12 @@ def automation_annotate_embryo(img_cam, config, model):
         if (x_full_centroid, y_full_centroid) == (None, None):
             return False, config.annotation_err_no_centroid
         # detecting the edges
-        img_ed = vision.detect_edges(img_cl, config.annotation_edge_level_1, config.annotation_edge_level_2, config.annotation_edge_aperture_size, config.annotation_edge_l2_gradient)
+        img_ed = vision.detect_edges(img_cl, config.annotation_edge_level_1, config.annotation_edge_level_2, config.annotation_edge_aperture_size, config.annotation_edge_l2_gradient,
+                                     workspace.get_buffer('emb_ed', img_cl.shape))
         if config.automation_flag_save_image:
             vision.save_image(img_ed, str(config.automation_counter)+'_emb_ed', config.automation_directory)
         # detecting the circles
-        img_crc, x_circle, y_circle = vision.detect_circles(img_ed, config.annotation_embryo_circle_dp,
-                                                            config.annotation_embryo_circle_param_1, config.annotation_embryo_circle_param_2, offset=config.annotation_point_offset)
+        img_crc, x_circle, y_circle = detect_embryo_circle(img_ed, x_full_centroid, y_full_centroid, config, config.automation_flag_save_image)
         if (x_circle, y_circle) == (None, None):
             return False, config.annotation_embryo_err_no_circle
         if config.automation_flag_save_image:
@@ -270,14 +532,15 @@ def automation_annotate_embryo(img_cam, config, model):
             vision.save_image(img_mid, str(config.automation_counter)+'_emb_mid', config.automation_directory)
         h_mid, w_mid = img_mid.shape
         # thresholding
-        img_mid_th = vision.apply_in_range_threshold(img_mid, 0, config.annotation_embryo_gray_level_2)
+        img_mid_th = vision.apply_in_range_threshold(img_mid, 0, config.annotation_embryo_gray_level_2, workspace.get_buffer('emb_mid_th', img_mid.shape))
         if config.automation_flag_save_image:
             vision.save_image(img_mid_th, str(config.automation_counter)+'_emb_mid_th', config.automation_directory)
         # processing the lower half of the image 
         img_low = img_mid_th[h_mid//2:, :]
         if config.automation_flag_save_image:
             vision.save_image(img_low, str(config.automation_counter)+'_emb_low', config.automation_directory)
-        img_low_op = vision.apply_opening(img_low, config.annotation_embryo_openning_kernel_size, config.annotation_embryo_openning_iterations)
+        img_low_op = vision.apply_opening(img_low, config.annotation_embryo_openning_kernel_size, config.annotation_embryo_openning_iterations,
+                                          workspace.get_buffer('emb_low_op', img_low.shape), workspace.get_kernel(config.annotation_embryo_openning_kernel_size))
         if config.automation_flag_save_image:
             vision.save_image(img_low_op, str(config.automation_counter)+'_emb_low_op', config.automation_directory)
         x_low_centroid, y_low_centroid = vision.calculate_centroid(img_low_op)
@@ -289,7 +552,8 @@ def automation_annotate_embryo(img_cam, config, model):
         img_up = img_cl[:h_mid//3, :]
         if config.automation_flag_save_image:
             vision.save_image(img_up, str(config.automation_counter)+'_emb_up', config.automation_directory)
-        img_up_op = vision.apply_opening(img_up, config.annotation_embryo_openning_kernel_size, config.annotation_embryo_openning_iterations)
+        img_up_op = vision.apply_opening(img_up, config.annotation_embryo_openning_kernel_size, config.annotation_embryo_openning_iterations,
+                                         workspace.get_buffer('emb_up_op', img_up.shape), workspace.get_kernel(config.annotation_embryo_openning_kernel_size))
         if config.automation_flag_save_image:
             vision.save_image(img_up_op, str(config.automation_counter)+'_emb_up_op', config.automation_directory)
         x_up_centroid, y_up_centroid = vision.calculate_centroid(img_up_op)
@@ -311,71 +575,92 @@ def automation_annotate_embryo(img_cam, config, model):
         return True, None
 
 
-def automation_annotate_scissor(img_cam, config):
-    # extracting scissor from the image
-    img_th, img_bl, flag, err = extract_scissor_from_image(img_cam, config)
-    if flag == False:
-        return flag, err
+@tracing.traced('vision')
+def automation_locate_scissor_tip(img_bl, img_th, bbox, config, workspace, flag_save_image, flag_store_uncertainty=True):
+    '''
+    locating the scissor tip in the scissor blob (bbox) of the thresholded image without changing the annotation points
+    returning the tip in the full image
+    '''
+
     # cropping
-    img_th_cr, img_bl_cr, x_cropped, y_cropped = vision.crop_image(img_th, img_bl, config.annotation_scissor_crop_offset)
+    img_th_cr, img_bl_cr, x_cropped, y_cropped = vision.crop_image_by_bbox(img_th, img_bl, bbox, config.annotation_scissor_crop_offset)
     h_full, w_full = img_th_cr.shape
-    if config.automation_flag_save_image:
+    if flag_save_image:
         vision.save_image(img_th_cr, str(config.automation_counter)+'_scs_th_cr', config.automation_directory)
         vision.save_image(img_bl_cr, str(config.automation_counter)+'_scs_bl_cr', config.automation_directory)
     # closing
-    img_cl = vision.apply_closing(img_th_cr, config.annotation_closing_kernel_size, config.annotation_closing_iterations)
-    if config.automation_flag_save_image:
+    img_cl = vision.apply_closing(img_th_cr, config.annotation_closing_kernel_size, config.annotation_closing_iterations, workspace.get_buffer('scs_cl', img_th_cr.shape),
+                                  workspace.get_kernel(config.annotation_closing_kernel_size))
+    if flag_save_image:
         vision.save_image(img_cl, str(config.automation_counter)+'_scs_cl', config.automation_directory)
     # calculating the centroid of the full scissor
     x_full_centroid, y_full_centroid = vision.calculate_centroid(img_cl)
     if (x_full_centroid, y_full_centroid) == (None, None):
-        return False, config.annotation_err_no_centroid
+        return None, None, False, config.annotation_err_no_centroid
     # detecting the edges
-    img_ed = vision.detect_edges(img_cl, config.annotation_edge_level_1, config.annotation_edge_level_2, config.annotation_edge_aperture_size, config.annotation_edge_l2_gradient)
-    if config.automation_flag_save_image:
+    img_ed = vision.detect_edges(img_cl, config.annotation_edge_level_1, config.annotation_edge_level_2, config.annotation_edge_aperture_size, config.annotation_edge_l2_gradient,
+                                 workspace.get_buffer('scs_ed', img_cl.shape))
+    if flag_save_image:
         vision.save_image(img_ed, str(config.automation_counter)+'_scs_ed', config.automation_directory)
-    # dividing the scissor into two parts (left and right)
-    img_left = img_ed[:, :x_full_centroid]
-    img_right = img_ed[:, x_full_centroid:]
-    # detecting lines in the left part
-    img_left_ann, points_left = vision.detect_lines(img_left, config.annotation_scissor_line_rho, config.annotation_scissor_line_theta,
-                                                    config.annotation_scissor_diagonal_line_vote, config.annotation_scissor_diagonal_line_length_min,
-                                                    config.annotation_scissor_diagonal_line_gap_max, config.annotation_scissor_diagonal_line_slope_min,
-                                                    config.annotation_scissor_diagonal_line_slope_max)
-    if points_left == None:
-        return False, config.annotation_scissor_err_no_line
-    if config.automation_flag_save_image:
-        vision.save_image(img_left_ann, str(config.automation_counter)+'_scs_left_ann', config.automation_directory)
-    # detecting lines in the right part
-    img_right_ann, points_right = vision.detect_lines(img_right, config.annotation_scissor_line_rho, config.annotation_scissor_line_theta,
-                                                      config.annotation_scissor_diagonal_line_vote, config.annotation_scissor_diagonal_line_length_min,   
-                                                      config.annotation_scissor_diagonal_line_gap_max, config.annotation_scissor_diagonal_line_slope_min,
-                                                      config.annotation_scissor_diagonal_line_slope_max)
-    if points_right == None:
-        return False, config.annotation_scissor_err_no_line
-    if config.automation_flag_save_image:
-        vision.save_image(img_right_ann, str(config.automation_counter)+'_scs_right_ann', config.automation_directory)
-    # converting the coordinates to match the dimensions of the full image
-    x1 = points_left[0] + config.annotation_scissor_diagonal_line_offset + x_cropped
-    x2 = points_left[2] + config.annotation_scissor_diagonal_line_offset + x_cropped
-    y1 = points_left[1] + y_cropped
-    y2 = points_left[3] + y_cropped
-    x3 = points_right[0] - config.annotation_scissor_diagonal_line_offset + x_full_centroid + x_cropped
-    x4 = points_right[2] - config.annotation_scissor_diagonal_line_offset + x_full_centroid + x_cropped
-    y3 = points_right[1] + y_cropped
-    y4 = points_right[3] + y_cropped
-    # calculating the intersection point
-    x_intersection = int(((x1*y2-y1*x2)*(x3-x4) - (x1-x2)*(x3*y4-y3*x4)) / ((x1-x2)*(y3-y4) - (y1-y2)*(x3-x4)))
-    y_intersection = int(((x1*y2-y1*x2)*(y3-y4) - (y1-y2)*(x3*y4-y3*x4)) / ((x1-x2)*(y3-y4) - (y1-y2)*(x3-x4)))
+    # detecting the diagonal lines in the left and right parts and intersecting them
+    img_left_ann, img_right_ann, x_intersection, y_intersection, flag, err = detect_scissor_tip(img_ed, x_full_centroid, x_cropped, y_cropped, config,
+                                                                                                flag_save_image, flag_store_uncertainty)
+    if flag_save_image:
+        if img_left_ann is not None:
+            vision.save_image(img_left_ann, str(config.automation_counter)+'_scs_left_ann', config.automation_directory)
+        if img_right_ann is not None:
+            vision.save_image(img_right_ann, str(config.automation_counter)+'_scs_right_ann', config.automation_directory)
+    if flag == False:
+        return None, None, False, err
     if x_intersection < 0 or x_intersection > img_th.shape[1] or y_intersection < 0 or y_intersection > img_th.shape[0]:
-        return False, config.annotation_scissor_err_no_intersection
+        return None, None, False, config.annotation_scissor_err_no_intersection
+    return x_intersection, y_intersection, True, None
+
+
+@tracing.traced('vision')
+@metrics.annotation('scissor')
+def automation_annotate_scissor(img_bl, img_th, bbox, config, workspace=None, cache=None, pose=None):
+    if workspace is None:
+        workspace = vision.Workspace()
+    # reusing the tip of the previous well if the smaract is at the same pose and the scissor did not drift
+    if cache is not None:
+        tip = cache.lookup(img_bl, pose)
+        if tip is not None:
+            config.annotation_scissor_tip_uncertainty = cache.uncertainty
+            config.annotation_scissor_points = [(tip[0], tip[1], (0, 255, 255))]
+            config.annotation_points = config.annotation_points + config.annotation_scissor_points
+            return True, None
+    x_intersection, y_intersection, flag, err = automation_locate_scissor_tip(img_bl, img_th, bbox, config, workspace, config.automation_flag_save_image)
+    if flag == False:
+        return False, err
     # processing the annotation points
     config.annotation_scissor_points = [(x_intersection, y_intersection, (0, 255, 255))]
     # # config.annotation_points = list(set(config.annotation_scissor_points).union(set(config.annotation_points)))
     config.annotation_points = config.annotation_points + config.annotation_scissor_points
+    if cache is not None:
+        cache.update(img_bl, pose, (x_intersection, y_intersection), config.annotation_scissor_tip_uncertainty)
     return True, None
 
 
+@tracing.traced('vision')
+def locate_scissor_tip_in_frame(img, config, workspace):
+    '''
+    locating the scissor tip in a raw camera frame (e.g. to re-anchor the tip tracker from the camera thread)
+    the frame is blurred and thresholded in the scissor gray-level band only, no debug image is saved and the annotation
+    state of config (the uncertainty of the tip) is left unchanged.
+    '''
+
+    img_nr = normalize_image(img)
+    img_bl = vision.apply_blurring(img_nr, config.annotation_blurring_kernel_size, config.annotation_blurring_sigma_x,
+                                   workspace.get_buffer('bl', img.shape, img_nr.dtype))
+    img_th = vision.apply_in_range_threshold(img_bl, 0, config.annotation_scissor_gray_level, workspace.get_buffer('scs_th', img.shape))
+    img_scs, bbox, area = vision.extract_largest_component(img_th, config.annotation_white_level, None, workspace.get_buffer('scs', img.shape),
+                                                           workspace.get_buffer('labels', img.shape, np.int32))
+    if bbox is None or area < config.annotation_area_value_min:
+        return None, None, False, config.annotation_err_no_areas
+    return automation_locate_scissor_tip(img_bl, img_scs, bbox, config, workspace, False, False)
+
+
 def extract_embryo_from_image(img, config):
     img_temp = img.copy()
     # blurring
@@ -386,18 +671,15 @@ def extract_embryo_from_image(img, config):
     img_th = vision.apply_in_range_threshold(img_bl, config.annotation_scissor_gray_level, config.annotation_embryo_gray_level_1)
     if config.annotation_flag_save_image:
         vision.save_image(img_th, str(config.annotation_embryo_counter)+'_th', config.annotation_embryo_directory)
-    # seprating embryo from the background
-    labels, areas = vision.find_connected_components(img_th)
-    if len(areas) == 0:
-        return None, None, False, config.annotation_err_no_areas
-    elif np.max(areas) < config.annotation_area_value_min:
-        return None, None, False, config.annotation_err_no_areas
-    area_max_idx = np.argmax(areas)
-    img_desired = np.zeros(labels.shape, dtype=np.uint8)
-    img_desired[labels == area_max_idx + 1] = config.annotation_white_level
+    # seprating embryo from the background (the largest blob)
+    img_desired, bbox, area = vision.extract_largest_component(img_th, config.annotation_white_level)
+    if bbox is None:
+        return None, None, None, False, config.annotation_err_no_areas
+    elif area < config.annotation_area_value_min:
+        return None, None, None, False, config.annotation_err_no_areas
     if config.annotation_flag_save_image:
         vision.save_image(img_desired, str(config.annotation_embryo_counter)+'_ex', config.annotation_embryo_directory)
-    return img_desired, img_bl, True, None
+    return img_desired, img_bl, bbox, True, None
 
 
 def extract_scissor_from_image(img, config):
@@ -410,62 +692,41 @@ def extract_scissor_from_image(img, config):
     img_th = vision.apply_in_range_threshold(img_bl, 0, config.annotation_scissor_gray_level)
     if config.annotation_flag_save_image:
         vision.save_image(img_th, str(config.annotation_scissor_counter)+'_th', config.annotation_scissor_directory)
-    # seprating scissor from the background
-    labels, areas = vision.find_connected_components(img_th)
-    if len(areas) == 0:
-        return None, None, False, config.annotation_err_no_areas
-    elif np.max(areas) < config.annotation_area_value_min:
-        return None, None, False, config.annotation_err_no_areas
-    area_max_idx = np.argmax(areas)
-    img_desired = np.zeros(labels.shape, dtype=np.uint8)
-    img_desired[labels == area_max_idx + 1] = config.annotation_white_level
+    # seprating scissor from the background (the largest blob)
+    img_desired, bbox, area = vision.extract_largest_component(img_th, config.annotation_white_level)
+    if bbox is None:
+        return None, None, None, False, config.annotation_err_no_areas
+    elif area < config.annotation_area_value_min:
+        return None, None, None, False, config.annotation_err_no_areas
     if config.annotation_flag_save_image:
         vision.save_image(img_desired, str(config.annotation_scissor_counter)+'_ex', config.annotation_scissor_directory)
-    return img_desired, img_bl, True, None
+    return img_desired, img_bl, bbox, True, None
 
 
+@tracing.traced('vision')
+@metrics.annotation('embryo')
 def annotate_embryo(config, model):
     # taking the current image of the camera
     img_cam = normalize_image(config.camera_image)
     vision.save_image(img_cam, str(config.annotation_embryo_counter), config.annotation_embryo_directory)
     # extracting embryo from the image
-    img_th, img_bl, flag, err = extract_embryo_from_image(img_cam, config)
+    img_th, img_bl, bbox, flag, err = extract_embryo_from_image(img_cam, config)
     if flag == False:
         return flag, err
     if config.annotation_embryo_flag_cv_dn:     # deep network
         # processing the image to be fed to the deep network
-        img_th_cr, img_cr, x_cropped, y_cropped = vision.crop_image(img_th, img_cam, config.annotation_embryo_crop_offset)
+        img_th_cr, img_cr, x_cropped, y_cropped = vision.crop_image_by_bbox(img_th, img_cam, bbox, config.annotation_embryo_crop_offset)
         h_emb, w_emb = img_cr.shape
         img_rs = vision.resize_image_by_size(img_cr, config.dn_image_size, config.dn_image_size)
         img_in_arr = np.zeros((1, config.dn_image_size, config.dn_image_size, 1), dtype=np.float32)
         img_in_arr[0, :, :, 0] = np.float32(img_rs) / config.dn_white_level
-        img_out_arr = model.predict(img_in_arr, verbose=0)
-        # processing the output of the deep network
-        img_out = img_out_arr[0, :, :, 0]
-        img_out_rs = vision.resize_image_by_size(img_out, w_emb, h_emb)
-        if config.annotation_flag_save_image:
-            vision.save_image(img_out_rs*config.dn_white_level, str(config.annotation_embryo_counter)+'_dn_out', config.annotation_embryo_directory)
-        img_out_th = np.zeros(img_out_rs.shape)
-        img_out_th[img_out_rs > config.dn_threshold] = config.dn_white_level_normalized
-        if config.annotation_flag_save_image:
-            vision.save_image(img_out_th*config.dn_white_level, str(config.annotation_embryo_counter)+'_dn_th', config.annotation_embryo_directory)
-        # computing the annotation coordinates
-        ids = np.argwhere(img_out_th == config.dn_white_level_normalized)
-        if ids.size == 0:
+        with tracing.span('inference', 'inference'):
+            img_out_arr = model(img_in_arr)
+        # computing the annotation coordinates from the output of the deep network
+        x_arr, y_arr = calculate_dn_centerline_points(img_out_arr[0, :, :, 0], w_emb, h_emb, config, config.annotation_flag_save_image,
+                                                      str(config.annotation_embryo_counter), config.annotation_embryo_directory)
+        if x_arr is None:
             return False, config.dn_err_empty
-        top = ids[:, 0].min()
-        bottom = ids[:, 0].max()
-        y_arr = np.arange(bottom, top, -int(config.dn_somite_height_px))
-        x_arr = np.zeros(y_arr.shape, dtype=int)
-        for i in range(len(y_arr)):
-            y = y_arr[i]
-            id_closest = np.abs(ids[:, 0] - y).argmin()
-            y_closest = ids[id_closest, 0]
-            x_arr[i] = int(np.mean(ids[ids[:, 0]==y_closest][:, 1]))
-        if config.annotation_flag_save_image:
-            temp_points = [(int(x), int(y), (0, 0, 255)) for x, y in zip(x_arr, y_arr)]
-            img_drawn = vision.draw_points(np.float32(img_out_th*config.dn_white_level), temp_points, config.annotation_point_offset)
-            vision.save_image(img_drawn, str(config.annotation_embryo_counter)+'_dn_th_ann', config.annotation_embryo_directory)
         # converting the coordinates to match the dimensions of the full image
         x_arr = x_arr + x_cropped
         y_arr = y_arr + y_cropped
@@ -479,7 +740,7 @@ def annotate_embryo(config, model):
         return True, None
     else:   	# computer vision
         # cropping
-        img_th_cr, img_bl_cr, x_cropped, y_cropped = vision.crop_image(img_th, img_bl, config.annotation_embryo_crop_offset)
+        img_th_cr, img_bl_cr, x_cropped, y_cropped = vision.crop_image_by_bbox(img_th, img_bl, bbox, config.annotation_embryo_crop_offset)
         h_full, w_full = img_th_cr.shape
         if config.annotation_flag_save_image:
             vision.save_image(img_th_cr, str(config.annotation_embryo_counter)+'_th_cr', config.annotation_embryo_directory)
@@ -501,8 +762,7 @@ def annotate_embryo(config, model):
         if config.annotation_flag_save_image:
             vision.save_image(img_ed, str(config.annotation_embryo_counter)+'_ed', config.annotation_embryo_directory)
         # detecting the circles
-        img_crc, x_circle, y_circle = vision.detect_circles(img_ed, config.annotation_embryo_circle_dp,
-                                                            config.annotation_embryo_circle_param_1, config.annotation_embryo_circle_param_2, offset=config.annotation_point_offset)
+        img_crc, x_circle, y_circle = detect_embryo_circle(img_ed, x_full_centroid, y_full_centroid, config, config.annotation_flag_save_image)
         if (x_circle, y_circle) == (None, None):
             return False, config.annotation_embryo_err_no_circle
         if config.annotation_flag_save_image:
@@ -557,16 +817,18 @@ def annotate_embryo(config, model):
         return True, None
 
 
+@tracing.traced('vision')
+@metrics.annotation('scissor')
 def annotate_scissor(config):
     # taking the current image of the camera
     img_cam = normalize_image(config.camera_image)
     vision.save_image(img_cam, str(config.annotation_scissor_counter), config.annotation_scissor_directory)
     # extracting scissor from the image
-    img_th, img_bl, flag, err = extract_scissor_from_image(img_cam, config)
+    img_th, img_bl, bbox, flag, err = extract_scissor_from_image(img_cam, config)
     if flag == False:
         return flag, err
     # cropping
-    img_th_cr, img_bl_cr, x_cropped, y_cropped = vision.crop_image(img_th, img_bl, config.annotation_scissor_crop_offset)
+    img_th_cr, img_bl_cr, x_cropped, y_cropped = vision.crop_image_by_bbox(img_th, img_bl, bbox, config.annotation_scissor_crop_offset)
     h_full, w_full = img_th_cr.shape
     if config.annotation_flag_save_image:
         vision.save_image(img_th_cr, str(config.annotation_scissor_counter)+'_th_cr', config.annotation_scissor_directory)
@@ -583,39 +845,16 @@ def annotate_scissor(config):
     img_ed = vision.detect_edges(img_cl, config.annotation_edge_level_1, config.annotation_edge_level_2, config.annotation_edge_aperture_size, config.annotation_edge_l2_gradient)
     if config.annotation_flag_save_image:
         vision.save_image(img_ed, str(config.annotation_scissor_counter)+'_ed', config.annotation_scissor_directory)
-    # dividing the scissor into two parts (left and right)
-    img_left = img_ed[:, :x_full_centroid]
-    img_right = img_ed[:, x_full_centroid:]
-    # detecting lines in the left part
-    img_left_ann, points_left = vision.detect_lines(img_left, config.annotation_scissor_line_rho, config.annotation_scissor_line_theta,
-                                                    config.annotation_scissor_diagonal_line_vote, config.annotation_scissor_diagonal_line_length_min,
-                                                    config.annotation_scissor_diagonal_line_gap_max, config.annotation_scissor_diagonal_line_slope_min,
-                                                    config.annotation_scissor_diagonal_line_slope_max)
-    if points_left == None:
-        return False, config.annotation_scissor_err_no_line
+    # detecting the diagonal lines in the left and right parts and intersecting them
+    img_left_ann, img_right_ann, x_intersection, y_intersection, flag, err = detect_scissor_tip(img_ed, x_full_centroid, x_cropped, y_cropped, config,
+                                                                                                config.annotation_flag_save_image)
     if config.annotation_flag_save_image:
-        vision.save_image(img_left_ann, str(config.annotation_scissor_counter)+'_left_ann', config.annotation_scissor_directory)
-    # detecting lines in the right part
-    img_right_ann, points_right = vision.detect_lines(img_right, config.annotation_scissor_line_rho, config.annotation_scissor_line_theta,
-                                                      config.annotation_scissor_diagonal_line_vote, config.annotation_scissor_diagonal_line_length_min,   
-                                                      config.annotation_scissor_diagonal_line_gap_max, config.annotation_scissor_diagonal_line_slope_min,
-                                                      config.annotation_scissor_diagonal_line_slope_max)
-    if points_right == None:
-        return False, config.annotation_scissor_err_no_line
-    if config.annotation_flag_save_image:
-        vision.save_image(img_right_ann, str(config.annotation_scissor_counter)+'_right_ann', config.annotation_scissor_directory)
-    # converting the coordinates to match the dimensions of the full image
-    x1 = points_left[0] + config.annotation_scissor_diagonal_line_offset + x_cropped
-    x2 = points_left[2] + config.annotation_scissor_diagonal_line_offset + x_cropped
-    y1 = points_left[1] + y_cropped
-    y2 = points_left[3] + y_cropped
-    x3 = points_right[0] - config.annotation_scissor_diagonal_line_offset + x_full_centroid + x_cropped
-    x4 = points_right[2] - config.annotation_scissor_diagonal_line_offset + x_full_centroid + x_cropped
-    y3 = points_right[1] + y_cropped
-    y4 = points_right[3] + y_cropped
-    # calculating the intersection point
-    x_intersection = int(((x1*y2-y1*x2)*(x3-x4) - (x1-x2)*(x3*y4-y3*x4)) / ((x1-x2)*(y3-y4) - (y1-y2)*(x3-x4)))
-    y_intersection = int(((x1*y2-y1*x2)*(y3-y4) - (y1-y2)*(x3*y4-y3*x4)) / ((x1-x2)*(y3-y4) - (y1-y2)*(x3-x4)))
+        if img_left_ann is not None:
+            vision.save_image(img_left_ann, str(config.annotation_scissor_counter)+'_left_ann', config.annotation_scissor_directory)
+        if img_right_ann is not None:
+            vision.save_image(img_right_ann, str(config.annotation_scissor_counter)+'_right_ann', config.annotation_scissor_directory)
+    if flag == False:
+        return False, err
     if x_intersection < 0 or x_intersection > img_th.shape[1] or y_intersection < 0 or y_intersection > img_th.shape[0]:
         return False, config.annotation_scissor_err_no_intersection
     # processing the annotation points
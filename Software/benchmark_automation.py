@@ -0,0 +1,187 @@
+##############################################################################
+# File name:    benchmark_automation.py
+# Project:      Robotic Surgery Software
+# Part:         Benchmark of the automation
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file runs the automation of a whole plate headless on
+#               the simulated devices (synthetic or recorded frames) and
+#               reports the wells per hour, the time of every phase per
+#               well (annotation, approach, cut, retract, travel, saves)
+#               and their tails. The results are written as json and can
+#               be compared with the json of an earlier run. With --trace
+#               the timeline of the run is exported as a chrome trace.
+##############################################################################
+
+
+# Modules
+import worker_threads as wt
+import auxiliary as aux
+import configuration
+import simulation
+import tracking
+import tracing
+import numpy as np
+import collections
+import threading
+import argparse
+import tempfile
+import json
+import time
+import os
+
+
+def get_stats(values):
+    values = np.array(values, dtype=float)
+    if values.size == 0:
+        return None
+    return {'count': int(values.size), 'mean': float(np.mean(values)), 'median': float(np.median(values)),
+            'p95': float(np.percentile(values, 95)), 'p99': float(np.percentile(values, 99)), 'max': float(np.max(values))}
+
+
+def run_automation(config, frames, flag_calibrate, flag_trace):
+    '''
+    running the camera worker in a thread and the calibration (optional) and automation workers in this thread
+    the times are the times of the rig (aux.get_time), so the result does not depend on sim_time_scale as long as the
+    camera keeps up with the automation.
+    '''
+
+    smaract, asm, pistage, gamepad, camera = simulation.create_devices(config, frames)
+    asm.set_delay(config.asm_delay_ms)
+    if flag_trace:
+        tracing.enable(config.trace_max_events)
+        smaract, asm, pistage, camera = [tracing.TracedDevice(device, category) for device, category in
+                                         [(smaract, 'smaract'), (asm, 'asm'), (pistage, 'pistage'), (camera, 'camera')]]
+    tip_tracker = tracking.ToolTipTracker(config)
+    worker_camera = wt.WorkerCamera(camera, config, tip_tracker)
+    config.camera_flag_off = False
+    thread_camera = threading.Thread(target=worker_camera.run, daemon=True)
+    thread_camera.start()
+    while not isinstance(config.camera_image, np.ndarray):      # no frame yet
+        time.sleep(config.servo_poll_time_s)
+    messages = collections.Counter()
+    if flag_calibrate:
+        worker_calibration = wt.WorkerCalibration(smaract, config)
+        worker_calibration.signals.progress_text_edit.connect(lambda text, mode: print(text))
+        worker_calibration.run()
+    model = None
+    if config.automation_flag_cv_dn:
+        import inference
+        model = inference.create_inference_engine(config)
+    worker = wt.WorkerAutomation(smaract, asm, pistage, camera, config, model, tip_tracker)
+    # the errors are counted and the summaries of the run printed
+    worker.signals.progress_text_edit.connect(lambda text, mode: messages.update([text]) if mode == config.text_edit_mode_err else None)
+    time_start, time_real_start = aux.get_time(), time.perf_counter()
+    worker.run()
+    time_total, time_real = aux.get_time() - time_start, time.perf_counter() - time_real_start
+    config.camera_flag_off = True
+    thread_camera.join()
+    tracing.disable()
+    return worker, tip_tracker, camera.scene.num_frames, messages, time_total, time_real
+
+
+def create_report(config, args, worker, tip_tracker, num_frames, messages, time_total, time_real):
+    times = np.array([times for times, flag_dissected in worker.well_log]).reshape(-1, len(config.automation_phases))
+    report = {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'settings': {'wells': [config.automation_num_l1, config.automation_num_l2], 'frames': args.frames or 'synthetic',
+                           'time_scale': config.sim_time_scale, 'cv_dn': config.automation_flag_cv_dn, 'calibrated': args.calibrate,
+                           'servo': config.servo_flag_enabled, 'tip_tracker': config.tip_tracker_flag_enabled},
+              'wells': len(worker.well_log),
+              'wells_dissected': int(sum(flag_dissected for times_well, flag_dissected in worker.well_log)),
+              'time_total_s': time_total,
+              'time_real_s': time_real,
+              'wells_per_hour': 3600 * len(worker.well_log) / time_total,
+              'camera_fps': num_frames / time_total,
+              'well_s': get_stats(np.sum(times, axis=1)),
+              'phases_s': {phase: get_stats(times[:, i]) for i, phase in enumerate(config.automation_phases)},
+              'errors': dict(messages)}
+    if len(worker.servo_log) > 0:
+        iterations, times_servo, errors, converged = zip(*worker.servo_log)
+        report['servo'] = {'iterations': get_stats(iterations), 'error_px': get_stats(errors), 'converged': int(sum(converged))}
+    report['tip_tracker'] = {'frames': tip_tracker.num_frames, 'losses': tip_tracker.num_losses}
+    return report
+
+
+def print_report(report):
+    print('{:d} wells ({:d} dissected) in {:.1f} s of the rig ({:.1f} s real): {:.0f} wells/hour, camera at {:.1f} fps'.format(
+          report['wells'], report['wells_dissected'], report['time_total_s'], report['time_real_s'], report['wells_per_hour'], report['camera_fps']))
+    print('{:12s} {:>8s} {:>8s} {:>8s} {:>8s} {:>8s}'.format('[s]', 'mean', 'median', 'p95', 'p99', 'max'))
+    for name, stats in [('well', report['well_s'])] + list(report['phases_s'].items()):
+        if stats is not None:
+            print('{:12s} {:8.3f} {:8.3f} {:8.3f} {:8.3f} {:8.3f}'.format(name, stats['mean'], stats['median'], stats['p95'], stats['p99'], stats['max']))
+    for err, count in report['errors'].items():
+        print('{:3d}x {}'.format(count, err))
+
+
+def compare_reports(report, baseline, tolerance, time_min_s):
+    '''
+    printing the median and p95 of the well and of every phase against the baseline, a phase is a regression if it is
+    slower by more than the tolerance and by more than time_min_s (such that the noise of the short phases is ignored)
+    the camera is slower in rig time if it does not keep up with the time scale, so runs should use the same settings.
+    '''
+
+    if report['settings'] != baseline.get('settings'):
+        print('the settings differ from the baseline: {}'.format(baseline.get('settings')))
+    regressions = []
+    names = [('well', report['well_s'], baseline.get('well_s'))]
+    names = names + [(phase, stats, baseline.get('phases_s', {}).get(phase)) for phase, stats in report['phases_s'].items()]
+    print('against {} ({:.0f} wells/hour):'.format(baseline.get('date'), baseline.get('wells_per_hour', 0)))
+    for name, stats, stats_baseline in names:
+        if stats is None or stats_baseline is None:
+            continue
+        for key in ['median', 'p95']:
+            value, value_baseline = stats[key], stats_baseline[key]
+            flag_regression = value > value_baseline * (1 + tolerance) and value - value_baseline > time_min_s
+            print('{:12s} {:6s} {:8.3f} s vs {:8.3f} s{}'.format(name, key, value, value_baseline, '  REGRESSION' if flag_regression else ''))
+            if flag_regression:
+                regressions.append(name + ' ' + key)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark of the automation of a plate on the simulated devices')
+    parser.add_argument('--wells', type=int, nargs=2, default=None, help='wells in the l1 and l2 directions (default: configuration)')
+    parser.add_argument('--time-scale', type=float, default=0.1, help='real time per simulated time (the camera falls behind if too small)')
+    parser.add_argument('--frames', default=None, help='directory of recorded automation frames replayed per well (default: synthetic frames)')
+    parser.add_argument('--cv-dn', type=int, default=None, help='0: computer vision, 1: deep network (default: configuration)')
+    parser.add_argument('--calibrate', action='store_true', help='calibrating the pixel to stage transform on the simulator first')
+    parser.add_argument('--output', default='./benchmarks/automation.json')
+    parser.add_argument('--baseline', default=None, help='json of an earlier run to compare with')
+    parser.add_argument('--trace', default=None, help='path of a chrome trace of the run (device calls, vision stages, saves, sleeps)')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative slowdown reported as a regression')
+    parser.add_argument('--time-min', type=float, default=0.05, help='s, absolute slowdown below which nothing is reported')
+    args = parser.parse_args()
+    if args.frames is not None and args.calibrate:
+        parser.error('the calibration needs the synthetic frames (the scissor of a recorded frame does not move)')
+    config = configuration.Configuration()
+    config.sim_time_scale = args.time_scale
+    if args.wells is not None:
+        config.automation_num_l1, config.automation_num_l2 = args.wells
+    if args.cv_dn is not None:
+        config.automation_flag_cv_dn = args.cv_dn
+    directory = tempfile.mkdtemp(prefix='benchmark_automation_')
+    config.automation_directory = os.path.join(directory, '')
+    config.calibration_directory = os.path.join(directory, '')
+    frames = None
+    if args.frames is not None:
+        frames = simulation.load_frames(args.frames)
+        # the scissor of a recorded frame does not follow the smaract, so only the open-loop move is done
+        config.servo_flag_enabled = False
+        config.tip_tracker_flag_enabled = False
+    report = create_report(config, args, *run_automation(config, frames, args.calibrate, args.trace is not None))
+    print_report(report)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=4)
+    print('written to ' + args.output + ' (images in ' + directory + ')')
+    if args.trace is not None:
+        print('{:d} spans written to {}'.format(tracing.export_chrome_trace(args.trace), args.trace))
+        summary = sorted(tracing.get_summary().items(), key=lambda item: -item[1][1])
+        for name, (count, total, maximum) in summary[:10]:
+            print('{:45s} {:6d} calls {:8.3f} s total {:8.3f} s max'.format(name, count, total, maximum))
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            regressions = compare_reports(report, json.load(file), args.tolerance, args.time_min)
+        if len(regressions) > 0:
+            raise SystemExit('regressions: ' + ', '.join(regressions))
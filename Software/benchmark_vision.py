@@ -0,0 +1,551 @@
+##############################################################################
+# File name:    benchmark_vision.py
+# Project:      Robotic Surgery Software
+# Part:         Benchmarks of the computer vision methods
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file measures the execution time of the computer
+#               vision methods used in the annotation and compares them
+#               with the implementations they replaced. It also measures
+#               the memory allocated per frame by the automation chain and
+#               compares the circle fits of the embryo and the line fits of
+#               the scissor tip with hough, and the scissor annotation with
+#               and without the tip cache and the tip tracker. It also
+#               prepares the corpus, the inputs and the cases of the time
+#               and peak memory suite of every function of
+#               computer_vision.py and of the annotation pipelines
+#               (test_benchmark_vision.py, run by pytest-benchmark).
+##############################################################################
+
+
+# Modules
+import computer_vision as vision
+import auxiliary as aux
+import configuration
+import tracking
+import numpy as np
+import cv2 as cv
+import argparse
+import tracemalloc
+import glob
+import timeit
+import copy
+import time
+
+
+def measure_time_ms(function, number, repeat):
+    '''
+    returning the best average execution time of the function in ms
+    '''
+
+    return 1000 * min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def create_tube_mask(size):
+    '''
+    creating a tilted tube-like mask similar to the thresholded output of the deep network
+    '''
+
+    img = np.zeros((size, size))
+    cv.ellipse(img=img, center=(size//2, size//2), axes=(size//10, int(0.45*size)), angle=10, startAngle=0, endAngle=360,
+               color=1, thickness=-1)
+    return img
+
+
+def create_frame(seed, x_tip, y_tip, x_emb, y_emb, size=1200):
+    '''
+    creating a synthetic camera frame with an embryo (chorion, yolk and body) and the opened scissor above it
+    '''
+
+    img = np.full((size, size), 220, dtype=np.uint8)
+    cv.circle(img=img, center=(x_emb, y_emb), radius=300, color=160, thickness=-1)
+    cv.ellipse(img=img, center=(x_emb, y_emb+120), axes=(90, 140), angle=0, startAngle=0, endAngle=360, color=100, thickness=-1)
+    cv.ellipse(img=img, center=(x_emb, y_emb-120), axes=(40, 120), angle=0, startAngle=0, endAngle=360, color=130, thickness=-1)
+    for sign in [-1, 1]:
+        blade = np.array([[x_tip, y_tip], [x_tip+sign*200, y_tip-700], [x_tip+sign*60, y_tip-700]], dtype=np.int32)
+        cv.fillPoly(img=img, pts=[blade], color=15)
+    noise = np.random.default_rng(seed).normal(0, 3, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+def calculate_centerline_points_reference(img, step):
+    '''
+    previous implementation of the somite sampling (one argmin over all mask pixels per sample)
+    '''
+
+    ids = np.argwhere(img == 1)
+    if ids.size == 0:
+        return None, None
+    top = ids[:, 0].min()
+    bottom = ids[:, 0].max()
+    y_arr = np.arange(bottom, top, -int(step))
+    x_arr = np.zeros(y_arr.shape, dtype=int)
+    for i in range(len(y_arr)):
+        y = y_arr[i]
+        id_closest = np.abs(ids[:, 0] - y).argmin()
+        y_closest = ids[id_closest, 0]
+        x_arr[i] = int(np.mean(ids[ids[:, 0]==y_closest][:, 1]))
+    return x_arr, y_arr
+
+
+def benchmark_centerline(sizes, step, number, repeat):
+    print('centerline points (step: {:d} px)'.format(step))
+    for size in sizes:
+        img = create_tube_mask(size)
+        x_ref, y_ref = calculate_centerline_points_reference(img, step)
+        x_new, y_new = vision.calculate_centerline_points(img, step)
+        equal = np.array_equal(x_ref, x_new) and np.array_equal(y_ref, y_new)
+        time_ref = measure_time_ms(lambda: calculate_centerline_points_reference(img, step), number, repeat)
+        time_new = measure_time_ms(lambda: vision.calculate_centerline_points(img, step), number, repeat)
+        print('  {:5d}x{:<5d} points: {:4d}  reference: {:9.2f} ms  vectorized: {:7.2f} ms  speedup: {:7.1f}x  equal: {}'.format(
+              size, size, len(y_new), time_ref, time_new, time_ref / time_new, equal))
+
+
+def run_automation_chain(img, config, roi_tracker, workspace):
+    img_bl, img_th_emb, bbox_emb, img_th_scs, bbox_scs, flag, err = aux.automation_extract_from_image(img, config, roi_tracker,
+                                                                                                     workspace or vision.Workspace())
+    if flag == False:
+        return flag
+    config.annotation_points = []
+    flag, err = aux.automation_annotate_embryo(img, img_bl, img_th_emb, bbox_emb, config, None, None, workspace)
+    if flag == False:
+        return flag
+    flag, err = aux.automation_annotate_scissor(img_bl, img_th_scs, bbox_scs, config, workspace)
+    return flag
+
+
+def benchmark_allocations(num_frames, num_warm_up):
+    '''
+    measuring the memory allocated per frame by the computer vision automation chain (extraction and annotation)
+    with a workspace the buffers are allocated during the warm-up only, without it every step allocates its output.
+    '''
+
+    config = configuration.Configuration()
+    frames = [aux.normalize_image(create_frame(i, 560+(i%5)*7, 500-(i%5)*5, 620-(i%5)*9, 820+(i%5)*4))
+              for i in range(num_warm_up+num_frames)]
+    print('allocations of the automation chain per frame ({:d} frames after {:d} warm-up frames)'.format(num_frames, num_warm_up))
+    for name, workspace in [('new arrays', None), ('workspace', vision.Workspace())]:
+        roi_tracker = tracking.RoiTracker(config)
+        for img in frames[:num_warm_up]:
+            run_automation_chain(img, config, roi_tracker, workspace)
+        peaks, retained, times = [], [], []
+        tracemalloc.start()
+        for img in frames[num_warm_up:]:
+            tracemalloc.reset_peak()
+            current_start, _ = tracemalloc.get_traced_memory()
+            time_start = time.perf_counter()
+            flag = run_automation_chain(img, config, roi_tracker, workspace)
+            times.append(1000 * (time.perf_counter() - time_start))
+            current_end, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - current_start)
+            retained.append(current_end - current_start)
+        tracemalloc.stop()
+        print('  {:10s}  peak allocated: {:8.2f} MB  retained: {:6.3f} MB  time: {:6.2f} ms  annotated: {}'.format(
+              name, np.mean(peaks) / 2**20, np.mean(retained) / 2**20, np.mean(times), flag))
+
+
+def prepare_embryo_edges(img, config):
+    '''
+    running the automation chain up to the edge image of the embryo crop (the input of the circle detection)
+    '''
+
+    workspace = vision.Workspace()
+    img_bl, img_th_emb, bbox, _, _, flag, err = aux.automation_extract_from_image(img, config, tracking.RoiTracker(config), workspace)
+    if flag == False:
+        return None
+    img_th_cr, _, x_cropped, y_cropped = vision.crop_image_by_bbox(img_th_emb, img_bl, bbox, config.annotation_embryo_crop_offset)
+    img_fl = vision.fill_image(img_th_cr, config.annotation_embryo_fill_offset, config.annotation_white_level)
+    img_cl = vision.apply_closing(img_fl, config.annotation_closing_kernel_size, config.annotation_closing_iterations)
+    x_seed, y_seed = vision.calculate_centroid(img_cl)
+    img_ed = vision.detect_edges(img_cl, config.annotation_edge_level_1, config.annotation_edge_level_2, config.annotation_edge_aperture_size,
+                                 config.annotation_edge_l2_gradient)
+    return img_ed, x_seed, y_seed, x_cropped, y_cropped
+
+
+def benchmark_circles(pattern, num_frames, number, repeat):
+    '''
+    comparing the circle fits with hough on archived frames (glob pattern) or on synthetic frames with a known center
+    the error is measured against the known center of the synthetic frames, or against hough for the archived frames.
+    '''
+
+    config = configuration.Configuration()
+    if pattern is None:
+        frames = []
+        for i in range(num_frames):
+            x_emb, y_emb = 620-(i%5)*9, 820+(i%5)*4
+            frames.append((create_frame(i, 560+(i%5)*7, 500-(i%5)*5, x_emb, y_emb), (x_emb, y_emb)))
+    else:
+        frames = [(cv.imread(path, cv.IMREAD_GRAYSCALE), None) for path in sorted(glob.glob(pattern))[:num_frames]]
+    methods = [('hough', config.annotation_embryo_circle_method_hough), ('least squares', config.annotation_embryo_circle_method_least_squares),
+               ('ransac', config.annotation_embryo_circle_method_ransac)]
+    results = {name: {'times': [], 'errors': [], 'failures': 0, 'deterministic': True} for name, _ in methods}
+    for img, center in frames:
+        edges = prepare_embryo_edges(aux.normalize_image(img), config)
+        if edges is None:
+            continue
+        img_ed, x_seed, y_seed, x_cropped, y_cropped = edges
+        for name, method in methods:
+            config.annotation_embryo_circle_method = method
+            detect = lambda: aux.detect_embryo_circle(img_ed, x_seed, y_seed, config, False)
+            _, x_circle, y_circle = detect()
+            results[name]['times'].append(measure_time_ms(detect, number, repeat))
+            results[name]['deterministic'] = results[name]['deterministic'] and detect()[1:] == (x_circle, y_circle)
+            if x_circle is None:
+                results[name]['failures'] = results[name]['failures'] + 1
+                continue
+            if center is None:
+                if name == 'hough':
+                    center = (x_circle + x_cropped, y_circle + y_cropped)
+                    continue
+                if center is None:
+                    continue
+            results[name]['errors'].append(np.hypot(x_circle + x_cropped - center[0], y_circle + y_cropped - center[1]))
+    print('embryo circle ({:d} {} frames, error against the {})'.format(len(frames), 'synthetic' if pattern is None else 'archived',
+                                                                       'known center' if pattern is None else 'hough center'))
+    for name, _ in methods:
+        result = results[name]
+        errors = result['errors'] if result['errors'] else [np.nan]
+        print('  {:13s}  time: {:7.2f} ms  error: mean {:5.2f} px, max {:5.2f} px  failures: {:d}  deterministic: {}'.format(
+              name, np.mean(result['times']), np.mean(errors), np.max(errors), result['failures'], result['deterministic']))
+
+
+def prepare_scissor_edges(img, config):
+    '''
+    running the automation chain up to the edge image of the scissor crop (the input of the line detection)
+    '''
+
+    workspace = vision.Workspace()
+    img_bl, _, _, img_th_scs, bbox, flag, err = aux.automation_extract_from_image(img, config, tracking.RoiTracker(config), workspace)
+    if flag == False:
+        return None
+    img_th_cr, _, x_cropped, y_cropped = vision.crop_image_by_bbox(img_th_scs, img_bl, bbox, config.annotation_scissor_crop_offset)
+    img_cl = vision.apply_closing(img_th_cr, config.annotation_closing_kernel_size, config.annotation_closing_iterations)
+    x_split, _ = vision.calculate_centroid(img_cl)
+    img_ed = vision.detect_edges(img_cl, config.annotation_edge_level_1, config.annotation_edge_level_2, config.annotation_edge_aperture_size,
+                                 config.annotation_edge_l2_gradient)
+    return img_ed, x_split, x_cropped, y_cropped
+
+
+def benchmark_scissor_tip(pattern, num_frames, number, repeat):
+    '''
+    comparing the line fit of the scissor tip with hough on archived frames (glob pattern) or on synthetic frames
+    the error is measured against the known tip of the synthetic frames (moved by the line offset as in the annotation),
+    or against hough for the archived frames. the spread is the deviation from the mean tip over noisy copies of a frame.
+    '''
+
+    config = configuration.Configuration()
+    # the lines are moved inwards by the offset, so the intersection of the synthetic blade edges moves up
+    rise = config.annotation_scissor_diagonal_line_offset * 700 / 200
+    if pattern is None:
+        frames = []
+        for i in range(num_frames):
+            x_tip, y_tip = 560+(i%5)*7, 500-(i%5)*5
+            frames.append((create_frame(i, x_tip, y_tip, 620-(i%5)*9, 820+(i%5)*4), (x_tip, y_tip - rise)))
+    else:
+        frames = [(cv.imread(path, cv.IMREAD_GRAYSCALE), None) for path in sorted(glob.glob(pattern))[:num_frames]]
+    methods = [('hough', config.annotation_scissor_line_method_hough), ('ransac + pca', config.annotation_scissor_line_method_ransac)]
+    results = {name: {'times': [], 'errors': [], 'uncertainties': [], 'failures': 0} for name, _ in methods}
+    for img, tip in frames:
+        edges = prepare_scissor_edges(aux.normalize_image(img), config)
+        if edges is None:
+            continue
+        img_ed, x_split, x_cropped, y_cropped = edges
+        for name, method in methods:
+            config.annotation_scissor_line_method = method
+            detect = lambda: aux.detect_scissor_tip(img_ed, x_split, x_cropped, y_cropped, config, False)
+            _, _, x_tip, y_tip, flag, err = detect()
+            results[name]['times'].append(measure_time_ms(detect, number, repeat))
+            if flag == False:
+                results[name]['failures'] = results[name]['failures'] + 1
+                continue
+            if config.annotation_scissor_tip_uncertainty is not None:
+                results[name]['uncertainties'].append(config.annotation_scissor_tip_uncertainty)
+            if tip is None:
+                if name == 'hough':
+                    tip = (x_tip, y_tip)
+                continue
+            results[name]['errors'].append(np.hypot(x_tip - tip[0], y_tip - tip[1]))
+    print('scissor tip ({:d} {} frames, error against the {})'.format(len(frames), 'synthetic' if pattern is None else 'archived',
+                                                                     'known tip' if pattern is None else 'hough tip'))
+    for name, _ in methods:
+        result = results[name]
+        errors = result['errors'] if result['errors'] else [np.nan]
+        uncertainty = '{:5.2f} px'.format(np.mean(result['uncertainties'])) if result['uncertainties'] else '    -   '
+        print('  {:13s}  time: {:7.2f} ms  error: mean {:5.2f} px, max {:5.2f} px  uncertainty: {}  failures: {:d}'.format(
+              name, np.mean(result['times']), np.mean(errors), np.max(errors), uncertainty, result['failures']))
+    # stability: the same scene with independent camera noise
+    if pattern is None:
+        for name, method in methods:
+            config.annotation_scissor_line_method = method
+            tips = []
+            for seed in range(num_frames):
+                edges = prepare_scissor_edges(aux.normalize_image(create_frame(100+seed, 560, 500, 620, 820)), config)
+                if edges is not None:
+                    _, _, x_tip, y_tip, flag, _ = aux.detect_scissor_tip(*edges, config, False)
+                    if flag:
+                        tips.append((x_tip, y_tip))
+            spread = np.max(np.hypot(*(np.array(tips) - np.mean(tips, axis=0)).T)) if tips else np.nan
+            print('  {:13s}  spread over {:d} noisy copies: {:5.2f} px'.format(name, len(tips), spread))
+
+
+def benchmark_tip_cache(num_frames, drift):
+    '''
+    measuring the scissor annotation with and without the tip cache on synthetic wells at the same smaract pose
+    (the embryo moves between the wells, the scissor does not) and checking that a drift of the scissor is detected
+    '''
+
+    config = configuration.Configuration()
+    pose = (0, 0, 0)
+    x_tip, y_tip = 560, 500
+    frames = [aux.normalize_image(create_frame(i, x_tip, y_tip, 620-(i%5)*9, 820+(i%5)*4)) for i in range(num_frames)]
+    print('scissor tip cache ({:d} synthetic wells at the same pose)'.format(num_frames))
+    tips_ref = []
+    for name, cache in [('no cache', None), ('cache', tracking.ToolTipCache(config))]:
+        roi_tracker = tracking.RoiTracker(config)
+        workspace = vision.Workspace()
+        times, tips = [], []
+        for img in frames:
+            img_bl, _, _, img_th_scs, bbox_scs, flag, err = aux.automation_extract_from_image(img, config, roi_tracker, workspace)
+            config.annotation_points = []
+            time_start = time.perf_counter()
+            flag, err = aux.automation_annotate_scissor(img_bl, img_th_scs, bbox_scs, config, workspace, cache, pose)
+            times.append(1000 * (time.perf_counter() - time_start))
+            tips.append(config.annotation_scissor_points[-1][:2] if flag else None)
+        if cache is None:
+            tips_ref = tips
+            print('  {:10s}  time: {:6.2f} ms per well'.format(name, np.mean(times)))
+        else:
+            print('  {:10s}  time: {:6.2f} ms per well  hits: {:d}/{:d}  same tips: {}'.format(
+                  name, np.mean(times), cache.num_hits, cache.num_checks, tips == [tips_ref[0]]*num_frames))
+    # a scissor that drifted at the same pose has to be detected again
+    img_drifted = aux.normalize_image(create_frame(num_frames, x_tip+drift, y_tip, 620, 820))
+    img_bl, _, _, img_th_scs, bbox_scs, flag, err = aux.automation_extract_from_image(img_drifted, config, tracking.RoiTracker(config), vision.Workspace())
+    config.annotation_points = []
+    aux.automation_annotate_scissor(img_bl, img_th_scs, bbox_scs, config, vision.Workspace(), cache, pose)
+    print('  drift of {:d} px detected: {} (tip {} -> {})'.format(drift, config.annotation_scissor_points[-1][:2] != tips_ref[0],
+                                                                tips_ref[0], config.annotation_scissor_points[-1][:2]))
+
+
+def benchmark_tip_tracker(num_frames, step):
+    '''
+    tracking the scissor tip on synthetic camera frames while the scissor moves by step px per frame (as in the camera
+    thread: the tip is detected again when it is lost or the anchor is too old) and comparing with a full detection
+    '''
+
+    config = configuration.Configuration()
+    rise = config.annotation_scissor_diagonal_line_offset * 700 / 200
+    tracker = tracking.ToolTipTracker(config)
+    workspace = vision.Workspace()
+    times_track, times_detect, errors, num_anchors = [], [], [], 0
+    for i in range(num_frames):
+        # the scissor moves down and to the right towards the embryo
+        x_tip, y_tip = 500 + step*i*0.6, 400 + step*i*0.8
+        img = create_frame(i, int(round(x_tip)), int(round(y_tip)), 620, 850)
+        time_start = time.perf_counter()
+        x_detected, y_detected, flag, err = aux.locate_scissor_tip_in_frame(img, config, workspace)
+        times_detect.append(1000 * (time.perf_counter() - time_start))
+        if tracker.needs_anchor():
+            num_anchors = num_anchors + 1
+            if flag:
+                tracker.anchor(img, (x_detected, y_detected))
+            continue
+        time_start = time.perf_counter()
+        tip, score = tracker.track(img)
+        times_track.append(1000 * (time.perf_counter() - time_start))
+        if tip is not None:
+            errors.append(np.hypot(tip[0] - round(x_tip), tip[1] - (round(y_tip) - rise)))
+    errors = errors if errors else [np.nan]
+    print('scissor tip tracker ({:d} synthetic frames, {:.1f} px per frame)'.format(num_frames, step))
+    print('  full detection  time: {:6.2f} ms per frame'.format(np.mean(times_detect)))
+    print('  tracking        time: {:6.2f} ms per frame  error: mean {:5.2f} px, max {:5.2f} px  anchors: {:d}  lost: {:d}/{:d}'.format(
+          np.mean(times_track), np.mean(errors), np.max(errors), num_anchors, tracker.num_losses, tracker.num_frames))
+
+
+def scale_configuration(config, size):
+    '''
+    returning a copy of the configuration with the pixel sizes of the annotation (offsets, kernels, lengths, tolerances
+    and areas tuned for camera_width) scaled to frames of size px, such that the chain runs at every size of the suite
+    the fill offset is kept, since it is the border of the flood-fill mask.
+    '''
+
+    scale = size / config.camera_width
+    config_scaled = copy.copy(config)
+    for name in ['annotation_embryo_crop_middle_offset', 'annotation_embryo_crop_offset', 'annotation_embryo_circle_fit_slack',
+                 'annotation_embryo_circle_points_min', 'annotation_scissor_crop_offset', 'annotation_scissor_diagonal_line_offset',
+                 'annotation_scissor_diagonal_line_vote', 'annotation_scissor_diagonal_line_length_min', 'annotation_scissor_diagonal_line_gap_max',
+                 'annotation_scissor_line_points_min', 'roi_padding', 'roi_margin']:
+        setattr(config_scaled, name, int(round(getattr(config, name) * scale)))
+    for name in ['annotation_embryo_circle_ransac_tolerance', 'annotation_scissor_line_ransac_tolerance', 'annotation_scissor_tip_uncertainty_max']:
+        setattr(config_scaled, name, max(getattr(config, name) * scale, 1))
+    # the kernels stay odd
+    for name in ['annotation_closing_kernel_size', 'annotation_embryo_openning_kernel_size', 'annotation_blurring_kernel_size']:
+        setattr(config_scaled, name, 2 * max(int(round((getattr(config, name) * scale - 1) / 2)), 1) + 1)
+    config_scaled.annotation_blurring_sigma_x = config.annotation_blurring_sigma_x * scale
+    config_scaled.annotation_area_value_min = int(round(config.annotation_area_value_min * scale**2))
+    config_scaled.annotation_points = []
+    return config_scaled
+
+
+def create_corpus(pattern, num_frames, sizes):
+    '''
+    creating the frames of the suite: synthetic frames and archived frames (glob pattern, optional), all mono8 and resized
+    from their camera resolution to every size
+    '''
+
+    frames = [('synthetic', create_frame(i, 560+(i%5)*7, 500-(i%5)*5, 620-(i%5)*9, 820+(i%5)*4)) for i in range(num_frames)]
+    if pattern is not None:
+        frames = frames + [('archived', cv.imread(path, cv.IMREAD_GRAYSCALE)) for path in sorted(glob.glob(pattern))[:num_frames]]
+    corpus = []
+    for name, img in frames:
+        for size in sizes:
+            corpus.append((name, size, img if img.shape == (size, size) else vision.resize_image_by_size(img, size, size)))
+    return corpus
+
+
+def prepare_inputs(img, config):
+    '''
+    running the annotation chain once on the frame and keeping the intermediate images as the inputs of the functions
+    the inputs of a stage are missing if the chain fails before it.
+    '''
+
+    inputs = {'img': img, 'img_nr': aux.normalize_image(img)}
+    # a mask like the thresholded output of the deep network for the embryo crop
+    inputs['img_dn'] = np.uint8(create_tube_mask(config.dn_image_size) * config.dn_white_level_normalized)
+    img_bl, img_th_emb, bbox_emb, img_th_scs, bbox_scs, flag, err = aux.automation_extract_from_image(inputs['img_nr'], config,
+                                                                                                     tracking.RoiTracker(config), vision.Workspace())
+    if flag == False:
+        return inputs
+    inputs.update({'img_bl': img_bl.copy(), 'img_th_emb': img_th_emb.copy(), 'bbox_emb': bbox_emb, 'img_th_scs': img_th_scs.copy(), 'bbox_scs': bbox_scs})
+    img_th_cr, _, _, _ = vision.crop_image_by_bbox(img_th_emb, img_bl, bbox_emb, config.annotation_embryo_crop_offset)
+    inputs['img_fl'] = vision.fill_image(img_th_cr, config.annotation_embryo_fill_offset, config.annotation_white_level)
+    inputs['img_cl'] = vision.apply_closing(inputs['img_fl'], config.annotation_closing_kernel_size, config.annotation_closing_iterations)
+    edges = prepare_embryo_edges(inputs['img_nr'], config)
+    if edges is not None and edges[1] is not None:
+        inputs['img_ed_emb'], inputs['x_seed'], inputs['y_seed'] = edges[:3]
+        y_arr, x_arr = np.nonzero(inputs['img_ed_emb'])
+        inputs['x_arr'], inputs['y_arr'] = np.float64(x_arr), np.float64(y_arr)
+    edges = prepare_scissor_edges(inputs['img_nr'], config)
+    if edges is not None and edges[1] is not None:
+        img_ed, x_split = edges[:2]
+        inputs['img_left'], inputs['img_right'] = img_ed[:, :x_split], img_ed[:, x_split:]
+        lines = [vision.fit_line(img_half, config.annotation_scissor_diagonal_line_slope_min, config.annotation_scissor_diagonal_line_slope_max,
+                                 config.annotation_scissor_diagonal_line_length_min, config.annotation_scissor_line_ransac_iterations,
+                                 config.annotation_scissor_line_ransac_tolerance, config.annotation_scissor_line_points_min,
+                                 config.annotation_scissor_line_ransac_points) for img_half in [inputs['img_left'], inputs['img_right']]]
+        if lines[0][0] is not None and lines[1][0] is not None:
+            inputs['lines'] = lines
+    return inputs
+
+
+def annotate(config, function, *args):
+    config.annotation_points = []
+    return function(*args)
+
+
+def create_cases(config, inputs, model, directory):
+    '''
+    returning (name, function without arguments) for every function of computer_vision.py and the annotation pipelines
+    whose inputs exist for the frame, and the names of the functions whose inputs are missing
+    the functions are grouped by the input they need, the lambdas only read the inputs when they are called.
+    '''
+
+    c, i = config, inputs
+    offset = c.annotation_embryo_crop_offset
+    groups = {}
+    groups[None] = [('normalize_image', lambda: aux.normalize_image(i['img'])),
+             ('resize_image_by_percentage', lambda: vision.resize_image_by_percentage(i['img_nr'], 50)),
+             ('resize_image_by_size', lambda: vision.resize_image_by_size(i['img_nr'], c.dn_image_size, c.dn_image_size)),
+             ('count_gray_levels', lambda: vision.count_gray_levels(i['img_nr'])),
+             ('apply_blurring', lambda: vision.apply_blurring(i['img_nr'], c.annotation_blurring_kernel_size, c.annotation_blurring_sigma_x)),
+             ('get_structuring_element', lambda: vision.get_structuring_element(c.annotation_closing_kernel_size)),
+             ('workspace_get_buffer', lambda: vision.Workspace().get_buffer('img', i['img_nr'].shape)),
+             ('save_image', lambda: vision.save_image(i['img_nr'], 'suite', directory)),
+             ('calculate_centerline_points', lambda: vision.calculate_centerline_points(i['img_dn'], c.dn_somite_height_px, i['img_nr'].shape[::-1]))]
+    groups['img_bl'] = [
+             ('apply_in_range_threshold', lambda: vision.apply_in_range_threshold(i['img_bl'], c.annotation_scissor_gray_level, c.annotation_embryo_gray_level_1)),
+             ('find_connected_components', lambda: vision.find_connected_components(i['img_th_emb'])),
+             ('extract_largest_component', lambda: vision.extract_largest_component(i['img_th_emb'], c.annotation_white_level)),
+             ('resize_mask_by_size', lambda: vision.resize_mask_by_size(i['img_th_emb'], c.dn_image_size, c.dn_image_size)),
+             ('crop_image_old', lambda: vision.crop_image_old(i['img_th_emb'], i['img_bl'], offset)),
+             ('crop_image', lambda: vision.crop_image(i['img_th_emb'], i['img_bl'], offset)),
+             ('crop_image_by_bbox', lambda: vision.crop_image_by_bbox(i['img_th_emb'], i['img_bl'], i['bbox_emb'], offset)),
+             ('crop_image_with_black_offset', lambda: vision.crop_image_with_black_offset(i['img_th_emb'], i['img_bl'], offset)),
+             ('crop_image_with_fixed_size', lambda: vision.crop_image_with_fixed_size(i['img_th_emb'], i['img_bl'], max(i['bbox_emb'][2:]))),
+             ('fill_image', lambda: vision.fill_image(i['img_th_emb'], c.annotation_embryo_fill_offset, c.annotation_white_level)),
+             ('apply_closing', lambda: vision.apply_closing(i['img_fl'], c.annotation_closing_kernel_size, c.annotation_closing_iterations)),
+             ('apply_opening', lambda: vision.apply_opening(i['img_fl'], c.annotation_closing_kernel_size, c.annotation_closing_iterations)),
+             ('calculate_centroid', lambda: vision.calculate_centroid(i['img_cl'])),
+             ('detect_edges', lambda: vision.detect_edges(i['img_cl'], c.annotation_edge_level_1, c.annotation_edge_level_2,
+                                                          c.annotation_edge_aperture_size, c.annotation_edge_l2_gradient)),
+             ('draw_points', lambda: vision.draw_points(np.float32(i['img_nr']), [(100, 100, c.color_red)]*20, c.annotation_point_offset)),
+             ('automation_extract_from_image', lambda: aux.automation_extract_from_image(i['img_nr'], c, tracking.RoiTracker(c), vision.Workspace())),
+             ('automation_annotate_embryo_cv', lambda: annotate(c, aux.automation_annotate_embryo, i['img_nr'], i['img_bl'], i['img_th_emb'],
+                                                                i['bbox_emb'], c, None, None, vision.Workspace())),
+             ('automation_annotate_scissor', lambda: annotate(c, aux.automation_annotate_scissor, i['img_bl'], i['img_th_scs'], i['bbox_scs'],
+                                                              c, vision.Workspace()))]
+    # measured only with a model (config.automation_flag_cv_dn set by the caller)
+    groups['img_bl'].append(('automation_annotate_embryo_dn', lambda: annotate(c, aux.automation_annotate_embryo, i['img_nr'], i['img_bl'], i['img_th_emb'],
+                                                                               i['bbox_emb'], c, model, None, vision.Workspace())))
+    # radius band of the circle fit, from the width of the embryo edges
+    r_band = lambda ratio, sign: ratio*i['img_ed_emb'].shape[1]/2 + sign*c.annotation_embryo_circle_fit_slack
+    groups['img_ed_emb'] = [
+             ('detect_circles', lambda: vision.detect_circles(i['img_ed_emb'], c.annotation_embryo_circle_dp, c.annotation_embryo_circle_param_1,
+                                                              c.annotation_embryo_circle_param_2, c.annotation_point_offset, False)),
+             ('fit_circle_least_squares', lambda: vision.fit_circle_least_squares(i['x_arr'], i['y_arr'])),
+             ('fit_circle', lambda: vision.fit_circle(i['img_ed_emb'], i['x_seed'], i['y_seed'], r_band(c.annotation_embryo_circle_radius_ratio_min, -1),
+                                                      r_band(c.annotation_embryo_circle_radius_ratio_max, 1), True,
+                                                      c.annotation_embryo_circle_ransac_iterations, c.annotation_embryo_circle_ransac_tolerance,
+                                                      c.annotation_embryo_circle_points_min, c.annotation_embryo_circle_ransac_points)),
+             ('draw_circle', lambda: vision.draw_circle(i['img_ed_emb'], i['x_seed'], i['y_seed'], i['img_ed_emb'].shape[1]/2, c.annotation_point_offset))]
+    groups['img_left'] = [
+             ('detect_lines', lambda: vision.detect_lines(i['img_left'], c.annotation_scissor_line_rho, c.annotation_scissor_line_theta,
+                                                          c.annotation_scissor_diagonal_line_vote, c.annotation_scissor_diagonal_line_length_min,
+                                                          c.annotation_scissor_diagonal_line_gap_max, c.annotation_scissor_diagonal_line_slope_min,
+                                                          c.annotation_scissor_diagonal_line_slope_max, False)),
+             ('fit_line', lambda: vision.fit_line(i['img_left'], c.annotation_scissor_diagonal_line_slope_min, c.annotation_scissor_diagonal_line_slope_max,
+                                                  c.annotation_scissor_diagonal_line_length_min, c.annotation_scissor_line_ransac_iterations,
+                                                  c.annotation_scissor_line_ransac_tolerance, c.annotation_scissor_line_points_min,
+                                                  c.annotation_scissor_line_ransac_points))]
+    # ((line, errors) of the left half, (line, errors) of the right half)
+    groups['lines'] = [
+             ('intersect_lines', lambda: vision.intersect_lines(i['lines'][0][0], i['lines'][1][0])),
+             ('intersect_lines_with_uncertainty', lambda: vision.intersect_lines_with_uncertainty(*i['lines'][0], *i['lines'][1])),
+             ('draw_line', lambda: vision.draw_line(i['img_left'], i['lines'][0][0]))]
+    cases = [case for key, group in groups.items() if key is None or key in i for case in group]
+    names_missing = [name for key, group in groups.items() if key is not None and key not in i for name, _ in group]
+    return cases, names_missing
+
+
+def measure_peak_mb(function):
+    '''
+    returning the peak memory allocated through python and numpy by one call in MB (the internal buffers of opencv are not seen)
+    '''
+
+    tracemalloc.start()
+    current_start, _ = tracemalloc.get_traced_memory()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (peak - current_start) / 2**20
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmarks of the computer vision methods')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[240, 1200, 2400, 4800])
+    parser.add_argument('--step', type=int, default=34)      # px, the somite height at 690 px/mm
+    parser.add_argument('--number', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--warm-up', type=int, default=5)
+    parser.add_argument('--drift', type=int, default=5, help='px, drift of the scissor in the tip cache check')
+    parser.add_argument('--tracked-frames', type=int, default=60)
+    parser.add_argument('--tracked-step', type=float, default=5, help='px, motion of the scissor per frame in the tip tracker check')
+    parser.add_argument('--archived', default=None, help='glob pattern of archived camera frames (default: synthetic frames)')
+    args = parser.parse_args()
+    benchmark_centerline(args.sizes, args.step, args.number, args.repeat)
+    benchmark_allocations(args.frames, args.warm_up)
+    benchmark_circles(args.archived, args.frames, args.number, args.repeat)
+    benchmark_scissor_tip(args.archived, args.frames, args.number, args.repeat)
+    benchmark_tip_cache(args.frames, args.drift)
+    benchmark_tip_tracker(args.tracked_frames, args.tracked_step)
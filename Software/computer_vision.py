@@ -11,6 +11,7 @@
 
 
 # Modules
+import tracing
 import cv2 as cv
 import numpy as np
 import time
@@ -26,6 +27,11 @@ def resize_image_by_size(img, width, height):
     return cv.resize(src=img, dsize=(width, height), interpolation=cv.INTER_LINEAR)
 
 
+def resize_mask_by_size(img, width, height):
+    # nearest neighbour such that a binary mask stays binary
+    return cv.resize(src=img, dsize=(width, height), interpolation=cv.INTER_NEAREST)
+
+
 def count_gray_levels(img):
     unique, counts = np.unique(img, return_counts=True)
     return int(np.max(unique))
@@ -40,7 +46,11 @@ def crop_image_old(img_test, img_original, offset):
 
 def crop_image(img_test, img_original, offset):
     coords = cv.findNonZero(img_test)
-    x, y, w, h = cv.boundingRect(coords)
+    return crop_image_by_bbox(img_test, img_original, cv.boundingRect(coords), offset)
+
+
+def crop_image_by_bbox(img_test, img_original, bbox, offset):
+    x, y, w, h = bbox
     h_img, w_img = img_test.shape
     y_lower = y-offset
     y_upper = y+h+offset
@@ -108,16 +118,24 @@ def crop_image_with_fixed_size(img_test, img_original, size):
     return img_test[y_lower:y_upper, x_lower:x_upper], img_original[y_lower:y_upper, x_lower:x_upper]
 
 
-def fill_image(img, offset, color):
-    img_f = img.copy()
-    h, w = img_f.shape
-    mask = np.zeros((h+offset, w+offset), np.uint8)
+def fill_image(img, offset, color, dst=None, mask=None):
+    # dst and mask are optional preallocated buffers (shapes: img.shape and (h+offset, w+offset))
+    h, w = img.shape
+    if dst is None:
+        img_f = img.copy()
+    else:
+        img_f = dst
+        np.copyto(img_f, img)
+    if mask is None:
+        mask = np.zeros((h+offset, w+offset), np.uint8)
+    else:
+        mask.fill(0)
     # flood-filling the image from (0, 0) pixel
     cv.floodFill(image=img_f, mask=mask, seedPoint=(0, 0), newVal=color)
     # inverting the floodfilled image
-    img_f_inv = cv.bitwise_not(src=img_f)
+    cv.bitwise_not(src=img_f, dst=img_f)
     # combining the two images to get the foreground
-    return img | img_f_inv
+    return cv.bitwise_or(src1=img, src2=img_f, dst=img_f)
 
 
 def calculate_centroid(img):
@@ -129,18 +147,62 @@ def calculate_centroid(img):
     return centroid_x, centroid_y
 
 
-def detect_circles(img, dp, param1, param2, offset):
-    img_temp = cv.cvtColor(img.copy(), cv.COLOR_GRAY2RGB)
-    h, w = img_temp.shape[:2]
-    circles = cv.HoughCircles(image=img.copy(), method=cv.HOUGH_GRADIENT, dp=dp, minDist=int(0.5*w/2), 
+def calculate_centerline_points(img, step, size=None):
+    '''
+    sampling the centerline of a mask every step px from its bottom to its top row
+    if size (w, h) is given, the mask is a lower-resolution mask of an image of that size (e.g. the output of the deep network
+    for an embryo crop). the points are then computed in the coordinates of that image as on the mask upsampled to that
+    size with nearest neighbour interpolation, but without upsampling it: every mask row and column stands for the band
+    of output rows and columns that are mapped to it (opencv computes the mapping with a float scale, which can move a
+    band edge by one pixel where the exact mapping is an integer). if size is smaller than the mask (e.g. a crop smaller
+    than the input of the deep network), some mask rows or columns are skipped instead, so the mask is resized to size.
+    '''
+
+    h_in, w_in = img.shape
+    w_out, h_out = (w_in, h_in) if size is None else size
+    if w_out < w_in or h_out < h_in:
+        return calculate_centerline_points(resize_mask_by_size(img, w_out, h_out), step)
+    mask = img != 0
+    # output bands [start, end] of the mask rows and columns (output pixel y is taken from mask pixel y*h_in//h_out)
+    rows_all = np.arange(h_in + 1)
+    rows_start = -((-rows_all * h_out) // h_in)
+    cols_all = np.arange(w_in + 1)
+    cols_start = -((-cols_all * w_out) // w_in)
+    cols_width = np.diff(cols_start).astype(np.float64)
+    cols_sum = (cols_start[:-1] + cols_start[1:] - 1) * cols_width / 2
+    # per-row pixel counts and x-moments of the (upsampled) mask
+    counts = mask.astype(np.float64) @ cols_width
+    moments = mask.astype(np.float64) @ cols_sum
+    rows = np.flatnonzero(counts)
+    if rows.size == 0:
+        return None, None
+    # sampling the rows from the bottom to the top of the (upsampled) mask
+    y_arr = np.arange(rows_start[rows[-1]+1] - 1, rows_start[rows[0]], -int(step))
+    # finding the closest non-empty row to every sample (the upper row wins a tie)
+    # all samples lie in the bands of [rows[0], rows[-1]], so the upper neighbour found by the binary search exists
+    ids_upper = np.searchsorted(rows, (y_arr * h_in) // h_out)
+    ids_lower = np.maximum(ids_upper - 1, 0)
+    distances_upper = rows_start[rows[ids_upper]] - y_arr
+    distances_lower = y_arr - (rows_start[rows[ids_lower]+1] - 1)
+    y_closest = rows[np.where(distances_upper < distances_lower, ids_upper, ids_lower)]
+    # the x coordinate of a point is the mean x of the mask in its closest row
+    x_arr = (moments[y_closest] / counts[y_closest]).astype(int)
+    return x_arr, y_arr
+
+
+def detect_circles(img, dp, param1, param2, offset, flag_draw=True):
+    # the circles are drawn on a color copy only if flag_draw is set (debug images), otherwise img_temp is None
+    h, w = img.shape[:2]
+    circles = cv.HoughCircles(image=img, method=cv.HOUGH_GRADIENT, dp=dp, minDist=int(0.5*w/2), 
                               param1=param1, param2=param2, minRadius=int(0.9*w/2), maxRadius=int(w/2))
     if circles is not None:
         # converting the (x, y) coordinates and radius of the circles to integers
         circles = np.round(circles[0, :]).astype("int")
-        for (x, y, r) in circles:
-            cv.circle(img=img_temp, center=(x, y), radius=r, color=(0, 0, 255), thickness=2)
-            cv.rectangle(img=img_temp, pt1=(x-offset, y-offset), pt2=(x+offset, y+offset),
-                         color=(0, 0, 255), thickness=-1)
+        img_temp = None
+        if flag_draw:
+            img_temp = cv.cvtColor(img, cv.COLOR_GRAY2RGB)
+            for (x, y, r) in circles:
+                draw_circle(img_temp, x, y, r, offset)
         center_x = int(np.mean(circles[:, 0]))
         center_y = int(np.mean(circles[:, 1]))
         return img_temp, center_x, center_y
@@ -148,45 +210,210 @@ def detect_circles(img, dp, param1, param2, offset):
         return None, None, None
 
 
-def detect_lines(img, rho, theta, threshold, min_line_length, max_line_gap, slope_min, slope_max):
-    img_temp = cv.cvtColor(img.copy(), cv.COLOR_GRAY2RGB)
-    lines = cv.HoughLinesP(image=img.copy(), rho=rho, theta=theta*np.pi/180, threshold=threshold, minLineLength=min_line_length, maxLineGap=max_line_gap)
+def draw_circle(img, x, y, r, offset):
+    # a gray image is converted to a color copy first
+    if img.ndim == 2:
+        img = cv.cvtColor(img, cv.COLOR_GRAY2RGB)
+    cv.circle(img=img, center=(int(x), int(y)), radius=int(r), color=(0, 0, 255), thickness=2)
+    cv.rectangle(img=img, pt1=(int(x)-offset, int(y)-offset), pt2=(int(x)+offset, int(y)+offset),
+                 color=(0, 0, 255), thickness=-1)
+    return img
+
+
+def fit_circle_least_squares(x_arr, y_arr):
+    # algebraic (kasa) fit: x^2 + y^2 = 2*a*x + 2*b*y + c with the center (a, b) and the radius sqrt(c + a^2 + b^2)
+    a_mat = np.stack([2*x_arr, 2*y_arr, np.ones_like(x_arr)], axis=1)
+    (a, b, c), _, _, _ = np.linalg.lstsq(a_mat, x_arr**2 + y_arr**2, rcond=None)
+    return a, b, np.sqrt(max(c + a**2 + b**2, 0))
+
+
+def fit_circle(img, x_seed, y_seed, r_min, r_max, flag_ransac, iterations, tolerance, points_min, points_score, seed=0):
+    '''
+    fitting a circle to the edge points within the expected radius band around a seed (e.g. the centroid of the blob)
+    the points outside the band (e.g. the edges inside the embryo) are discarded first. the circle is then fitted by
+    least squares, or by ransac over circles through three points followed by least squares on the inliers. the ransac
+    candidates are scored on at most points_score evenly spread points, and the random generator is seeded, so the same
+    edges always give the same circle.
+    returning the center and radius, or (None, None, None) if there are too few points or no circle in the band
+    '''
+
+    points = cv.findNonZero(img)
+    if points is None:
+        return None, None, None
+    x_arr = points[:, 0, 0].astype(np.float64)
+    y_arr = points[:, 0, 1].astype(np.float64)
+    distances = np.hypot(x_arr - x_seed, y_arr - y_seed)
+    ids_band = (distances >= r_min) & (distances <= r_max)
+    x_arr, y_arr = x_arr[ids_band], y_arr[ids_band]
+    if x_arr.size < points_min:
+        return None, None, None
+    if flag_ransac:
+        # circumcircles of random point triplets (all at once), degenerate triplets and circles out of the band are skipped
+        ids = np.random.default_rng(seed).integers(0, x_arr.size, (iterations, 3))
+        xa, xb, xc = x_arr[ids].T
+        ya, yb, yc = y_arr[ids].T
+        d = 2 * (xa*(yb-yc) + xb*(yc-ya) + xc*(ya-yb))
+        d[np.abs(d) < 1e-9] = np.nan
+        sa, sb, sc = xa**2+ya**2, xb**2+yb**2, xc**2+yc**2
+        xs = (sa*(yb-yc) + sb*(yc-ya) + sc*(ya-yb)) / d
+        ys = (sa*(xc-xb) + sb*(xa-xc) + sc*(xb-xa)) / d
+        rs = np.hypot(xa - xs, ya - ys)
+        valid = (rs >= r_min) & (rs <= r_max)
+        if not np.any(valid):
+            return None, None, None
+        xs, ys, rs = xs[valid], ys[valid], rs[valid]
+        step = max(x_arr.size // points_score, 1)
+        residuals = np.abs(np.hypot(x_arr[None, ::step] - xs[:, None], y_arr[None, ::step] - ys[:, None]) - rs[:, None])
+        id_best = np.argmax(np.count_nonzero(residuals <= tolerance, axis=1))
+        inliers = np.abs(np.hypot(x_arr - xs[id_best], y_arr - ys[id_best]) - rs[id_best]) <= tolerance
+        if np.count_nonzero(inliers) < points_min:
+            return None, None, None
+        x_arr, y_arr = x_arr[inliers], y_arr[inliers]
+    x_center, y_center, radius = fit_circle_least_squares(x_arr, y_arr)
+    return int(round(x_center)), int(round(y_center)), int(round(radius))
+
+
+def detect_lines(img, rho, theta, threshold, min_line_length, max_line_gap, slope_min, slope_max, flag_draw=True):
+    # the line is drawn on a color copy only if flag_draw is set (debug images), otherwise img_temp is None
+    lines = cv.HoughLinesP(image=img, rho=rho, theta=theta*np.pi/180, threshold=threshold, minLineLength=min_line_length, maxLineGap=max_line_gap)
     points = []
     if lines is not None:
         for line in lines:
             x1, y1, x2, y2 = line[0]
             if slope_min <= 180*np.arctan2(abs(y2-y1), abs(x2-x1))/np.pi <= slope_max:
                 points = [x1, y1, x2, y2]
-                cv.line(img=img_temp, pt1=(x1, y1), pt2=(x2, y2), color=(0, 0, 255), thickness=3)
+                img_temp = None
+                if flag_draw:
+                    img_temp = cv.cvtColor(img, cv.COLOR_GRAY2RGB)
+                    cv.line(img=img_temp, pt1=(x1, y1), pt2=(x2, y2), color=(0, 0, 255), thickness=3)
                 return img_temp, points
     return None, None
 
 
+def fit_line(img, slope_min, slope_max, length_min, iterations, tolerance, points_min, points_score, seed=0):
+    '''
+    fitting the dominant line with a slope within [slope_min, slope_max] deg to the edge points of the image
+    ransac candidates through two points are kept only if their slope is in the band, and are scored on at most
+    points_score evenly spread points. the inliers of the best candidate are refined by pca (total least squares) and
+    must extend over at least length_min px. the random generator is seeded, so the same edges always give the same line.
+    returning the line as a point and a unit direction (x, y, vx, vy) and the standard errors of its perpendicular offset
+    (px) and angle (rad), or (None, None) if there is no such line
+    '''
+
+    points = cv.findNonZero(img)
+    if points is None or len(points) < points_min:
+        return None, None
+    x_arr = points[:, 0, 0].astype(np.float64)
+    y_arr = points[:, 0, 1].astype(np.float64)
+    # candidate lines through random point pairs (all at once), degenerate pairs and slopes out of the band are skipped
+    ids = np.random.default_rng(seed).integers(0, x_arr.size, (iterations, 2))
+    dx = x_arr[ids[:, 1]] - x_arr[ids[:, 0]]
+    dy = y_arr[ids[:, 1]] - y_arr[ids[:, 0]]
+    lengths = np.hypot(dx, dy)
+    slopes = 180*np.arctan2(np.abs(dy), np.abs(dx))/np.pi
+    valid = (lengths > 0) & (slopes >= slope_min) & (slopes <= slope_max)
+    if not np.any(valid):
+        return None, None
+    ids, nx, ny = ids[valid, 0], -dy[valid]/lengths[valid], dx[valid]/lengths[valid]
+    step = max(x_arr.size // points_score, 1)
+    distances = np.abs((x_arr[None, ::step] - x_arr[ids, None])*nx[:, None] + (y_arr[None, ::step] - y_arr[ids, None])*ny[:, None])
+    id_best = np.argmax(np.count_nonzero(distances <= tolerance, axis=1))
+    inliers = np.abs((x_arr - x_arr[ids[id_best]])*nx[id_best] + (y_arr - y_arr[ids[id_best]])*ny[id_best]) <= tolerance
+    if np.count_nonzero(inliers) < points_min:
+        return None, None
+    x_arr, y_arr = x_arr[inliers], y_arr[inliers]
+    # pca: the direction is the principal axis of the inliers around their centroid
+    x_mean, y_mean = np.mean(x_arr), np.mean(y_arr)
+    eigenvalues, eigenvectors = np.linalg.eigh(np.cov(x_arr - x_mean, y_arr - y_mean))
+    vx, vy = eigenvectors[:, 1]
+    if not slope_min <= 180*np.arctan2(abs(vy), abs(vx))/np.pi <= slope_max:
+        return None, None
+    projections = (x_arr - x_mean)*vx + (y_arr - y_mean)*vy
+    if np.ptp(projections) < length_min:
+        return None, None
+    # standard errors of the fit from the spread of the inliers around the line
+    sigma = np.sqrt(max(eigenvalues[0], 0) * (x_arr.size - 1) / max(x_arr.size - 2, 1))
+    return (x_mean, y_mean, vx, vy), (sigma / np.sqrt(x_arr.size), sigma / np.sqrt(np.sum(projections**2)))
+
+
+def intersect_lines(line_1, line_2):
+    # lines as a point and a direction (x, y, vx, vy), returning None for parallel lines
+    x1, y1, vx1, vy1 = line_1
+    x2, y2, vx2, vy2 = line_2
+    cross = vx1*vy2 - vy1*vx2
+    if abs(cross) < 1e-9:
+        return None, None
+    a = ((x2 - x1)*vy2 - (y2 - y1)*vx2) / cross
+    return x1 + a*vx1, y1 + a*vy1
+
+
+def intersect_lines_with_uncertainty(line_1, errors_1, line_2, errors_2):
+    '''
+    intersecting two fitted lines and propagating the standard errors of their offsets and angles to the intersection
+    (first order, by shifting and rotating each line by one standard error in turn)
+    returning the intersection and its uncertainty in px (the root of the summed variances of x and y)
+    '''
+
+    x, y = intersect_lines(line_1, line_2)
+    if x is None:
+        return None, None, None
+    variance = 0
+    for id_line, (line, errors) in enumerate([(line_1, errors_1), (line_2, errors_2)]):
+        x0, y0, vx, vy = line
+        error_offset, error_angle = errors
+        c, s = np.cos(error_angle), np.sin(error_angle)
+        for line_perturbed in [(x0 - error_offset*vy, y0 + error_offset*vx, vx, vy), (x0, y0, c*vx - s*vy, s*vx + c*vy)]:
+            lines = [line_perturbed, line_2] if id_line == 0 else [line_1, line_perturbed]
+            x_perturbed, y_perturbed = intersect_lines(*lines)
+            if x_perturbed is None:
+                return x, y, np.inf
+            variance = variance + (x_perturbed - x)**2 + (y_perturbed - y)**2
+    return x, y, np.sqrt(variance)
+
+
+def draw_line(img, line, color=(0, 0, 255)):
+    # a gray image is converted to a color copy first, the line (x, y, vx, vy) is drawn across the whole image
+    if img.ndim == 2:
+        img = cv.cvtColor(img, cv.COLOR_GRAY2RGB)
+    x, y, vx, vy = line
+    length = img.shape[0] + img.shape[1]
+    cv.line(img=img, pt1=(int(x - length*vx), int(y - length*vy)), pt2=(int(x + length*vx), int(y + length*vy)), color=color, thickness=3)
+    return img
+
+
+@tracing.traced('save')
 def save_image(img, name, path):
     time_stamp = time.strftime('%Y_%m_%d_%H_%M_%S_', time.localtime())
     cv.imwrite(path + time_stamp + name + '.png', img)
 
 
-def apply_closing(img, kernel_size, iterations):
-    kernel = cv.getStructuringElement(shape=cv.MORPH_ELLIPSE, ksize=(kernel_size, kernel_size))
-    return cv.morphologyEx(src=img.copy(), op=cv.MORPH_CLOSE, kernel=kernel, iterations=iterations)
+def get_structuring_element(kernel_size):
+    return cv.getStructuringElement(shape=cv.MORPH_ELLIPSE, ksize=(kernel_size, kernel_size))
+
 
+# the functions below do not modify their input, dst is an optional preallocated output (e.g. from a Workspace)
+def apply_closing(img, kernel_size, iterations, dst=None, kernel=None):
+    if kernel is None:
+        kernel = get_structuring_element(kernel_size)
+    return cv.morphologyEx(src=img, op=cv.MORPH_CLOSE, kernel=kernel, dst=dst, iterations=iterations)
 
-def apply_opening(img, kernel_size, iterations):
-    kernel = cv.getStructuringElement(shape=cv.MORPH_ELLIPSE, ksize=(kernel_size, kernel_size))
-    return cv.morphologyEx(src=img.copy(), op=cv.MORPH_OPEN, kernel=kernel, iterations=iterations)
 
+def apply_opening(img, kernel_size, iterations, dst=None, kernel=None):
+    if kernel is None:
+        kernel = get_structuring_element(kernel_size)
+    return cv.morphologyEx(src=img, op=cv.MORPH_OPEN, kernel=kernel, dst=dst, iterations=iterations)
 
-def detect_edges(img, threshold_1, threshold_2, aperture_size, l2_gradient=True):
-    return cv.Canny(image=img.copy(), threshold1=threshold_1, threshold2=threshold_2, apertureSize=aperture_size, L2gradient=l2_gradient)
 
+def detect_edges(img, threshold_1, threshold_2, aperture_size, l2_gradient=True, dst=None):
+    return cv.Canny(image=img, threshold1=threshold_1, threshold2=threshold_2, edges=dst, apertureSize=aperture_size, L2gradient=l2_gradient)
 
-def apply_in_range_threshold(img, lower_bound, upper_bound):
-    return cv.inRange(src=img.copy(), lowerb=lower_bound, upperb=upper_bound)
 
+def apply_in_range_threshold(img, lower_bound, upper_bound, dst=None):
+    return cv.inRange(src=img, lowerb=lower_bound, upperb=upper_bound, dst=dst)
 
-def apply_blurring(img, kernel_size, sigma_x):
-    return cv.GaussianBlur(src=img.copy(), ksize=(kernel_size, kernel_size), sigmaX=sigma_x)
+
+def apply_blurring(img, kernel_size, sigma_x, dst=None):
+    return cv.GaussianBlur(src=img, ksize=(kernel_size, kernel_size), sigmaX=sigma_x, dst=dst)
     
 
 def find_connected_components(img):
@@ -195,6 +422,47 @@ def find_connected_components(img):
     return labels, areas
 
 
+def extract_largest_component(img, white_level, roi=None, img_out=None, labels=None):
+    # labeling only the roi (x, y, w, h) if it is given, labels is an optional preallocated int32 buffer of the roi shape
+    x_roi, y_roi, w_roi, h_roi = (0, 0, img.shape[1], img.shape[0]) if roi is None else roi
+    n_labels, labels, stats, centroids = cv.connectedComponentsWithStats(image=img[y_roi:y_roi+h_roi, x_roi:x_roi+w_roi], labels=labels, connectivity=8, ltype=cv.CV_32S)
+    if img_out is None:
+        img_out = np.zeros(img.shape, dtype=np.uint8)
+    else:
+        img_out.fill(0)
+    if n_labels < 2:
+        return img_out, None, 0
+    # comparing the labels only inside the bounding box of the largest component
+    idx = 1 + int(np.argmax(stats[1:, cv.CC_STAT_AREA]))
+    x, y, w, h, area = [int(value) for value in stats[idx]]
+    img_out[y_roi+y:y_roi+y+h, x_roi+x:x_roi+x+w][labels[y:y+h, x:x+w] == idx] = white_level
+    return img_out, (x_roi+x, y_roi+y, w, h), area
+
+
+class Workspace:
+    '''
+    reusable buffers and structuring elements such that the annotation chain does not allocate them per frame
+    a buffer is a contiguous view on a flat array kept per name and dtype. the flat array only grows, so the crops, whose
+    shape changes from well to well, reuse the same memory once the largest crop has been seen.
+    '''
+
+    def __init__(self):
+        self.buffers = {}
+        self.kernels = {}
+
+    def get_buffer(self, name, shape, dtype=np.uint8):
+        key = (name, np.dtype(dtype).str)
+        size = int(np.prod(shape))
+        if key not in self.buffers or self.buffers[key].size < size:
+            self.buffers[key] = np.zeros(size, dtype=dtype)
+        return self.buffers[key][:size].reshape(shape)
+
+    def get_kernel(self, kernel_size):
+        if kernel_size not in self.kernels:
+            self.kernels[kernel_size] = get_structuring_element(kernel_size)
+        return self.kernels[kernel_size]
+
+
 def draw_points(img, points, offset):
     img_drawn = cv.cvtColor(img, cv.COLOR_GRAY2BGR)
     for point in points:
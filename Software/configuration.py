@@ -302,6 +302,17 @@ class Configuration:
         self.annotation_embryo_circle_dp                                = 5
         self.annotation_embryo_circle_param_1                           = 255
         self.annotation_embryo_circle_param_2                           = 220
+        self.annotation_embryo_circle_method_hough                      = 0
+        self.annotation_embryo_circle_method_least_squares              = 1
+        self.annotation_embryo_circle_method_ransac                     = 2
+        self.annotation_embryo_circle_method                            = self.annotation_embryo_circle_method_hough   # ransac once it is validated on archived frames (benchmark_vision.py --archived)
+        self.annotation_embryo_circle_radius_ratio_min                  = 0.9   # radius band of the fit as a ratio of half the crop width (as for hough)
+        self.annotation_embryo_circle_radius_ratio_max                  = 1.0
+        self.annotation_embryo_circle_fit_slack                         = 20    # px, the band is widened as the centroid seed is not the exact center
+        self.annotation_embryo_circle_ransac_iterations                 = 100
+        self.annotation_embryo_circle_ransac_tolerance                  = 2     # px, max distance of an inlier to the circle
+        self.annotation_embryo_circle_ransac_points                     = 200   # max number of points the ransac candidates are scored on
+        self.annotation_embryo_circle_points_min                        = 20
         self.annotation_embryo_point_offset_x                           = 0     # px
         self.annotation_embryo_point_offset_y                           = 0     # px, -100
         self.annotation_embryo_flag_cv_dn                               = 0     # 0: cv (computer vision), 1: dn (deep network)
@@ -320,8 +331,18 @@ class Configuration:
         self.annotation_scissor_diagonal_line_gap_max                   = 50    # px
         self.annotation_scissor_diagonal_line_slope_min                 = 60    # [deg]
         self.annotation_scissor_diagonal_line_slope_max                 = 80    # [deg]
+        self.annotation_scissor_line_method_hough                       = 0
+        self.annotation_scissor_line_method_ransac                      = 1
+        self.annotation_scissor_line_method                             = self.annotation_scissor_line_method_ransac
+        self.annotation_scissor_line_ransac_iterations                  = 100
+        self.annotation_scissor_line_ransac_tolerance                   = 2     # px, max distance of an inlier to the line
+        self.annotation_scissor_line_ransac_points                      = 200   # max number of points the ransac candidates are scored on
+        self.annotation_scissor_line_points_min                         = 30
+        self.annotation_scissor_tip_uncertainty_max                     = 5     # px, the intersection is rejected above this uncertainty
+        self.annotation_scissor_tip_uncertainty                         = None  # px, uncertainty of the last intersection (None for hough)
         self.annotation_scissor_err_no_line                             = 'no line is detected!'
         self.annotation_scissor_err_no_intersection                     = 'intersection is not in the field of view!'
+        self.annotation_scissor_err_uncertain                           = 'intersection of the lines is too uncertain!'
         self.annotation_scissor_directory                               = self.annotation_directory + 'scs_'
 
         # automation constants and variables
@@ -344,6 +365,48 @@ class Configuration:
         self.automation_sleep_multiplier_pistage                        = 0.2
         self.automation_sleep_multiplier_smaract                        = 1.5
         self.automation_flag_stopped                                    = False
+        self.automation_phases                                          = ['annotation', 'approach', 'cut', 'retract', 'travel', 'saves']   # timed per well
+        self.automation_message_phases                                  = 'time per well: '
+
+        # roi (region of interest) constants and variables
+        self.roi_flag_enabled                                           = 1         # 0: full frame in every well, 1: padded roi around the last embryo and scissor first
+        self.roi_padding                                                = 150       # px, added around the union of the last bounding boxes
+        self.roi_margin                                                 = 20        # px, minimum distance of a confident blob to the roi borders
+        self.roi_area_ratio_max                                         = 1.5       # maximum change of the blob area with respect to the previous well
+        self.roi_name_embryo                                            = 'embryo'
+        self.roi_name_scissor                                           = 'scissor'
+        self.roi_message_hit_rate                                       = 'roi hit rate: '
+
+        # scissor tip cache constants
+        self.tip_cache_flag_enabled                                     = 1         # 0: scissor tip detected in every well, 1: reused while the smaract pose is unchanged
+        self.tip_cache_pose_tolerance                                   = 1000      # nm, maximum difference of every smaract channel to the cached pose
+        self.tip_cache_template_size                                    = 128       # px, side of the patch around the tip (both blade edges have to be inside)
+        self.tip_cache_search_margin                                    = 16        # px, added around the patch for the drift check
+        self.tip_cache_score_min                                        = 0.9       # minimum normalized correlation of the patch
+        self.tip_cache_drift_max                                        = 2         # px, maximum shift of the patch
+        self.tip_cache_message_hit_rate                                 = 'scissor tip cache hit rate: '
+
+        # scissor tip tracker constants and variables
+        self.tip_tracker_flag_enabled                                   = 1         # 0: tip detected only when annotating, 1: tip also tracked in every camera frame
+        self.tip_tracker_template_size                                  = 96        # px, side of the patch around the tip
+        self.tip_tracker_search_margin                                  = 40        # px, maximum motion of the tip between two frames
+        self.tip_tracker_score_min                                      = 0.7       # minimum normalized correlation, the tip is lost below
+        self.tip_tracker_anchor_interval                                = 50        # frames, the tip is detected again to refresh the patch
+        self.tip_tracker_anchor_backoff_frames                          = 25        # frames, the camera waits this long after a failed detection of the tip
+        self.tip_tracker_window                                         = 100       # frames of the rate and latency statistics
+        self.tip_tracker_tip                                            = None      # (x, y) in px, last tracked tip (None if lost)
+        self.tip_tracker_message                                        = 'scissor tip tracker: '
+
+        # visual servoing constants of the approach of the scissor to the target
+        self.servo_flag_enabled                                         = 1         # 0: one open-loop move, 1: moves repeated until the tip is on the target
+        self.servo_gain                                                 = 1.0       # fraction of the pixel error corrected per iteration
+        self.servo_threshold                                            = 3         # px, the approach has converged below this error
+        self.servo_iterations_max                                       = 5
+        self.servo_settle_time_s                                        = 0.2       # waiting time after a move before the tip is measured
+        self.servo_frame_timeout_s                                      = 1.0       # maximum waiting time for a new tracked tip
+        self.servo_poll_time_s                                          = 0.01
+        self.servo_message                                              = 'approach: '
+        self.servo_err_lost                                             = 'scissor tip is lost during the approach!'
         
         # positioning variables to store the initial position of smaract channels prior to perform the cutting sequence
         self.pos_initial_x                                              = 0
@@ -381,6 +444,62 @@ class Configuration:
         self.micro                                                      = 1000000
         self.pixel_to_mili                                              = 1/690    # 104px/mm for 0.63x, 660/684/690px/mm for 4x, found by imageJ calibration
         self.mili_to_pixel                                              = 1/self.pixel_to_mili
+        # # pixel to stage calibration (affine transform from the smaract x/y positions to the pixels, fitted by WorkerCalibration)
+        self.calibration_objective                                      = '4x'      # the calibration is stored per objective
+        self.calibration_directory                                      = './calibrations/'
+        self.calibration_matrix                                         = None      # 2x3, pixel = matrix[:, :2] @ stage (nm) + matrix[:, 2], loaded at start
+        self.calibration_step                                           = 100000    # nm, spacing of the jogging pattern
+        self.calibration_pattern                                        = [(0, 0), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)]
+        self.calibration_settle_time_s                                  = 0.3       # waiting time after a move before the tip is detected
+        self.calibration_points_min                                     = 6
+        self.calibration_residual_max                                   = 3         # px, rms residual above which the calibration is rejected
+        self.calibration_message_start                                  = 'calibrating the pixel to stage transform...'
+        self.calibration_message_done                                   = 'calibration is saved: '
+        self.calibration_err_points                                     = 'calibration failed: the scissor tip is not detected in enough positions!'
+        self.calibration_err_residual                                   = 'calibration failed: the residual is too large: '
+        self.calibration_err_not_reachable                              = 'calibration failed: the jogging pattern is not reachable!'
+        # simulated hardware (run.py --sim)
+        self.sim_time_scale                                             = 1.0       # real time per simulated time, all the sleeps of the workers are scaled by it
+        self.sim_seed                                                   = 0
+        self.sim_smaract_acceleration                                   = 20000000  # nm/s^2
+        self.sim_smaract_settle_time_s                                  = 0.02
+        self.sim_smaract_referencing_time_s                             = 2.0
+        self.sim_pistage_acceleration                                   = 10        # mm/s^2
+        self.sim_pistage_settle_time_s                                  = 0.05
+        self.sim_pistage_referencing_time_s                             = 5.0
+        self.sim_serial_latency_s                                       = 0.01      # one way, asm
+        self.sim_camera_fps                                             = 30
+        self.sim_camera_px_per_mm                                       = 680       # px/mm, slightly off pixel_to_mili as on a rig before calibration
+        self.sim_camera_angle_deg                                       = 1         # rotation between the smaract and the camera axes
+        self.sim_camera_noise                                           = 3         # std of the gaussian noise of the frames
+        self.sim_camera_noise_frames                                    = 8         # noise patterns generated once and reused cyclically
+        self.sim_tip_start                                              = (560, 430)    # px, scissor tip at smaract_linear_pos_desired
+        self.sim_embryo_center                                          = (600, 820)    # px, embryo of a centered well
+        self.sim_embryo_offset_max                                      = 60        # px, random offset of the embryo in its well
+        # performance panel (counters of the workers plotted live in the gui, run.py --performance)
+        self.performance_flag_enabled                                   = False     # the device calls are traced and the Performance button is enabled
+        self.performance_max_samples                                    = 2000      # per counter
+        self.performance_window_s                                       = 60        # time span of the plots
+        self.performance_rate_bin_s                                     = 1         # bins of the fps plots
+        self.performance_rate_window_s                                  = 5         # fps shown above the plots
+        self.performance_refresh_ms                                     = 500
+        self.performance_categories                                     = ['vision', 'inference', 'smaract', 'pistage', 'asm']   # traced spans kept
+        self.performance_vision_stages                                  = ['automation_preprocess_image', 'automation_extract_from_image', 'automation_annotate_embryo',
+                                                                           'automation_annotate_scissor', 'annotate_embryo', 'annotate_scissor']
+        self.performance_device_round_trips                             = ['smaract.get_channel_position', 'pistage.get_axis_position', 'asm.get_position']
+        self.performance_panel_title                                    = 'Performance'
+        # metrics exporter (prometheus text format on http://metrics_host:metrics_port/metrics, run.py --metrics)
+        self.metrics_flag_enabled                                       = False
+        self.metrics_host                                               = '127.0.0.1'   # '0.0.0.0' to be scraped by other machines
+        self.metrics_port                                               = 9150
+        self.metrics_devices                                            = ['smaract', 'pistage', 'asm']
+        self.metrics_device_buckets_s                                   = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+        self.metrics_well_cycle_buckets_s                               = [5, 10, 15, 20, 30, 45, 60, 90, 120, 180]
+        # tracing of the workers (run.py --trace)
+        self.trace_flag_enabled                                         = False
+        self.trace_directory                                            = './traces/'
+        self.trace_path                                                 = None      # chrome trace exported when the gui is closed (set by run.py)
+        self.trace_max_events                                           = 1000000   # the oldest spans are dropped beyond
         self.save_counter                                               = 1
         self.save_directory                                             = './images_saved/'
         self.flag_save_images_annotation                                = False
@@ -400,6 +519,7 @@ class Configuration:
         self.dn_stride                                                  = 2
         self.dn_dropout                                                 = 0.5
         self.dn_flag_batch_norm                                         = True
+        self.dn_flag_fused                                              = True  # batch normalization folded into the convolutions and dropout stripped at load time
         self.dn_threshold                                               = 0.5
         self.dn_somite_height_um                                        = 50    # um
         self.dn_somite_height_px                                        = self.dn_somite_height_um * self.micro_to_mili * self.mili_to_pixel
@@ -410,3 +530,38 @@ class Configuration:
         self.dn_threshold_max                                           = 1
         self.dn_err_threshold_invalid                                   = 'the entered threshold for deep network was invalid and is set to the previous valid value!'
         self.dn_err_empty                                               = 'the thresholded output image of the deep network is empty!'
+        self.dn_warm_up_iterations                                      = 2     # predictions run at load time to trace and warm up the graph
+        self.dn_latency_window                                          = 100   # number of the latest predictions kept for the latency statistics
+        self.dn_message_latency                                         = 'deep network latency: '
+        self.dn_backend_tensorflow                                      = 0
+        self.dn_backend_tflite                                          = 1
+        self.dn_backend_onnx                                            = 2
+        self.dn_backend                                                 = self.dn_backend_tensorflow
+        self.dn_path_tflite                                             = './deep_networks/deep_tube.tflite'
+        self.dn_path_onnx                                               = './deep_networks/deep_tube.onnx'
+        self.dn_batch_size                                              = 8     # crops per forward pass of the batched prediction
+        self.dn_flag_threshold_before_resize                            = 1     # thresholding the output and computing the centerline at dn_image_size instead of on the output upsampled to the crop
+        self.dn_flag_gate                                               = 1     # checking the embryo blob before running the deep network
+        self.dn_gate_area_min                                           = 20000     # px, static bounds used until dn_gate_samples_min embryos are annotated
+        self.dn_gate_area_max                                           = 720000    # px
+        self.dn_gate_aspect_min                                         = 0.25      # h/w of the bounding box
+        self.dn_gate_aspect_max                                         = 4
+        self.dn_gate_samples_min                                        = 5
+        self.dn_gate_history                                            = 50    # number of the latest annotated embryos the bounds are learned from
+        self.dn_gate_area_ratio_max                                     = 1.5   # max ratio between the area and the median area of the history
+        self.dn_gate_aspect_ratio_max                                   = 1.3   # max ratio between the aspect ratio and the median aspect ratio of the history
+        self.dn_gate_rejections_max                                     = 3     # consecutive rejections after which the next blob is passed to the deep network
+        self.dn_err_gate                                                = 'the embryo blob is not plausible (area or shape out of the learned bounds), the deep network is not run!'
+        self.dn_message_gate                                            = 'deep network gate: '
+        self.dn_threads_intra_op                                        = 0     # threads of a single operation, 0: decided by the runtime
+        self.dn_threads_inter_op                                        = 0     # operations run in parallel, 0: decided by the runtime
+        self.dn_cpu_affinity                                            = []    # cores of the inference, []: all cores
+        self.dn_flag_onednn                                             = 1     # onednn (mkl) kernels of tensorflow
+        self.dn_precision                                               = 'float32'     # tensorflow backend only, 'float32' or 'mixed_bfloat16'
+        self.dn_flag_profile                                            = 1     # overwriting the settings above with the profile written by tune_inference.py
+        self.dn_profile_path                                            = './deep_networks/runtime_profile.json'
+        self.dn_profile_names                                           = ['dn_threads_intra_op', 'dn_threads_inter_op', 'dn_cpu_affinity', 'dn_flag_onednn', 'dn_precision']
+        self.dn_message_loading                                         = 'loading the deep network in the background...'
+        self.dn_message_loaded                                          = 'deep network loaded in '
+        self.dn_err_loading                                             = 'the deep network could not be loaded: '
+        self.dn_err_not_ready                                           = 'the deep network is still loading, try again once it is loaded!'
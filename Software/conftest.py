@@ -0,0 +1,21 @@
+##############################################################################
+# File name:    conftest.py
+# Project:      Robotic Surgery Software
+# Part:         Options of the tests
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file adds the options of the vision suite
+#               (test_benchmark_vision.py) to pytest: the resolutions,
+#               the number of frames, the archived camera frames and the
+#               deep network annotation.
+##############################################################################
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('vision suite')
+    group.addoption('--vision-sizes', type=int, nargs='+', default=[600, 1200, 2400], help='px, resolutions of the suite frames')
+    group.addoption('--vision-frames', type=int, default=3, help='synthetic (and archived) frames of the suite')
+    group.addoption('--vision-rounds', type=int, default=3, help='timed rounds per frame')
+    group.addoption('--vision-archived', default=None, help='glob pattern of archived camera frames (default: synthetic frames only)')
+    group.addoption('--vision-dn', action='store_true', help='also measuring the deep network annotation (configuration dn_backend)')
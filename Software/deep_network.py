@@ -10,6 +10,8 @@ from tensorflow.keras import activations
 from tensorflow.keras import models
 from tensorflow.keras import datasets
 from tensorflow.keras import utils
+import numpy as np
+import time
 
 
 def conv2d_block(input, filters_num, kernel_size, flag_batch_norm):
@@ -22,47 +24,54 @@ def conv2d_block(input, filters_num, kernel_size, flag_batch_norm):
     return x
 
 
+def dropout_block(input, dropout):
+    # dropout is the identity at inference, so the fused graph (dropout=0) is built without these layers
+    if dropout == 0:
+        return input
+    return layers.Dropout(dropout)(input)
+
+
 def build_model(input, filters_num, kernel_size, stride, dropout, flag_batch_norm):
     c1 = conv2d_block(input, filters_num*1, kernel_size, flag_batch_norm)
     p1 = layers.MaxPool2D((stride, stride))(c1)
-    p1 = layers.Dropout(dropout)(p1)
+    p1 = dropout_block(p1, dropout)
 
     c2 = conv2d_block(p1, filters_num*2, kernel_size, flag_batch_norm)
     p2 = layers.MaxPool2D((stride, stride))(c2)
-    p2 = layers.Dropout(dropout)(p2)
+    p2 = dropout_block(p2, dropout)
 
     c3 = conv2d_block(p2, filters_num*4, kernel_size, flag_batch_norm)
     p3 = layers.MaxPool2D((stride, stride))(c3)
-    p3 = layers.Dropout(dropout)(p3)
+    p3 = dropout_block(p3, dropout)
 
     c4 = conv2d_block(p3, filters_num*8, kernel_size, flag_batch_norm)
     p4 = layers.MaxPool2D((stride, stride))(c4)
-    p4 = layers.Dropout(dropout)(p4)
+    p4 = dropout_block(p4, dropout)
     
     c5 = conv2d_block(p4, filters_num*16, kernel_size, flag_batch_norm)
     
     u6 = layers.Conv2DTranspose(filters=filters_num*8, kernel_size=kernel_size,
                                 strides=stride, padding='same')(c5)
     u6 = layers.concatenate([u6, c4], axis=-1)
-    u6 = layers.Dropout(dropout)(u6)
+    u6 = dropout_block(u6, dropout)
     c6 = conv2d_block(u6, filters_num*8, kernel_size, flag_batch_norm)
 
     u7 = layers.Conv2DTranspose(filters=filters_num*4, kernel_size=kernel_size,
                                 strides=stride, padding='same')(c6)
     u7 = layers.concatenate([u7, c3], axis=-1)
-    u7 = layers.Dropout(dropout)(u7)
+    u7 = dropout_block(u7, dropout)
     c7 = conv2d_block(u7, filters_num*4, kernel_size, flag_batch_norm)
 
     u8 = layers.Conv2DTranspose(filters=filters_num*2, kernel_size=kernel_size,
                                 strides=stride, padding='same')(c7)
     u8 = layers.concatenate([u8, c2], axis=-1)
-    u8 = layers.Dropout(dropout)(u8)
+    u8 = dropout_block(u8, dropout)
     c8 = conv2d_block(u8, filters_num*2, kernel_size, flag_batch_norm)
 
     u9 = layers.Conv2DTranspose(filters=filters_num*1, kernel_size=kernel_size,
                                 strides=stride, padding='same')(c8)
     u9 = layers.concatenate([u9, c1], axis=-1)
-    u9 = layers.Dropout(dropout)(u9)
+    u9 = dropout_block(u9, dropout)
     c9 = conv2d_block(u9, filters_num*1, kernel_size, flag_batch_norm)
     
     output = layers.Conv2D(filters=1, kernel_size=1, activation='sigmoid')(c9) 
@@ -70,8 +79,73 @@ def build_model(input, filters_num, kernel_size, stride, dropout, flag_batch_nor
     return model
 
 
-def load_model(path, image_size, filters_num, kernel_size, stride, dropout, flag_batch_norm):
+def fuse_model(model, image_size, filters_num, kernel_size, stride):
+    '''
+    building the inference graph of a trained model: batch normalization folded into the preceding convolution and no dropout
+    the convolutions of both graphs are created in the same order, so they are paired in order. a batch normalization
+    directly follows its convolution in model.layers.
+    '''
+
+    input = layers.Input((image_size, image_size, 1), name='input')
+    model_fused = build_model(input, filters_num, kernel_size, stride, 0, False)
+    layers_conv = [layer for layer in model.layers if isinstance(layer, (layers.Conv2D, layers.Conv2DTranspose))]
+    layers_conv_fused = [layer for layer in model_fused.layers if isinstance(layer, (layers.Conv2D, layers.Conv2DTranspose))]
+    for layer, layer_fused in zip(layers_conv, layers_conv_fused):
+        kernel, bias = layer.get_weights()
+        index = model.layers.index(layer)
+        layer_next = model.layers[index+1] if index+1 < len(model.layers) else None
+        if isinstance(layer_next, layers.BatchNormalization):
+            gamma, beta, mean, variance = layer_next.get_weights()
+            scale = gamma / np.sqrt(variance + layer_next.epsilon)
+            kernel = kernel * scale                 # the output channels are the last axis of a conv2d kernel
+            bias = (bias - mean) * scale + beta
+        layer_fused.set_weights([kernel, bias])
+    return model_fused
+
+
+def load_model(path, image_size, filters_num, kernel_size, stride, dropout, flag_batch_norm, flag_fused=False):
     input = layers.Input((image_size, image_size, 1), name='input')
     model = build_model(input, filters_num, kernel_size, stride, dropout, flag_batch_norm)
     model.load_weights(path)
+    if flag_fused:
+        return fuse_model(model, image_size, filters_num, kernel_size, stride)
     return model
+
+
+def check_fused_model(model, model_fused, num_images, batch_size):
+    '''
+    comparing the predictions of the fused inference graph with the original model on random images
+    '''
+
+    imgs = np.random.default_rng(0).random((num_images,) + tuple(model.input_shape[1:]), dtype=np.float32)
+    outputs = model(imgs, training=False).numpy()
+    outputs_fused = model_fused(imgs, training=False).numpy()
+    function = tf.function(lambda x: model(x, training=False))
+    function_fused = tf.function(lambda x: model_fused(x, training=False))
+    latencies_ms = []
+    for f in [function, function_fused]:
+        f(imgs[:batch_size])
+        time_start = time.perf_counter()
+        for _ in range(num_images // batch_size):
+            f(imgs[:batch_size])
+        latencies_ms.append(1000 * (time.perf_counter() - time_start) / (num_images // batch_size))
+    return np.max(np.abs(outputs - outputs_fused)), latencies_ms[0], latencies_ms[1]
+
+
+if __name__ == '__main__':
+    import configuration
+    import argparse
+    parser = argparse.ArgumentParser(description='numerical equivalence and latency of the fused inference graph')
+    parser.add_argument('--dn-path', default=None, help='keras weights (default: configuration dn_path)')
+    parser.add_argument('--images', type=int, default=16)
+    parser.add_argument('--tolerance', type=float, default=1e-4)
+    args = parser.parse_args()
+    config = configuration.Configuration()
+    path = config.dn_path if args.dn_path is None else args.dn_path
+    model = load_model(path, config.dn_image_size, config.dn_filters_num, config.dn_kernel_size, config.dn_stride,
+                       config.dn_dropout, config.dn_flag_batch_norm)
+    model_fused = fuse_model(model, config.dn_image_size, config.dn_filters_num, config.dn_kernel_size, config.dn_stride)
+    error, latency_ms, latency_fused_ms = check_fused_model(model, model_fused, args.images, 1)
+    print('layers:            {:d} -> {:d}'.format(len(model.layers), len(model_fused.layers)))
+    print('max abs deviation: {:.2e} ({})'.format(error, 'equivalent' if error < args.tolerance else 'NOT equivalent'))
+    print('latency:           {:.2f} ms -> {:.2f} ms ({:.2f}x)'.format(latency_ms, latency_fused_ms, latency_ms / latency_fused_ms))
@@ -0,0 +1,175 @@
+##############################################################################
+# File name:    export_network.py
+# Project:      Robotic Surgery Software
+# Part:         Export of the deep network
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file converts the trained u-net to tflite and/or onnx
+#               with optional float16 or int8 post-training quantization
+#               calibrated on archived embryo crops, and reports the
+#               accuracy deltas and latency gains against the keras model.
+##############################################################################
+
+
+# Modules
+import configuration
+import computer_vision as vision
+import inference
+import numpy as np
+import cv2 as cv
+import argparse
+import glob
+import os
+
+
+def load_crops(pattern, config):
+    '''
+    loading the archived embryo crops and converting them to the input of the deep network (as in automation_annotate_embryo)
+    '''
+
+    crops = []
+    for path in sorted(glob.glob(pattern)):
+        img = cv.imread(path, cv.IMREAD_GRAYSCALE)
+        if img is None:
+            continue
+        img_rs = vision.resize_image_by_size(img, config.dn_image_size, config.dn_image_size)
+        img_in_arr = np.zeros((1, config.dn_image_size, config.dn_image_size, 1), dtype=np.float32)
+        img_in_arr[0, :, :, 0] = np.float32(img_rs) / config.dn_white_level
+        crops.append((img_in_arr, img.shape))
+    return crops
+
+
+def export_tflite(model, path, quantization, crops):
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        # the weights and activations are quantized, the input and output stay float such that the engine is unchanged
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([img_in_arr] for img_in_arr, _ in crops)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(path, 'wb') as file:
+        file.write(converter.convert())
+
+
+class CalibrationReader:
+    '''
+    feeding the archived embryo crops to the static int8 quantization of onnxruntime
+    '''
+
+    def __init__(self, input_name, crops):
+        self.samples = iter([{input_name: img_in_arr} for img_in_arr, _ in crops])
+
+    def get_next(self):
+        return next(self.samples, None)
+
+
+def export_onnx(model, path, quantization, crops, input_shape):
+    import tensorflow as tf
+    import tf2onnx
+    import onnx
+    # dynamic batch dimension such that the same model serves the single and batched predictions
+    spec = (tf.TensorSpec((None,) + tuple(input_shape[1:]), tf.float32, name='input'),)
+    model_onnx, _ = tf2onnx.convert.from_keras(model, input_signature=spec, opset=13)
+    if quantization == 'float16':
+        from onnxconverter_common import float16
+        model_onnx = float16.convert_float_to_float16(model_onnx, keep_io_types=True)
+    onnx.save(model_onnx, path)
+    if quantization == 'int8':
+        from onnxruntime import quantization as ort_quantization
+        path_float = path + '.float'
+        os.replace(path, path_float)
+        reader = CalibrationReader(model_onnx.graph.input[0].name, crops)
+        ort_quantization.quantize_static(path_float, path, reader, quant_format=ort_quantization.QuantFormat.QDQ,
+                                         activation_type=ort_quantization.QuantType.QInt8,
+                                         weight_type=ort_quantization.QuantType.QInt8)
+        os.remove(path_float)
+
+
+def calculate_mask(img_out_arr, shape, config):
+    '''
+    thresholding the output of the deep network at the size of the crop (as in automation_annotate_embryo)
+    '''
+
+    img_out_rs = vision.resize_image_by_size(img_out_arr[0, :, :, 0], shape[1], shape[0])
+    img_out_th = np.zeros(img_out_rs.shape)
+    img_out_th[img_out_rs > config.dn_threshold] = config.dn_white_level_normalized
+    return img_out_th
+
+
+def calculate_point_error(x_ref, y_ref, x_test, y_test):
+    '''
+    returning the mean distance in px from every reference somite point to the closest exported one
+    '''
+
+    if x_ref is None or x_test is None:
+        return None
+    points_ref = np.stack([x_ref, y_ref], axis=1).astype(float)
+    points_test = np.stack([x_test, y_test], axis=1).astype(float)
+    distances = np.linalg.norm(points_ref[:, None, :] - points_test[None, :, :], axis=2)
+    return np.mean(np.min(distances, axis=1))
+
+
+def evaluate(engine_ref, engine_test, crops, config):
+    ious = []
+    errors = []
+    for img_in_arr, shape in crops:
+        mask_ref = calculate_mask(engine_ref(img_in_arr), shape, config)
+        mask_test = calculate_mask(engine_test(img_in_arr), shape, config)
+        union = np.count_nonzero(np.logical_or(mask_ref, mask_test))
+        intersection = np.count_nonzero(np.logical_and(mask_ref, mask_test))
+        ious.append(intersection / union if union else 1.0)
+        x_ref, y_ref = vision.calculate_centerline_points(mask_ref, config.dn_somite_height_px)
+        x_test, y_test = vision.calculate_centerline_points(mask_test, config.dn_somite_height_px)
+        error = calculate_point_error(x_ref, y_ref, x_test, y_test)
+        if error is not None:
+            errors.append(error)
+    return np.mean(ious), np.min(ious), (np.mean(errors) if errors else None), (np.max(errors) if errors else None)
+
+
+def report(name, engine_ref, engine_test, crops, config):
+    iou_mean, iou_min, error_mean, error_max = evaluate(engine_ref, engine_test, crops, config)
+    stats_ref = engine_ref.get_latency_stats()
+    stats_test = engine_test.get_latency_stats()
+    print(name)
+    print('  mask iou:             mean {:.4f}, min {:.4f}'.format(iou_mean, iou_min))
+    if error_mean is None:
+        print('  somite point error:   no points')
+    else:
+        print('  somite point error:   mean {:.2f} px, max {:.2f} px'.format(error_mean, error_max))
+    print('  latency (median):     {:.2f} ms -> {:.2f} ms ({:.2f}x)'.format(stats_ref['median'], stats_test['median'],
+                                                                            stats_ref['median'] / stats_test['median']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='exporting the deep network to tflite and/or onnx')
+    parser.add_argument('--crops', required=True, help='glob pattern of the archived embryo crops (calibration and evaluation)')
+    parser.add_argument('--format', choices=['tflite', 'onnx', 'all'], default='all')
+    parser.add_argument('--quantization', choices=['none', 'float16', 'int8'], default='none')
+    parser.add_argument('--dn-path', default=None, help='keras weights to export (default: configuration dn_path)')
+    args = parser.parse_args()
+
+    config = configuration.Configuration()
+    if args.dn_path is not None:
+        config.dn_path = args.dn_path
+    crops = load_crops(args.crops, config)
+    if len(crops) == 0:
+        raise SystemExit('no embryo crops matched ' + args.crops)
+
+    engine_ref = inference.InferenceEngine(config)
+    formats = ['tflite', 'onnx'] if args.format == 'all' else [args.format]
+    for export_format in formats:
+        if export_format == 'tflite':
+            export_tflite(engine_ref.model, config.dn_path_tflite, args.quantization, crops)
+            engine_test = inference.TFLiteEngine(config)
+            path = config.dn_path_tflite
+        else:
+            export_onnx(engine_ref.model, config.dn_path_onnx, args.quantization, crops, engine_ref.input_shape)
+            engine_test = inference.OnnxEngine(config)
+            path = config.dn_path_onnx
+        engine_ref.latencies_ms.clear()
+        report('{} ({}, quantization: {}, {:.1f} MB)'.format(path, export_format, args.quantization, os.path.getsize(path) / 2**20),
+               engine_ref, engine_test, crops, config)
@@ -16,12 +16,14 @@
 import auxiliary as aux
 import worker_threads as wt
 import computer_vision as vision
-import deep_network as dn
+import tracking
+import tracing
+import performance
 from PyQt5.QtWidgets import QMainWindow, QWidget
 from PyQt5.QtWidgets import QGridLayout, QVBoxLayout, QHBoxLayout
 from PyQt5.QtWidgets import QGroupBox, QLabel, QPushButton, QSpinBox, QMessageBox, QLineEdit, QTextEdit, QComboBox
 from PyQt5.QtGui import QPixmap, QFont, QIcon, QColor
-from PyQt5.QtCore import Qt, pyqtSlot, QThreadPool
+from PyQt5.QtCore import Qt, pyqtSlot, QThreadPool, QTimer
 import pyqtgraph as pg
 import os
 import numpy as np
@@ -68,9 +70,10 @@ class GUI(QMainWindow):
         self.camera = camera
         self.config = config
         self.ppi = ppi
-        self.model = dn.load_model(self.config.dn_path, self.config.dn_image_size, self.config.dn_filters_num, 
-                                   self.config.dn_kernel_size, self.config.dn_stride, self.config.dn_dropout,
-                                   self.config.dn_flag_batch_norm)
+        self.model = None                   # loaded in the background only when the deep network is used
+        self.flag_model_loading = False
+        self.tip_tracker = tracking.ToolTipTracker(self.config)    # shared by the camera (tracking) and automation (anchoring) threads
+        aux.load_calibration(self.config)   # pixel to stage transform of the current objective (if calibrated)
         # loading the images
         self.image_black = QPixmap(self.config.gui_directory+'black.png')
         self.image_red_cross = QPixmap(self.config.gui_directory+'redCross.png')
@@ -126,6 +129,8 @@ class GUI(QMainWindow):
         self.widget_middle = QWidget()
         self.widget_middle.setLayout(self.layout_middle)
         self.widget_middle.setFixedSize(int(self.ppi * 6.5), int(self.ppi * 7.8))
+        # # performance panel (collapsible, next to the camera image)
+        self.create_performance_layout()
         # # right panel (setting)
         self.create_setting_layout()
         self.group_box_setting.setFixedSize(int(self.ppi * 3.75), int(self.ppi * 7.8))
@@ -135,6 +140,7 @@ class GUI(QMainWindow):
         self.layout_general = QHBoxLayout()
         self.layout_general.addWidget(self.widget_left)
         self.layout_general.addWidget(self.widget_middle)
+        self.layout_general.addWidget(self.group_box_performance)
         self.layout_general.addWidget(self.group_box_setting)
         self.centralWidget = QWidget(self)
         self.setCentralWidget(self.centralWidget)
@@ -160,6 +166,9 @@ class GUI(QMainWindow):
         self.worker_gamepad.signals.progress_position.connect(self.update_position)
         self.worker_gamepad.signals.progress_text_edit.connect(self.update_text_edit)
         self.thread_pool.start(self.worker_gamepad)
+        # loading the deep network if it is already selected
+        if self.config.annotation_embryo_flag_cv_dn or self.config.automation_flag_cv_dn:
+            self.load_model()
     
     def closeEvent(self, event):
         '''
@@ -175,6 +184,9 @@ class GUI(QMainWindow):
             self.camera.Close()
             self.thread_pool.waitForDone(self.config.gui_close_window_time_ms)
             self.thread_pool.clear()
+            # exporting the spans of the workers (run.py --trace) before exiting
+            if self.config.trace_flag_enabled and self.config.trace_path is not None:
+                tracing.export_chrome_trace(self.config.trace_path)
             os._exit(0)
         else:
             event.ignore()
@@ -584,8 +596,8 @@ class GUI(QMainWindow):
                 self.config.coords_temp.pop()
             else:
                 # preparing the movement of smaract channels to the target location
-                y_movement = (self.config.coords_temp[1][1] - self.config.coords_temp[0][1]) * self.config.pixel_to_mili * self.config.mili_to_nano
-                x_movement = (self.config.coords_temp[1][0] - self.config.coords_temp[0][0]) * self.config.pixel_to_mili * self.config.mili_to_nano
+                x_movement, y_movement = aux.pixel_to_stage(self.config, self.config.coords_temp[0][0] - self.config.coords_temp[1][0],
+                                                            self.config.coords_temp[0][1] - self.config.coords_temp[1][1])
                 speed = self.config.smaract_linear_speed_on_click
                 if not aux.smaract_is_valid_relative_movement(self.config, self.config.smaract_channel_x, self.smaract.get_channel_position(self.config.smaract_channel_x), x_movement):
                     self.update_text_edit(self.config.smaract_err_x_not_reachable, self.config.text_edit_mode_err)
@@ -672,6 +684,20 @@ class GUI(QMainWindow):
         self.button_reconnection.setStyleSheet('background-color: #fe8a71; color: white; text-align: center; padding-bottom: 3px;')
         self.button_reconnection.clicked.connect(self.action_button_reconnection)
         self.button_reconnection.setEnabled(False)
+        # creating the Performance button (showing or hiding the performance panel)
+        self.button_performance = QPushButton(self.config.performance_panel_title)
+        self.button_performance.setFont(self.button_middle_font)
+        self.button_performance.setFixedHeight(self.button_middle_height)
+        self.button_performance.setStyleSheet('background-color: #2E4053; color: white; text-align: center; padding-bottom: 3px;')
+        self.button_performance.setCheckable(True)
+        self.button_performance.setEnabled(self.config.performance_flag_enabled)
+        self.button_performance.clicked.connect(self.action_button_performance)
+        # creating the Calibrate button
+        self.button_calibration = QPushButton('Calibrate')
+        self.button_calibration.setFont(self.button_middle_font)
+        self.button_calibration.setFixedHeight(self.button_middle_height)
+        self.button_calibration.setStyleSheet('background-color: #5D6D7E; color: white; text-align: center; padding-bottom: 3px;')
+        self.button_calibration.clicked.connect(self.action_button_calibration)
         # positioning the widgets in the layout (widget name, row, column, rowspan, colspan)
         self.layout_control_middle.addWidget(self.button_camera_start, 0, 0, 1, 1)
         self.layout_control_middle.addWidget(self.button_camera_stop, 0, 1, 1, 1)
@@ -682,6 +708,8 @@ class GUI(QMainWindow):
         self.layout_control_middle.addWidget(self.button_automation_start, 2, 0, 1, 1)
         self.layout_control_middle.addWidget(self.button_automation_stop, 2, 1, 1, 1)
         self.layout_control_middle.addWidget(self.button_reconnection, 2, 2, 1, 1)
+        self.layout_control_middle.addWidget(self.button_calibration, 3, 0, 1, 2)
+        self.layout_control_middle.addWidget(self.button_performance, 3, 2, 1, 1)
         # grouping the above widgets
         self.widget_control_middle = QWidget()
         self.widget_control_middle.setLayout(self.layout_control_middle)
@@ -694,8 +722,9 @@ class GUI(QMainWindow):
 
         self.button_camera_start.setEnabled(False)
         self.config.camera_flag_off = False
-        self.worker_camera = wt.WorkerCamera(self.camera, self.config)
+        self.worker_camera = wt.WorkerCamera(self.camera, self.config, self.tip_tracker)
         self.worker_camera.signals.progress.connect(self.update_camera_image_view)
+        self.worker_camera.signals.progress_tip.connect(self.update_tip)
         self.thread_pool.start(self.worker_camera)
         self.button_camera_stop.setEnabled(True)
 
@@ -739,6 +768,10 @@ class GUI(QMainWindow):
         if self.config.camera_flag_off:
             self.update_text_edit(self.config.camera_err_off, self.config.text_edit_mode_err)
             return
+        if self.config.annotation_embryo_flag_cv_dn and self.model is None:
+            self.load_model()
+            self.update_text_edit(self.config.dn_err_not_ready, self.config.text_edit_mode_err)
+            return
         # initializing
         self.button_annotate_embryo.setEnabled(False)
         if self.config.annotation_flag_stop_camera:
@@ -825,9 +858,13 @@ class GUI(QMainWindow):
         if self.config.camera_flag_off:
             self.update_text_edit(self.config.camera_err_off, self.config.text_edit_mode_err)
             return
+        if self.config.automation_flag_cv_dn and self.model is None:
+            self.load_model()
+            self.update_text_edit(self.config.dn_err_not_ready, self.config.text_edit_mode_err)
+            return
         self.button_automation_start.setEnabled(False)
         self.config.automation_flag_stopped = False
-        self.worker_automation = wt.WorkerAutomation(self.smaract, self.asm, self.pistage, self.camera, self.config, self.model)
+        self.worker_automation = wt.WorkerAutomation(self.smaract, self.asm, self.pistage, self.camera, self.config, self.model, self.tip_tracker)
         self.worker_automation.signals.progress_position.connect(self.update_position)
         self.worker_automation.signals.progress_text_edit.connect(self.update_text_edit)
         self.worker_automation.signals.progress_coord.connect(self.update_coord)
@@ -835,6 +872,22 @@ class GUI(QMainWindow):
         self.thread_pool.start(self.worker_automation)
         self.button_automation_stop.setEnabled(True)
     
+    def action_button_calibration(self):
+        '''
+        calibrating the transform between the pixels and the smaract x/y positions with the scissor in the field of view
+        this function is called when the user clicks the 'Calibrate' button.
+        '''
+
+        if self.config.camera_flag_off:
+            self.update_text_edit(self.config.camera_err_off, self.config.text_edit_mode_err)
+            return
+        self.button_calibration.setEnabled(False)
+        self.worker_calibration = wt.WorkerCalibration(self.smaract, self.config)
+        self.worker_calibration.signals.progress_position.connect(self.update_position)
+        self.worker_calibration.signals.progress_text_edit.connect(self.update_text_edit)
+        self.worker_calibration.signals.progress_button.connect(self.update_button_calibration)
+        self.thread_pool.start(self.worker_calibration)
+
     def action_button_automation_stop(self):
         '''
         this function is called when the user clicks the 'Stop Automation' button.
@@ -846,6 +899,20 @@ class GUI(QMainWindow):
         self.update_text_edit(self.config.automation_message_stopped, self.config.text_edit_mode_err)
         self.button_reconnection.setEnabled(True)
 
+    def load_model(self):
+        '''
+        starting the background loading of the deep network if it is neither loaded nor being loaded
+        '''
+
+        if self.model is not None or self.flag_model_loading:
+            return
+        self.flag_model_loading = True
+        self.update_text_edit(self.config.dn_message_loading, self.config.text_edit_mode_info)
+        self.worker_model_loading = wt.WorkerModelLoading(self.config)
+        self.worker_model_loading.signals.progress_model.connect(self.update_model)
+        self.worker_model_loading.signals.progress_text_edit.connect(self.update_text_edit)
+        self.thread_pool.start(self.worker_model_loading)
+
     def action_button_reconnection(self):
         '''
         this function is called when the user clicks the 'Reconnect' button.
@@ -881,6 +948,99 @@ class GUI(QMainWindow):
             img_show[:, :, 0] = img_drawn[:, :, 2]
             img_show[:, :, 2] = img_drawn[:, :, 0]
             self.camera_image_view.setImage(img_show)
+        performance.add('display_frames', 1)
+
+    def create_performance_layout(self):
+        '''
+        creating the performance panel in the gui (hidden until the Performance button is clicked)
+        the plots are fed by the counters of performance.py: camera and display fps, latency of the annotation stages, of
+        the inference and of the device round trips, and the cycle time of the wells.
+        '''
+
+        self.performance_width = int(self.ppi * 4.0)
+        self.performance_plot_widget = pg.GraphicsLayoutWidget()
+        self.performance_plot_widget.setBackground('w')
+        self.performance_plots, self.performance_curves = {}, {}
+        for row, (name, title, unit) in enumerate([('camera', 'Camera', 'fps'), ('vision', 'Annotation stages', 'ms'),
+                                                   ('inference', 'Inference', 'ms'), ('devices', 'Device round trips', 'ms'),
+                                                   ('well', 'Well cycle', 's')]):
+            plot = self.performance_plot_widget.addPlot(row=row, col=0, title=title)
+            plot.setLabel('left', unit)
+            plot.setXRange(-self.config.performance_window_s, 0)
+            plot.showGrid(x=True, y=True, alpha=0.3)
+            plot.addLegend(offset=(1, 1), labelTextSize='7pt')
+            self.performance_plots[name] = plot
+        self.performance_plots['well'].setLabel('bottom', 's')
+        self.label_performance_text = QLabel(self.config.gui_empty_text)
+        self.label_performance_text.setFont(QFont(self.font_name, self.font_size_setting))
+        self.layout_performance = QVBoxLayout()
+        self.layout_performance.addWidget(self.label_performance_text)
+        self.layout_performance.addWidget(self.performance_plot_widget)
+        self.group_box_performance = QGroupBox(self.config.performance_panel_title)
+        self.group_box_performance.setLayout(self.layout_performance)
+        self.group_box_performance.setFixedSize(self.performance_width, int(self.ppi * 7.8))
+        self.group_box_performance.hide()
+        # refreshing the plots only while the panel is shown
+        self.timer_performance = QTimer()
+        self.timer_performance.setInterval(self.config.performance_refresh_ms)
+        self.timer_performance.timeout.connect(self.update_performance_panel)
+
+    def action_button_performance(self):
+        '''
+        showing or hiding the performance panel
+        this function is called when the user clicks the 'Performance' button. the samples are only kept while the panel
+        is shown, such that the workers and the traced spans cost nothing otherwise.
+        '''
+
+        if self.button_performance.isChecked():
+            performance.enable(self.config)
+            self.group_box_performance.show()
+            self.setFixedSize(self.gui_width + self.performance_width, self.gui_height)
+            self.update_performance_panel()
+            self.timer_performance.start()
+        else:
+            self.timer_performance.stop()
+            performance.disable()
+            self.group_box_performance.hide()
+            self.setFixedSize(self.gui_width, self.gui_height)
+
+    def set_performance_curve(self, plot_name, name, times, values):
+        '''
+        updating the curve of name in the plot (created the first time the counter has samples)
+        '''
+
+        if name not in self.performance_curves:
+            if len(times) == 0:
+                return
+            color = pg.intColor(len(self.performance_plots[plot_name].listDataItems()), hues=6)
+            self.performance_curves[name] = self.performance_plots[plot_name].plot(name=name.split('.')[0], pen=pg.mkPen(color, width=1.5),
+                                                                                   symbol='o', symbolSize=3, symbolPen=None, symbolBrush=color)
+        self.performance_curves[name].setData(times, values)
+
+    @pyqtSlot()
+    def update_performance_panel(self):
+        '''
+        plotting the samples of the counters over the last performance_window_s
+        this function is called by the timer of the performance panel.
+        '''
+
+        window_s, bin_s = self.config.performance_window_s, self.config.performance_rate_bin_s
+        for name in ['camera_frames', 'display_frames']:
+            self.set_performance_curve('camera', name, *performance.get_rate_series(name, window_s, bin_s))
+        for name in self.config.performance_vision_stages:
+            times, values = performance.get_samples(name, window_s)
+            self.set_performance_curve('vision', name, times, 1000 * values)
+        times, values = performance.get_samples('inference', window_s)
+        self.set_performance_curve('inference', 'inference', times, 1000 * values)
+        for name in self.config.performance_device_round_trips:
+            times, values = performance.get_samples(name, window_s)
+            self.set_performance_curve('devices', name, times, 1000 * values)
+        self.set_performance_curve('well', 'well_cycle', *performance.get_samples('well_cycle', window_s))
+        _, drops = performance.get_samples('camera_drops', window_s)
+        rate_window_s = self.config.performance_rate_window_s
+        self.label_performance_text.setText('camera {:.1f} fps ({:.1f} skipped/s), display {:.1f} fps, {:d} drops in {:d} s'.format(
+            performance.get_rate('camera_frames', rate_window_s), performance.get_rate('camera_skipped', rate_window_s),
+            performance.get_rate('display_frames', rate_window_s), int(np.sum(drops)), window_s))
 
     def create_microbs_layout(self):
         '''
@@ -1981,6 +2141,8 @@ class GUI(QMainWindow):
                 self.line_edit_annotation_embryo.setText(str(self.config.annotation_embryo_flag_cv_dn))
             else:
                 self.config.annotation_embryo_flag_cv_dn = temp
+                if temp:
+                    self.load_model()
 
     def on_annotation_scissor_combo_box(self, index):
         '''
@@ -2198,6 +2360,8 @@ class GUI(QMainWindow):
                 self.line_edit_automation.setText(str(self.config.automation_flag_cv_dn))
             else:
                 self.config.automation_flag_cv_dn = temp
+                if temp:
+                    self.load_model()
         elif index == 11:   # waiting time for the development experiment
             try:
                 temp = int(self.line_edit_automation.text())
@@ -2467,6 +2631,18 @@ class GUI(QMainWindow):
             self.label_tool_text.setText('x: {:d}, y: {:d}'.format(int(self.config.coords_tool[-1][0]), int(self.config.coords_tool[-1][1])))
             self.label_tool_text.setStyleSheet('color: green;')
 
+    @pyqtSlot(object, float)
+    def update_tip(self, tip, score):
+        '''
+        this function is called when the tip tracker has processed a new camera image. it updates the tool coordinates shown in the gui.
+        '''
+
+        if tip is None:
+            self.label_tool_text.setStyleSheet('color: red;')
+            return
+        self.label_tool_text.setText('x: {:d}, y: {:d}'.format(int(tip[0]), int(tip[1])))
+        self.label_tool_text.setStyleSheet('color: green;')
+
     @pyqtSlot()
     def update_button_smaract_positioning(self):
         self.button_smaract_positioning.setEnabled(True)
@@ -2483,6 +2659,15 @@ class GUI(QMainWindow):
     def update_button_sequence(self):
         self.button_sequence.setEnabled(True)
 
+    @pyqtSlot(object)
+    def update_model(self, model):
+        self.model = model
+        self.flag_model_loading = False
+
     @pyqtSlot()
     def update_button_automation_start(self):
         self.button_automation_start.setEnabled(True)
+
+    @pyqtSlot()
+    def update_button_calibration(self):
+        self.button_calibration.setEnabled(True)
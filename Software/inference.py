@@ -0,0 +1,274 @@
+##############################################################################
+# File name:    inference.py
+# Project:      Robotic Surgery Software
+# Part:         Inference of the deep network
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file wraps the u-net of deep_network.py into an
+#               inference engine that keeps a warm, traced graph and
+#               records the latency of every prediction. The exported
+#               tflite and onnx models run through the same interface.
+#               Crops can also be predicted in batches for the pre-scan
+#               of a plate or the offline reprocessing of archived crops.
+#               The cpu runtime settings (threads, affinity, onednn and
+#               precision) are applied when an engine is created.
+##############################################################################
+
+
+# Modules
+import numpy as np
+import collections
+import argparse
+import json
+import time
+import os
+
+
+class InferenceEngine:
+    '''
+    u-net wrapped in a traced tf.function with a fixed single-image input signature
+    the graph is traced and warmed up once at creation, so a prediction only costs the forward pass and not the
+    dataset and tracing overhead of keras predict.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.input_shape = (1, self.config.dn_image_size, self.config.dn_image_size, 1)
+        self.batch_shape = (self.config.dn_batch_size, self.config.dn_image_size, self.config.dn_image_size, 1)
+        self.batch_arr = None       # preallocated nhwc input of the batched predictions, created by the first predict_batch
+        self.latencies_ms = collections.deque(maxlen=self.config.dn_latency_window)
+        self.load()
+        self.warm_up_time_ms = self.warm_up()
+
+    def load(self):
+        # tensorflow is imported here such that the other backends do not depend on it
+        os.environ['TF_ENABLE_ONEDNN_OPTS'] = str(int(self.config.dn_flag_onednn))     # only read when tensorflow is imported
+        import deep_network as dn
+        import tensorflow as tf
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(self.config.dn_threads_intra_op)
+            tf.config.threading.set_inter_op_parallelism_threads(self.config.dn_threads_inter_op)
+        except RuntimeError:
+            pass    # the runtime of tensorflow is already initialized (an engine was created before) and keeps its threads
+        tf.keras.mixed_precision.set_global_policy(self.config.dn_precision)
+        self.model = dn.load_model(self.config.dn_path, self.config.dn_image_size, self.config.dn_filters_num,
+                                   self.config.dn_kernel_size, self.config.dn_stride, self.config.dn_dropout,
+                                   self.config.dn_flag_batch_norm, self.config.dn_flag_fused)
+        self.function = tf.function(self.forward, input_signature=[tf.TensorSpec(shape=self.input_shape, dtype=tf.float32)])
+
+    def load_batch(self):
+        # only built when a batch is predicted, such that loading the model for the automation does not pay for it
+        import tensorflow as tf
+        self.function_batch = tf.function(self.forward, input_signature=[tf.TensorSpec(shape=self.batch_shape, dtype=tf.float32)])
+
+    def forward(self, img_in_arr):
+        import tensorflow as tf
+        return tf.cast(self.model(img_in_arr, training=False), tf.float32)
+
+    def run(self, img_in_arr):
+        return self.function(img_in_arr).numpy()
+
+    def run_batch(self, batch_arr):
+        return self.function_batch(batch_arr).numpy()
+
+    def warm_up(self):
+        '''
+        tracing the graph and running it a few times such that the first real prediction is not slower than the others
+        '''
+
+        time_start = time.perf_counter()
+        img_in_arr = np.zeros(self.input_shape, dtype=np.float32)
+        for _ in range(self.config.dn_warm_up_iterations):
+            self.run(img_in_arr)
+        return 1000 * (time.perf_counter() - time_start)
+
+    def __call__(self, img_in_arr):
+        time_start = time.perf_counter()
+        img_out_arr = self.run(img_in_arr)
+        self.latencies_ms.append(1000 * (time.perf_counter() - time_start))
+        return img_out_arr
+
+    def predict_batch(self, imgs):
+        '''
+        predicting the output of the deep network for a list of crops already resized to dn_image_size
+        the crops are written into the preallocated input tensor and run dn_batch_size at a time. the last batch
+        is run at full size as well (the unused slots keep the previous crops) such that only one batch shape is
+        ever traced, and only the outputs of the given crops are returned. the batched graph (or interpreter) is created
+        by the first call.
+        '''
+
+        if self.batch_arr is None:
+            self.load_batch()
+            self.batch_arr = np.zeros(self.batch_shape, dtype=np.float32)
+        imgs_out = np.zeros((len(imgs), self.config.dn_image_size, self.config.dn_image_size), dtype=np.float32)
+        for id_start in range(0, len(imgs), self.config.dn_batch_size):
+            num = min(self.config.dn_batch_size, len(imgs) - id_start)
+            for i in range(num):
+                np.divide(imgs[id_start+i], self.config.dn_white_level, out=self.batch_arr[i, :, :, 0], casting='unsafe')
+            batch_out_arr = self.run_batch(self.batch_arr)
+            imgs_out[id_start:id_start+num] = batch_out_arr[:num, :, :, 0]
+        return imgs_out
+
+    def get_latency_stats(self):
+        if len(self.latencies_ms) == 0:
+            return None
+        latencies_ms = np.array(self.latencies_ms)
+        return {'count': len(latencies_ms), 'last': latencies_ms[-1], 'mean': np.mean(latencies_ms),
+                'median': np.median(latencies_ms), 'p95': np.percentile(latencies_ms, 95), 'max': np.max(latencies_ms)}
+
+    def get_latency_text(self):
+        stats = self.get_latency_stats()
+        if stats is None:
+            return self.config.dn_message_latency + self.config.gui_empty_text
+        return self.config.dn_message_latency + 'mean {:.1f} ms, median {:.1f} ms, p95 {:.1f} ms, max {:.1f} ms ({:d} predictions)'.format(
+               stats['mean'], stats['median'], stats['p95'], stats['max'], stats['count'])
+
+
+class TFLiteEngine(InferenceEngine):
+    '''
+    exported tflite model run by the tflite interpreter on cpu (the standalone tflite-runtime package is used if installed)
+    '''
+
+    def create_interpreter(self):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        num_threads = self.config.dn_threads_intra_op if self.config.dn_threads_intra_op else None
+        return Interpreter(model_path=self.config.dn_path_tflite, num_threads=num_threads)
+
+    def load(self):
+        self.interpreter = self.create_interpreter()
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+
+    def load_batch(self):
+        # a second interpreter resized to the batch shape such that single and batched predictions do not reallocate
+        self.interpreter_batch = self.create_interpreter()
+        self.interpreter_batch.resize_tensor_input(self.input_details['index'], self.batch_shape)
+        self.interpreter_batch.allocate_tensors()
+
+    def run(self, img_in_arr):
+        self.interpreter.set_tensor(self.input_details['index'], img_in_arr)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_details['index'])
+
+    def run_batch(self, batch_arr):
+        self.interpreter_batch.set_tensor(self.input_details['index'], batch_arr)
+        self.interpreter_batch.invoke()
+        return self.interpreter_batch.get_tensor(self.output_details['index'])
+
+
+class OnnxEngine(InferenceEngine):
+    '''
+    exported onnx model run by onnxruntime on cpu
+    '''
+
+    def load(self):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.config.dn_threads_intra_op
+        options.inter_op_num_threads = self.config.dn_threads_inter_op
+        self.session = ort.InferenceSession(self.config.dn_path_onnx, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def load_batch(self):
+        return      # the batch dimension of the exported onnx model is dynamic, the same session runs the batches
+
+    def run(self, img_in_arr):
+        return self.session.run(None, {self.input_name: img_in_arr})[0]
+
+    def run_batch(self, batch_arr):
+        # the batch dimension of the exported onnx model is dynamic
+        return self.session.run(None, {self.input_name: batch_arr})[0]
+
+
+def load_runtime_profile(config):
+    '''
+    overwriting the runtime settings of the configuration with the best profile written by tune_inference.py (if any)
+    '''
+
+    if not os.path.isfile(config.dn_profile_path):
+        return False
+    with open(config.dn_profile_path) as file:
+        profile = json.load(file)
+    for name in config.dn_profile_names:
+        if name in profile:
+            setattr(config, name, profile[name])
+    return True
+
+
+def set_cpu_affinity(cores):
+    '''
+    restricting the calling thread (and the threads it starts afterwards) to the given cores and returning its previous cores
+    only linux sets the affinity per thread. elsewhere the affinity of the whole process (gui and camera included) would
+    be restricted, so it is not set and None is returned.
+    '''
+
+    if not hasattr(os, 'sched_setaffinity'):
+        return None
+    cores_previous = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, cores)
+    return cores_previous
+
+
+def create_inference_engine(config):
+    '''
+    creating the inference engine of the backend selected in the configuration
+    '''
+
+    if config.dn_flag_profile:
+        load_runtime_profile(config)
+    # the thread pools of the runtime are started by the warm up of the engine and keep the affinity, the calling thread
+    # (a worker of the thread pool of the gui, reused later by the camera and automation workers) gets its cores back
+    cores_previous = set_cpu_affinity(config.dn_cpu_affinity) if config.dn_cpu_affinity else None
+    try:
+        if config.dn_backend == config.dn_backend_tflite:
+            return TFLiteEngine(config)
+        elif config.dn_backend == config.dn_backend_onnx:
+            return OnnxEngine(config)
+        return InferenceEngine(config)
+    finally:
+        if cores_previous is not None:
+            os.sched_setaffinity(0, cores_previous)
+
+
+def benchmark_batch(config, batch_sizes, num_images):
+    '''
+    printing the throughput of the batched prediction against the batch size
+    '''
+
+    imgs = np.random.default_rng(0).integers(0, config.dn_white_level, (num_images, config.dn_image_size, config.dn_image_size))
+    engine = create_inference_engine(config)
+    time_start = time.perf_counter()
+    for img in imgs:
+        engine(np.float32(img[None, :, :, None]) / config.dn_white_level)
+    throughput_single = num_images / (time.perf_counter() - time_start)
+    print('single image: {:7.1f} images/s'.format(throughput_single))
+    for batch_size in batch_sizes:
+        config.dn_batch_size = batch_size
+        engine = create_inference_engine(config)
+        engine.predict_batch(imgs[:batch_size])     # building and warming up the batched graph
+        time_start = time.perf_counter()
+        engine.predict_batch(imgs)
+        throughput = num_images / (time.perf_counter() - time_start)
+        print('batch size {:3d}: {:7.1f} images/s ({:.2f}x)'.format(batch_size, throughput, throughput / throughput_single))
+
+
+if __name__ == '__main__':
+    import configuration
+    parser = argparse.ArgumentParser(description='throughput of the batched inference against the batch size')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--images', type=int, default=64)
+    parser.add_argument('--backend', type=int, default=None, help='0: tensorflow, 1: tflite, 2: onnx (default: configuration dn_backend)')
+    parser.add_argument('--dn-path', default=None, help='keras weights (default: configuration dn_path)')
+    args = parser.parse_args()
+    config = configuration.Configuration()
+    if args.backend is not None:
+        config.dn_backend = args.backend
+    if args.dn_path is not None:
+        config.dn_path = args.dn_path
+    benchmark_batch(config, args.batch_sizes, args.images)
@@ -0,0 +1,255 @@
+##############################################################################
+# File name:    metrics.py
+# Project:      Robotic Surgery Software
+# Part:         Metrics exporter of the rig
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file counts the frames grabbed, skipped and dropped by
+#               the camera, the annotations succeeded and failed per error,
+#               the latency of the device commands and the wells completed
+#               by the automation with their cycle time, and serves them on
+#               a local http endpoint (/metrics) in the prometheus text
+#               exposition format, such that the rigs can be scraped by a
+#               prometheus server. The counters are fed by the traced device
+#               calls, the samples of performance.py and the annotation
+#               functions of auxiliary.py.
+##############################################################################
+
+
+# Modules
+import performance
+import tracing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import functools
+import threading
+import bisect
+import re
+
+
+flag_enabled = False
+lock = threading.Lock()
+counters = {}               # (name, labels) -> value
+histograms = {}             # (name, labels) -> [counts of the buckets, sum, count]
+buckets = {}                # name -> upper bounds of the buckets
+err_names = {}              # err text -> name of the err in the configuration
+devices = set()             # categories of the traced spans counted as device commands
+# name -> (type, help) in the order of the exposition
+descriptions = {'camera_frames_grabbed_total': ('counter', 'frames grabbed by the camera'),
+                'camera_frames_skipped_total': ('counter', 'frames overwritten in the camera buffer before being grabbed'),
+                'camera_frames_dropped_total': ('counter', 'grabs of the camera that failed or timed out'),
+                'annotations_total': ('counter', 'annotations by stage and result'),
+                'annotation_errors_total': ('counter', 'failed annotations by stage and error'),
+                'device_command_seconds': ('histogram', 'latency of the device commands'),
+                'automation_wells_total': ('counter', 'wells completed by the automation'),
+                'automation_wells_dissected_total': ('counter', 'wells dissected by the automation'),
+                'automation_well_cycle_seconds': ('histogram', 'cycle time of the wells (time of the rig)')}
+# samples of performance.py -> counter incremented by the value
+sample_counters = {'camera_frames': 'camera_frames_grabbed_total',
+                   'camera_skipped': 'camera_frames_skipped_total',
+                   'camera_drops': 'camera_frames_dropped_total',
+                   'well_dissected': 'automation_wells_dissected_total'}
+
+
+def enable(config):
+    '''
+    starting to count (the devices must be wrapped by tracing.TracedDevice for their commands to be counted)
+    '''
+
+    global flag_enabled, devices
+    buckets['device_command_seconds'] = list(config.metrics_device_buckets_s)
+    buckets['automation_well_cycle_seconds'] = list(config.metrics_well_cycle_buckets_s)
+    # the annotation errors are labelled by their name in the configuration (e.g. annotation_embryo_err_no_circle)
+    err_names.update({value: name for name, value in vars(config).items() if '_err_' in name and isinstance(value, str)})
+    devices = set(config.metrics_devices)
+    flag_enabled = True
+    tracing.add_listener(on_span)
+    performance.add_listener(on_sample)
+
+
+def disable():
+    global flag_enabled
+    flag_enabled = False
+    tracing.remove_listener(on_span)
+    performance.remove_listener(on_sample)
+
+
+def clear():
+    with lock:
+        counters.clear()
+        histograms.clear()
+
+
+def inc(name, value=1, **labels):
+    if not flag_enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    if not flag_enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    bounds = buckets[name]
+    with lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [[0] * len(bounds), 0, 0]
+        index = bisect.bisect_left(bounds, value)
+        if index < len(bounds):
+            histogram[0][index] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def on_span(name, category, time_start, time_end):
+    if category in devices:
+        observe('device_command_seconds', time_end - time_start, device=category, command=name.split('.', 1)[-1])
+
+
+def on_sample(name, value):
+    if name in sample_counters:
+        inc(sample_counters[name], value)
+    elif name == 'well_cycle':
+        inc('automation_wells_total')
+        observe('automation_well_cycle_seconds', value)
+
+
+def count_annotation(stage, flag, err):
+    if flag:
+        inc('annotations_total', stage=stage, result='succeeded')
+    else:
+        inc('annotations_total', stage=stage, result='failed')
+        inc('annotation_errors_total', stage=stage, error=err_names.get(err, 'other'))
+
+
+def annotation(stage):
+    '''
+    decorator counting the result of an annotation function (returning flag and err last) under stage
+    '''
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            result = function(*args, **kwargs)
+            if flag_enabled:
+                count_annotation(stage, result[-2], result[-1])
+            return result
+        return wrapper
+    return decorator
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ''
+    texts = ['{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in labels]
+    return '{' + ','.join(texts) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def get_text():
+    '''
+    returning the metrics in the prometheus text exposition format (version 0.0.4)
+    '''
+
+    with lock:
+        items_counter = sorted(counters.items())
+        items_histogram = sorted((key, [list(histogram[0]), histogram[1], histogram[2]]) for key, histogram in histograms.items())
+    lines = []
+    for name, (kind, text_help) in descriptions.items():
+        lines.append('# HELP {} {}'.format(name, text_help))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        if kind == 'counter':
+            for (name_counter, labels), value in items_counter:
+                if name_counter == name:
+                    lines.append('{}{} {}'.format(name, format_labels(labels), format_value(value)))
+            continue
+        for (name_histogram, labels), (counts, total, count) in items_histogram:
+            if name_histogram != name:
+                continue
+            cumulative = 0
+            for bound, count_bucket in zip(buckets[name], counts):
+                cumulative += count_bucket
+                lines.append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', format_value(float(bound))),)), cumulative))
+            lines.append('{}_bucket{} {}'.format(name, format_labels(labels + (('le', '+Inf'),)), count))
+            lines.append('{}_sum{} {}'.format(name, format_labels(labels), format_value(float(total))))
+            lines.append('{}_count{} {}'.format(name, format_labels(labels), count))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    '''
+    serving get_text on /metrics
+    '''
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = get_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # the scrapes are not printed in the console of the software
+        return
+
+
+def start_server(config):
+    '''
+    serving the metrics on config.metrics_host:config.metrics_port in a daemon thread and returning the server
+    the port is chosen by the system if config.metrics_port is 0 (server.server_address gives it).
+    '''
+
+    server = ThreadingHTTPServer((config.metrics_host, config.metrics_port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    return server
+
+
+def parse_text(text):
+    '''
+    parsing the text exposition format into {(name, labels): value} and {name: type}
+    '''
+
+    samples, types = {}, {}
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            types[name] = kind
+        elif len(line) > 0 and not line.startswith('#'):
+            name_labels, value = line.rsplit(' ', 1)
+            labels = ()
+            if '{' in name_labels:
+                name, text_labels = name_labels[:-1].split('{', 1)
+                labels = tuple(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', text_labels))
+            else:
+                name = name_labels
+            samples[(name, labels)] = float(value)
+    return samples, types
+
+
+if __name__ == '__main__':
+    # serving a few counters and printing the scraped exposition (test_metrics.py checks it)
+    import configuration
+    import urllib.request
+    config = configuration.Configuration()
+    config.metrics_port = 0
+    enable(config)
+    server = start_server(config)
+    count_annotation('embryo', True, None)
+    count_annotation('embryo', False, config.annotation_embryo_err_no_circle)
+    for name, value in [('camera_frames', 1), ('camera_frames', 1), ('camera_skipped', 3), ('well_cycle', 12.5), ('well_dissected', 1)]:
+        performance.add(name, value)
+    with urllib.request.urlopen('http://{}:{}/metrics'.format(*server.server_address[:2])) as response:
+        print(response.read().decode('utf-8'))
+    server.shutdown()
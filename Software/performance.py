@@ -0,0 +1,157 @@
+##############################################################################
+# File name:    performance.py
+# Project:      Robotic Surgery Software
+# Part:         Performance counters of the worker threads
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file keeps the recent samples of the counters updated
+#               by the workers (camera frames and drops, displayed frames,
+#               well cycle time) and of the traced vision stages, inference
+#               and device calls, which the performance panel of the gui
+#               plots live. The counters are off until enable is called,
+#               and a sample then costs one deque append. The samples can
+#               also be passed to listeners (the metrics exporter).
+##############################################################################
+
+
+# Modules
+import tracing
+import collections
+import numpy as np
+import time
+
+
+flag_enabled = False        # samples are taken (kept and/or passed to the listeners)
+flag_recording = False
+listeners = []              # functions called with (name, value)
+categories = set()          # categories of the traced spans kept as samples
+series = {}                 # name -> deque of (time in s, value)
+max_samples = 2000
+
+
+def enable(config):
+    '''
+    starting to keep the samples of the counters and of the traced spans of config.performance_categories
+    '''
+
+    global flag_recording, categories, max_samples
+    categories = set(config.performance_categories)
+    max_samples = config.performance_max_samples
+    flag_recording = True
+    update_flag()
+    tracing.add_listener(on_span)
+
+
+def disable():
+    global flag_recording
+    flag_recording = False
+    update_flag()
+    tracing.remove_listener(on_span)
+
+
+def update_flag():
+    global flag_enabled
+    flag_enabled = flag_recording or len(listeners) > 0
+
+
+def add_listener(listener):
+    if listener not in listeners:
+        listeners.append(listener)
+    update_flag()
+
+
+def remove_listener(listener):
+    if listener in listeners:
+        listeners.remove(listener)
+    update_flag()
+
+
+def clear():
+    series.clear()
+
+
+def add(name, value, time_now=None):
+    '''
+    adding a sample to the series of name (a latency in s, or a number of events for the rates)
+    '''
+
+    if not flag_enabled:
+        return
+    if flag_recording:
+        samples = series.get(name)
+        if samples is None:
+            samples = series.setdefault(name, collections.deque(maxlen=max_samples))
+        # deque.append is atomic, so the threads do not need a lock
+        samples.append((time.perf_counter() if time_now is None else time_now, value))
+    for listener in listeners:
+        listener(name, value)
+
+
+def on_span(name, category, time_start, time_end):
+    if flag_recording and category in categories:
+        add(name, time_end - time_start, time_end)
+
+
+def get_samples(name, window_s):
+    '''
+    returning the times (s, relative to now) and the values of the samples of the last window_s
+    '''
+
+    samples = list(series.get(name, ()))
+    if len(samples) == 0:
+        return np.zeros(0), np.zeros(0)
+    times, values = np.array(samples, dtype=float).T
+    times = times - time.perf_counter()
+    flags = times >= -window_s
+    return times[flags], values[flags]
+
+
+def get_rate(name, window_s):
+    '''
+    returning the events per s of the last window_s
+    '''
+
+    times, values = get_samples(name, window_s)
+    return np.sum(values) / window_s
+
+
+def get_rate_series(name, window_s, bin_s):
+    '''
+    returning the times (s, relative to now) and the events per s of the bins of bin_s over the last window_s
+    the current bin is not complete, so it is left out.
+    '''
+
+    times, values = get_samples(name, window_s)
+    edges = np.arange(-window_s, 1e-9, bin_s)
+    counts, _ = np.histogram(times, bins=edges, weights=values)
+    return edges[1:-1], counts[:-1] / bin_s
+
+
+if __name__ == '__main__':
+    import configuration
+    import threading
+    config = configuration.Configuration()
+    enable(config)
+
+    @tracing.traced('vision')
+    def stage():
+        time.sleep(0.002)
+
+    def camera():
+        for _ in range(100):
+            add('camera_frames', 1)
+            time.sleep(1 / 50)
+
+    thread = threading.Thread(target=camera)
+    thread.start()
+    for _ in range(50):
+        stage()
+    thread.join()
+    times, values = get_samples('stage', 60)
+    print('stage: {:d} samples, median {:.2f} ms'.format(len(values), 1000 * np.median(values)))
+    print('camera: {:.1f} fps over the last 1 s, bins {}'.format(get_rate('camera_frames', 1), get_rate_series('camera_frames', 2, 0.5)[1]))
+    disable()
+    add('camera_frames', 1)
+    stage()
+    print('disabled: {:d} camera samples, {:d} stage samples'.format(len(series['camera_frames']), len(series['stage'])))
@@ -1,4 +1,3 @@
-
 ##############################################################################
 # File name:    run.py
 # Project:      Robotic Surgery Software
@@ -7,56 +6,95 @@
 #               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
 # Version:      22.0
 # Description:  This file is responsible for initializing all the
-#               necessary modules and running the software.
+#               necessary modules and running the software. With --sim
+#               the simulated devices of simulation.py are used instead
+#               of the hardware, with --trace the spans of the workers
+#               are exported as a chrome trace when the software exits,
+#               with --performance the performance panel of the gui can
+#               be shown, and with --metrics the metrics of the rig are
+#               served on a local http endpoint.
 ##############################################################################
 
 
 # Modules
 from configuration import Configuration
-from SmarAct import SmarAct
-from pistage import PIStage
-from asm import ASM
-from gamepad import XInput
-from pypylon import pylon
 from gui import GUI
 from PyQt5.QtWidgets import QApplication
+import tracing
+import metrics
+import argparse
+import time
 import sys
 import os
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='robotic surgery software')
+    parser.add_argument('--sim', action='store_true', help='running on the simulated smaract, asm, pistage, gamepad and camera')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='real time per simulated time (--sim only)')
+    parser.add_argument('--trace', action='store_true', help='recording the spans of the workers and exporting them at exit')
+    parser.add_argument('--performance', action='store_true', help='enabling the performance panel of the gui')
+    parser.add_argument('--metrics', action='store_true', help='serving the metrics of the rig on http://metrics_host:metrics_port/metrics')
+    args, _ = parser.parse_known_args()
     config = Configuration()
-    # initializing smaract
-    smaract = SmarAct()
-    status = smaract.initialize()
-    if status != config.smaract_status_ok:
-        print('smaract initialization failed with status: ' + str(status))
-        os._exit(0)
-    else:
-        print('smaract has been initialized.')
-     # initializing asm
-    asm = ASM()
-    status = asm.initialize()
-    if status != asm.status_ok:
-        print('asm initialization failed with status: ' + str(status))
-        os._exit(0)
-    else:
-        print('asm has been initialized.')
-    asm.set_delay(config.asm_delay_ms)
-    # initializing pistage
-    pistage = PIStage()
-    status = pistage.initialize()
-    if status != pistage.status_ok:
-        print('pistage initialization failed with status: ' + str(status))
-        os._exit(0)
+    config.trace_flag_enabled = config.trace_flag_enabled or args.trace
+    config.performance_flag_enabled = config.performance_flag_enabled or args.performance
+    config.metrics_flag_enabled = config.metrics_flag_enabled or args.metrics
+    if args.sim:
+        import simulation
+        config.sim_time_scale = args.time_scale
+        smaract, asm, pistage, gamepad, camera = simulation.create_devices(config)
+        asm.set_delay(config.asm_delay_ms)
+        print('simulated devices have been initialized.')
     else:
-        print('pistage has been initialized.')
-    # initializing gamepad
-    gamepad = XInput()
-    # initializing camera
-    tl = pylon.TlFactory.GetInstance()
-    camera = pylon.InstantCamera()
-    camera.Attach(tl.CreateFirstDevice())
+        from SmarAct import SmarAct
+        from pistage import PIStage
+        from asm import ASM
+        from gamepad import XInput
+        from pypylon import pylon
+        # initializing smaract
+        smaract = SmarAct()
+        status = smaract.initialize()
+        if status != config.smaract_status_ok:
+            print('smaract initialization failed with status: ' + str(status))
+            os._exit(0)
+        else:
+            print('smaract has been initialized.')
+         # initializing asm
+        asm = ASM()
+        status = asm.initialize()
+        if status != asm.status_ok:
+            print('asm initialization failed with status: ' + str(status))
+            os._exit(0)
+        else:
+            print('asm has been initialized.')
+        asm.set_delay(config.asm_delay_ms)
+        # initializing pistage
+        pistage = PIStage()
+        status = pistage.initialize()
+        if status != pistage.status_ok:
+            print('pistage initialization failed with status: ' + str(status))
+            os._exit(0)
+        else:
+            print('pistage has been initialized.')
+        # initializing gamepad
+        gamepad = XInput()
+        # initializing camera
+        tl = pylon.TlFactory.GetInstance()
+        camera = pylon.InstantCamera()
+        camera.Attach(tl.CreateFirstDevice())
+    # tracing the device calls (the gamepad is polled continuously and is not traced)
+    # the performance panel and the metrics use the latency of the traced calls, the spans are only recorded with --trace
+    if config.trace_flag_enabled or config.performance_flag_enabled or config.metrics_flag_enabled:
+        smaract, asm, pistage, camera = [tracing.TracedDevice(device, category) for device, category in
+                                         [(smaract, 'smaract'), (asm, 'asm'), (pistage, 'pistage'), (camera, 'camera')]]
+    if config.trace_flag_enabled:
+        tracing.enable(config.trace_max_events)
+        # exported by the gui when it is closed (it exits with os._exit, so atexit would not run)
+        config.trace_path = config.trace_directory + time.strftime('trace_%Y_%m_%d_%H_%M_%S.json', time.localtime())
+    if config.metrics_flag_enabled:
+        metrics.enable(config)
+        metrics.start_server(config)
     # running the gui
     app = QApplication([])
     screen = app.screens()[0]
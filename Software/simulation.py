@@ -0,0 +1,560 @@
+##############################################################################
+# File name:    simulation.py
+# Project:      Robotic Surgery Software
+# Part:         Simulated hardware
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file contains drop-in simulated devices for the
+#               smaract, pistage, asm, gamepad and pylon camera (run.py
+#               --sim). The stages move with trapezoidal velocity profiles
+#               and settle times, the asm answers with a serial latency,
+#               and the camera renders synthetic frames of the embryo in
+#               the current well and the scissor at the smaract position.
+#               All the timing is scaled by sim_time_scale, so the
+#               workers can run faster than real time.
+##############################################################################
+
+
+# Modules
+import auxiliary as aux
+import numpy as np
+import cv2 as cv
+import threading
+import time
+import os
+
+
+class pylon:
+    '''
+    constants of pypylon used by the workers (imported from here if pypylon is not installed)
+    '''
+
+    TimeoutHandling_Return = 0
+    TimeoutHandling_ThrowException = 1
+    GrabStrategy_LatestImageOnly = 1
+
+
+class SimClock:
+    '''
+    simulated time in s, running 1/sim_time_scale times faster than real time
+    the clock follows the real time, so the computation of the workers (vision, inference) is stretched by the same
+    factor in simulated time, only the waiting is shortened.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.time_start = time.perf_counter()
+
+    def now(self):
+        return (time.perf_counter() - self.time_start) / self.config.sim_time_scale
+
+    def sleep(self, time_s):
+        if time_s > 0:
+            aux.sleep(self.config, time_s)
+
+
+class SimAxis:
+    '''
+    positioning axis moving with a trapezoidal velocity profile (acceleration, constant speed, deceleration)
+    followed by a settle time, the position is evaluated at any simulated time
+    '''
+
+    def __init__(self, position, acceleration, settle_time_s):
+        self.acceleration = acceleration
+        self.settle_time_s = settle_time_s
+        self.position_start = position
+        self.position_end = position
+        self.speed = 1
+        self.time_start = 0
+        self.duration = 0
+
+    def get_motion_time(self, distance, speed):
+        # time to reach the speed and the distance covered meanwhile (a triangular profile if the move is short)
+        time_ramp = speed / self.acceleration
+        if distance < speed * time_ramp:
+            return 2 * np.sqrt(distance / self.acceleration)
+        return 2 * time_ramp + (distance - speed * time_ramp) / speed
+
+    def move_to(self, position, speed, time_now):
+        self.position_start = self.get_position(time_now)
+        self.position_end = position
+        self.speed = abs(speed)
+        self.time_start = time_now
+        self.duration = self.get_motion_time(abs(position - self.position_start), self.speed)
+        return self.duration + self.settle_time_s
+
+    def stop(self, time_now):
+        self.position_start = self.position_end = self.get_position(time_now)
+        self.duration = 0
+
+    def get_position(self, time_now):
+        elapsed = time_now - self.time_start
+        if elapsed >= self.duration:
+            return self.position_end
+        distance = abs(self.position_end - self.position_start)
+        speed = min(self.speed, np.sqrt(distance * self.acceleration))        # peak speed of a triangular profile
+        time_ramp = speed / self.acceleration
+        if elapsed < time_ramp:
+            covered = 0.5 * self.acceleration * elapsed**2
+        elif elapsed < self.duration - time_ramp:
+            covered = 0.5 * speed * time_ramp + speed * (elapsed - time_ramp)
+        else:
+            covered = distance - 0.5 * self.acceleration * (self.duration - elapsed)**2
+        return self.position_start + np.sign(self.position_end - self.position_start) * covered
+
+    def is_moving(self, time_now):
+        return time_now - self.time_start < self.duration + self.settle_time_s
+
+
+class SimSmarAct:
+    '''
+    simulated smaract (same interface as the SmarAct module), the moves do not block as on the real controller
+    '''
+
+    def __init__(self, config, clock):
+        self.config = config
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.referencing_status = None
+        channels_linear = [self.config.smaract_channel_x, self.config.smaract_channel_y, self.config.smaract_channel_z]
+        self.axes = {}
+        for channel in channels_linear + [self.config.smaract_channel_alpha, self.config.smaract_channel_beta, self.config.smaract_channel_gamma]:
+            position = self.config.smaract_linear_pos_desired if channel in channels_linear else 0
+            self.axes[channel] = SimAxis(position, self.config.sim_smaract_acceleration, self.config.sim_smaract_settle_time_s)
+        self.referenced = {channel: False for channel in self.axes}
+        self.codes_not_referenced = {self.config.smaract_channel_x: self.config.smaract_referencing_x_not,
+                                     self.config.smaract_channel_y: self.config.smaract_referencing_y_not,
+                                     self.config.smaract_channel_z: self.config.smaract_referencing_z_not,
+                                     self.config.smaract_channel_alpha: self.config.smaract_referencing_alpha_not,
+                                     self.config.smaract_channel_beta: self.config.smaract_referencing_beta_not}
+
+    def initialize(self):
+        return self.config.smaract_status_ok
+
+    def close(self):
+        return self.config.smaract_status_ok
+
+    def get_referencing_status(self):
+        return self.referencing_status
+
+    def set_referencing_status(self, status):
+        self.referencing_status = status
+
+    def is_channel_referenced(self, channel):
+        if self.referenced[channel] or channel not in self.codes_not_referenced:
+            return self.config.smaract_status_ok
+        return self.codes_not_referenced[channel]
+
+    def reference_channel(self, channel):
+        self.clock.sleep(self.config.sim_smaract_referencing_time_s)
+        self.referenced[channel] = True
+        return self.config.smaract_status_ok
+
+    def get_channel_position(self, channel):
+        with self.lock:
+            return self.axes[channel].get_position(self.clock.now())
+
+    def move_channel(self, channel, movement, speed):
+        with self.lock:
+            axis = self.axes[channel]
+            axis.move_to(axis.get_position(self.clock.now()) + movement, speed, self.clock.now())
+
+    def move_channel_to_position(self, channel, position, speed):
+        with self.lock:
+            self.axes[channel].move_to(position, speed, self.clock.now())
+
+    def stop_channel(self, channel):
+        with self.lock:
+            self.axes[channel].stop(self.clock.now())
+
+
+class SimPIStage:
+    '''
+    simulated pistage (same interface as pistage.PIStage), the moves block until the axis is on target
+    '''
+
+    def __init__(self, config, clock):
+        self.config = config
+        self.clock = clock
+        self.status_ok = 0
+        self.referencing_status = None
+        self.axes = {axis: SimAxis(0, self.config.sim_pistage_acceleration, self.config.sim_pistage_settle_time_s)
+                     for axis in [self.config.pistage_l1, self.config.pistage_l2]}
+        self.velocities = {axis: 1 for axis in self.axes}
+        self.referenced = {axis: False for axis in self.axes}
+
+    def initialize(self):
+        return self.status_ok
+
+    def close(self):
+        return
+
+    def get_axis_position(self, axis):
+        return self.axes[axis].get_position(self.clock.now())
+
+    def get_axis_velocity(self, axis):
+        return self.velocities[axis]
+
+    def set_axis_velocity(self, axis, velocity):
+        self.velocities[axis] = velocity
+
+    def get_axis_acceleration(self, axis):
+        return self.axes[axis].acceleration
+
+    def set_axis_acceleration(self, axis, acceleration):
+        self.axes[axis].acceleration = acceleration
+
+    def get_axis_deceleration(self, axis):
+        return self.axes[axis].acceleration
+
+    def set_axis_deceleration(self, axis, deceleration):
+        self.axes[axis].acceleration = deceleration
+
+    def get_referencing_status(self):
+        return self.referencing_status
+
+    def set_referencing_status(self, status):
+        self.referencing_status = status
+
+    def is_axis_referenced(self, axis):
+        return self.referenced[axis]
+
+    def reference_axis(self, axis):
+        self.clock.sleep(self.config.sim_pistage_referencing_time_s)
+        self.referenced[axis] = True
+        return True
+
+    def move_axis(self, axis, movement, speed):
+        self.move_axis_to_position(axis, self.get_axis_position(axis) + movement, speed)
+
+    def move_axis_to_position(self, axis, position, speed):
+        self.set_axis_velocity(axis, speed)
+        self.clock.sleep(self.axes[axis].move_to(position, speed, self.clock.now()))
+
+    def stop(self):
+        for axis in self.axes.values():
+            axis.stop(self.clock.now())
+
+    def stop_axis(self, axis):
+        self.axes[axis].stop(self.clock.now())
+
+
+class SimASM:
+    '''
+    simulated arduino stepper motor (same interface as asm.ASM) with the latency of the serial link
+    '''
+
+    def __init__(self, config, clock):
+        self.config = config
+        self.clock = clock
+        self.status_ok = 0
+        self.name = 'Arduino'
+        self.position = 0       # [steps]
+        self.delay = 0          # [ms] per step
+
+    def initialize(self):
+        return self.status_ok
+
+    def close(self):
+        return
+
+    def getname(self):
+        self.clock.sleep(2 * self.config.sim_serial_latency_s)
+        return self.name
+
+    def move(self, steps):
+        # the arduino waits the delay twice per step (high and low pulse)
+        self.clock.sleep(2 * self.config.sim_serial_latency_s + 2 * abs(steps) * self.delay / 1000)
+        self.position = self.position + steps
+
+    def get_position(self):
+        self.clock.sleep(2 * self.config.sim_serial_latency_s)
+        return str(self.position) + '\r\n'
+
+    def get_delay(self):
+        self.clock.sleep(2 * self.config.sim_serial_latency_s)
+        return self.delay
+
+    def set_delay(self, delay):
+        self.clock.sleep(2 * self.config.sim_serial_latency_s)
+        self.delay = delay
+
+
+class SimGamepad:
+    '''
+    simulated gamepad that is never connected (same interface as gamepad.XInput)
+    '''
+
+    def __init__(self, config):
+        self.config = config
+
+    def get_state(self):
+        return self.config.gamepad_not_found
+
+    def is_button_pressed(self, button):
+        return False
+
+    def get_axis_value(self, axis):
+        return 0
+
+    def get_trigger_value(self, trigger):
+        return 0.0
+
+    def get_stick_value(self, thumb):
+        return 0.0
+
+
+class SimScene:
+    '''
+    rendering the camera frame of the simulated rig
+    the embryo of the current well is placed with a random (seeded) offset and moves with the pistage, the scissor
+    tip moves with the smaract x/y channels through the transform sim_camera_px_per_mm and sim_camera_angle_deg
+    (different from pixel_to_mili, as for a real rig before calibration).
+    with recorded frames, the frame of the current well is replayed instead (the scissor then does not follow the smaract).
+    '''
+
+    def __init__(self, config, smaract, pistage, clock, frames=None):
+        self.config = config
+        self.smaract = smaract
+        self.pistage = pistage
+        self.clock = clock
+        self.frames = frames
+        self.position_start = (smaract.get_channel_position(self.config.smaract_channel_x), smaract.get_channel_position(self.config.smaract_channel_y))
+        angle = np.radians(self.config.sim_camera_angle_deg)
+        scale = self.config.sim_camera_px_per_mm * self.config.nano_to_mili
+        # the image moves opposite to the stage
+        self.matrix = -scale * np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        rng = np.random.default_rng(self.config.sim_seed)
+        self.noises = [rng.normal(0, self.config.sim_camera_noise, (self.config.camera_height, self.config.camera_width)).astype(np.float32)
+                       for _ in range(self.config.sim_camera_noise_frames)]
+        self.num_frames = 0
+
+    def get_tip(self):
+        x = self.smaract.get_channel_position(self.config.smaract_channel_x) - self.position_start[0]
+        y = self.smaract.get_channel_position(self.config.smaract_channel_y) - self.position_start[1]
+        x_tip, y_tip = self.matrix @ np.array([x, y]) + np.array(self.config.sim_tip_start)
+        return x_tip, y_tip
+
+    def get_well(self):
+        l1 = self.pistage.get_axis_position(self.config.pistage_l1)
+        l2 = self.pistage.get_axis_position(self.config.pistage_l2)
+        return l1, l2, int(round(l1 / self.config.automation_step_l1)), int(round(l2 / self.config.automation_step_l2))
+
+    def get_embryo(self):
+        l1, l2, id_l1, id_l2 = self.get_well()
+        # the offset of the embryo in its well is fixed per well
+        rng = np.random.default_rng((self.config.sim_seed, id_l1 + 1000, id_l2 + 1000))
+        x_offset, y_offset = rng.uniform(-self.config.sim_embryo_offset_max, self.config.sim_embryo_offset_max, 2)
+        px_per_mm = self.config.sim_camera_px_per_mm
+        x_embryo = self.config.sim_embryo_center[0] + x_offset - (l1 - id_l1 * self.config.automation_step_l1) * px_per_mm
+        y_embryo = self.config.sim_embryo_center[1] + y_offset - (l2 - id_l2 * self.config.automation_step_l2) * px_per_mm
+        return x_embryo, y_embryo
+
+    def render(self, width, height, offset_x, offset_y, reverse_x, reverse_y):
+        self.num_frames = self.num_frames + 1
+        if self.frames is not None:
+            # the automation goes in the -l1 direction from the first well
+            _, _, id_l1, id_l2 = self.get_well()
+            img = self.frames[(abs(id_l2) * self.config.automation_num_l1 + abs(id_l1)) % len(self.frames)]
+            img = img[offset_y:offset_y+height, offset_x:offset_x+width]
+            return img[::-1 if reverse_y else 1, ::-1 if reverse_x else 1]
+        img = np.full((self.config.camera_height, self.config.camera_width), 220, dtype=np.float32)
+        x_emb, y_emb = (int(round(value)) for value in self.get_embryo())
+        cv.circle(img=img, center=(x_emb, y_emb), radius=300, color=160, thickness=-1)
+        cv.ellipse(img=img, center=(x_emb, y_emb+120), axes=(90, 140), angle=0, startAngle=0, endAngle=360, color=100, thickness=-1)
+        cv.ellipse(img=img, center=(x_emb, y_emb-120), axes=(40, 120), angle=0, startAngle=0, endAngle=360, color=130, thickness=-1)
+        x_tip, y_tip = (int(round(value)) for value in self.get_tip())
+        # the blades reach the top of the frame wherever the tip is
+        length = max(y_tip, 0) + 100
+        for sign in [-1, 1]:
+            blade = np.array([[x_tip, y_tip], [x_tip+sign*200*length//700, y_tip-length], [x_tip+sign*60*length//700, y_tip-length]], dtype=np.int32)
+            cv.fillPoly(img=img, pts=[blade], color=15)
+        img = img + self.noises[self.num_frames % len(self.noises)]
+        img = img[offset_y:offset_y+height, offset_x:offset_x+width]
+        if reverse_x:
+            img = img[:, ::-1]
+        if reverse_y:
+            img = img[::-1, :]
+        return np.clip(img, 0, 255).astype(np.uint8)
+
+
+class SimParameter:
+    '''
+    camera parameter with the GenICam accessors used by the gui
+    '''
+
+    def __init__(self, value, value_min=None, value_max=None, increment=1):
+        self.value = value
+        self.value_min = value_min
+        self.value_max = value_max
+        self.increment = increment
+
+    def SetValue(self, value):
+        self.value = value
+
+    def GetValue(self):
+        return self.value
+
+    def GetMin(self):
+        return self.value_min
+
+    def GetMax(self):
+        return self.value_max
+
+    def GetInc(self):
+        return self.increment
+
+
+class SimCommand:
+    def Execute(self):
+        return
+
+
+class SimGrabResult:
+    '''
+    grab result of the simulated camera, False if the grab timed out
+    '''
+
+    def __init__(self, img, num_skipped=0):
+        self.img = img
+        self.num_skipped = num_skipped
+
+    def __bool__(self):
+        return self.img is not None
+
+    def GrabSucceeded(self):
+        return self.img is not None
+
+    def GetArray(self):
+        return self.img
+
+    def GetNumberOfSkippedImages(self):
+        return self.num_skipped
+
+    def Release(self):
+        return
+
+
+class SimCamera:
+    '''
+    simulated pylon instant camera acquiring frames of the scene at sim_camera_fps
+    '''
+
+    def __init__(self, config, clock, scene):
+        self.config = config
+        self.clock = clock
+        self.scene = scene
+        self.flag_grabbing = False
+        self.time_frame = 0
+        self.TLParamsLocked = False
+        self.MaxNumBuffer = SimParameter(self.config.camera_buffer)
+        self.PixelFormat = SimParameter(self.config.camera_pixel_format)
+        self.ExposureTime = SimParameter(self.config.camera_exposure_time)
+        self.Width = SimParameter(self.config.camera_width, 16, self.config.camera_width, 4)
+        self.Height = SimParameter(self.config.camera_height, 16, self.config.camera_height, 2)
+        self.OffsetX = SimParameter(self.config.camera_offset_x, 0, 0, 4)
+        self.OffsetY = SimParameter(self.config.camera_offset_y, 0, 0, 2)
+        self.ReverseX = SimParameter(self.config.camera_reverse_x)
+        self.ReverseY = SimParameter(self.config.camera_reverse_y)
+        self.AcquisitionStart = SimCommand()
+        self.AcquisitionStop = SimCommand()
+
+    def Attach(self, device):
+        return
+
+    def Open(self):
+        return
+
+    def Close(self):
+        self.flag_grabbing = False
+
+    def StartGrabbing(self, strategy=pylon.GrabStrategy_LatestImageOnly):
+        self.flag_grabbing = True
+        self.time_frame = self.clock.now()
+
+    def StopGrabbing(self):
+        self.flag_grabbing = False
+
+    def IsGrabbing(self):
+        return self.flag_grabbing
+
+    def RetrieveResult(self, timeout_ms, timeout_handling=pylon.TimeoutHandling_ThrowException):
+        '''
+        waiting for the next frame (the latest one only, as with GrabStrategy_LatestImageOnly) and rendering it
+        '''
+
+        if not self.flag_grabbing:
+            raise RuntimeError('the simulated camera is not grabbing')
+        interval = 1 / self.config.sim_camera_fps
+        time_now = self.clock.now()
+        time_next = max(self.time_frame + interval, time_now - (time_now - self.time_frame) % interval)
+        if time_next - time_now > timeout_ms / 1000:
+            self.clock.sleep(timeout_ms / 1000)
+            if timeout_handling == pylon.TimeoutHandling_ThrowException:
+                raise TimeoutError('the simulated camera timed out')
+            return SimGrabResult(None)
+        self.clock.sleep(time_next - time_now)
+        # the frames acquired since the last retrieved one were overwritten in the buffer
+        num_skipped = max(int(round((time_next - self.time_frame) / interval)) - 1, 0)
+        self.time_frame = time_next
+        return SimGrabResult(self.scene.render(self.Width.GetValue(), self.Height.GetValue(), self.OffsetX.GetValue(), self.OffsetY.GetValue(),
+                                               self.ReverseX.GetValue(), self.ReverseY.GetValue()), num_skipped)
+
+
+def load_frames(directory):
+    '''
+    loading the frames recorded by the automation (the images saved before each annotation, without _ann and _done)
+    '''
+
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.png') and not name.endswith(('_ann.png', '_done.png')))
+    return [cv.imread(os.path.join(directory, name), cv.IMREAD_GRAYSCALE) for name in names]
+
+
+def create_devices(config, frames=None):
+    '''
+    creating the simulated smaract, asm, pistage, gamepad and camera sharing the same clock and scene
+    '''
+
+    clock = SimClock(config)
+    smaract = SimSmarAct(config, clock)
+    pistage = SimPIStage(config, clock)
+    asm = SimASM(config, clock)
+    gamepad = SimGamepad(config)
+    scene = SimScene(config, smaract, pistage, clock, frames)
+    camera = SimCamera(config, clock, scene)
+    return smaract, asm, pistage, gamepad, camera
+
+
+if __name__ == '__main__':
+    import configuration
+    import computer_vision as vision
+    import argparse
+    parser = argparse.ArgumentParser(description='checking the simulated devices')
+    parser.add_argument('--time-scale', type=float, default=0.01, help='real time per simulated time')
+    args = parser.parse_args()
+    config = configuration.Configuration()
+    config.sim_time_scale = args.time_scale
+    smaract, asm, pistage, gamepad, camera = create_devices(config)
+    clock = camera.clock
+    time_start, time_sim_start = time.perf_counter(), clock.now()
+    # a 0.3 mm move of the smaract at 1.5 mm/s and a 2 mm move of the pistage at 1 mm/s
+    aux.smaract_move_channel_sleep(smaract, config.smaract_channel_x, 300000, config.automation_speed_smaract, 1.5, config)
+    print('smaract x: {:.0f} nm'.format(smaract.get_channel_position(config.smaract_channel_x)))
+    pistage.move_axis(config.pistage_l1, config.automation_step_l1, config.automation_speed_pistage)
+    print('pistage l1: {:.3f} mm'.format(pistage.get_axis_position(config.pistage_l1)))
+    asm.set_delay(config.asm_delay_ms)
+    aux.scissor_close(asm, config)
+    aux.scissor_open(asm, config)
+    print('asm: {} steps'.format(asm.get_position().strip()))
+    camera.Open()
+    camera.StartGrabbing(1)
+    num_frames = 10
+    for _ in range(num_frames):
+        grab = camera.RetrieveResult(config.camera_timeout_ms, pylon.TimeoutHandling_Return)
+    x_tip, y_tip, flag, err = aux.locate_scissor_tip_in_frame(grab.GetArray(), config, vision.Workspace())
+    x_true, y_true = camera.scene.get_tip()
+    print('scissor tip: detected at {}, rendered at ({:.0f}, {:.0f}) {}'.format((x_tip, y_tip), x_true, y_true, err))
+    time_real = time.perf_counter() - time_start
+    time_sim = clock.now() - time_sim_start
+    print('simulated {:.2f} s in {:.2f} s ({:.0f}x real time)'.format(time_sim, time_real, time_sim / time_real))
@@ -0,0 +1,104 @@
+##############################################################################
+# File name:    test_benchmark_vision.py
+# Project:      Robotic Surgery Software
+# Part:         Time and peak memory suite of the computer vision methods
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file measures the time (pytest-benchmark) and the peak
+#               memory (tracemalloc, in the extra info of the benchmark) of
+#               every function of computer_vision.py and of the annotation
+#               pipelines, for every corpus (synthetic and archived frames),
+#               resolution and function. The pixel sizes of the
+#               configuration are scaled to the resolution, and an
+#               annotation pipeline that does not succeed fails the suite.
+#               The options are in conftest.py (--vision-sizes, ...), the
+#               results are compared with --benchmark-autosave and
+#               --benchmark-compare --benchmark-compare-fail=median:20%.
+##############################################################################
+
+
+# Modules
+import pytest
+import itertools
+import os
+
+pytest.importorskip('pytest_benchmark')
+import benchmark_vision as bv
+import configuration
+
+
+def pytest_generate_tests(metafunc):
+    '''
+    parametrizing the suite over corpus x size x function
+    '''
+
+    if 'function_name' in metafunc.fixturenames:
+        options = metafunc.config.option
+        corpora = ['synthetic'] + (['archived'] if options.vision_archived is not None else [])
+        cases, names_missing = bv.create_cases(configuration.Configuration(), {}, None, None)
+        names = [name for name, _ in cases] + names_missing
+        metafunc.parametrize('corpus, size, function_name', [(corpus, size, name) for corpus in corpora for size in options.vision_sizes
+                                                             for name in names])
+
+
+@pytest.fixture(scope='session')
+def suite(request, tmp_path_factory):
+    '''
+    returning the model (None without --vision-dn) and a function returning the (configuration, cases, missing names) of
+    every frame of a corpus at a size, the annotation chain runs once per frame and size
+    '''
+
+    options = request.config.option
+    directory = os.path.join(str(tmp_path_factory.mktemp('benchmark_vision')), '')
+    config = configuration.Configuration()
+    config.automation_flag_save_image = 0
+    model = None
+    if options.vision_dn:
+        import inference
+        model = inference.create_inference_engine(config)
+    frames = {}
+
+    def get_frames(corpus, size):
+        if (corpus, size) not in frames:
+            frames[(corpus, size)] = []
+            for name, _, img in bv.create_corpus(options.vision_archived, options.vision_frames, [size]):
+                if name == corpus:
+                    config_scaled = bv.scale_configuration(config, size)
+                    cases, names_missing = bv.create_cases(config_scaled, bv.prepare_inputs(img, config_scaled), model, directory)
+                    frames[(corpus, size)].append((config_scaled, dict(cases), names_missing))
+        return frames[(corpus, size)]
+
+    return model, get_frames
+
+
+def test_vision(benchmark, pytestconfig, suite, corpus, size, function_name):
+    model, get_frames = suite
+    if function_name.endswith('_dn') and model is None:
+        pytest.skip('the deep network annotation is measured with --vision-dn')
+    frames = get_frames(corpus, size)
+    if len(frames) == 0:
+        pytest.skip('no {} frames'.format(corpus))
+    # a pipeline without inputs fails, the other functions are skipped (the failure of the chain is reported by its pipeline)
+    num_missing = sum(function_name in names_missing for _, _, names_missing in frames)
+    if num_missing > 0:
+        message = 'inputs of {} not produced by the annotation chain on {:d}/{:d} frames'.format(function_name, num_missing, len(frames))
+        if function_name.startswith('automation_'):
+            pytest.fail(message)
+        pytest.skip(message)
+    functions = []
+    for config, cases, _ in frames:
+        config.automation_flag_cv_dn = int(function_name.endswith('_dn'))
+        functions.append(cases[function_name])
+    # warm-up, checking that the pipelines annotate the frames (a failure is not measured as a result)
+    for function in functions:
+        result = function()
+        if function_name.startswith('automation_') and result[-2] == False:
+            pytest.fail('{} failed on a {} frame at {:d} px: {}'.format(function_name, corpus, size, result[-1]))
+    benchmark.group = function_name
+    benchmark.extra_info['frames'] = len(functions)
+    benchmark.extra_info['peak_mb'] = max(bv.measure_peak_mb(function) for function in functions)
+    # one frame per round, in turn
+    functions_cycle = itertools.cycle(functions)
+    benchmark.pedantic(lambda function: function(), setup=lambda: ((next(functions_cycle),), {}),
+                       rounds=len(functions) * pytestconfig.option.vision_rounds)
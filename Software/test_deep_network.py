@@ -0,0 +1,47 @@
+##############################################################################
+# File name:    test_deep_network.py
+# Project:      Robotic Surgery Software
+# Part:         Tests of the deep network
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file checks that the fused inference graph of
+#               deep_network.py (batch normalization folded into the
+#               convolutions, no dropout) predicts the same output as the
+#               original u-net, on a small u-net with random weights.
+##############################################################################
+
+
+# Modules
+import pytest
+import numpy as np
+
+tf = pytest.importorskip('tensorflow')
+import deep_network as dn
+
+
+def create_random_model(image_size, filters_num, kernel_size, stride, dropout):
+    '''
+    building a u-net with batch normalization and random weights, including the statistics of the batch normalization
+    '''
+
+    tf.keras.utils.set_random_seed(0)
+    model = dn.build_model(tf.keras.layers.Input((image_size, image_size, 1)), filters_num, kernel_size, stride, dropout, True)
+    rng = np.random.default_rng(0)
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.BatchNormalization):
+            gamma, beta, mean, variance = layer.get_weights()
+            layer.set_weights([rng.uniform(0.5, 1.5, gamma.shape).astype(np.float32), rng.normal(0, 0.1, beta.shape).astype(np.float32),
+                               rng.normal(0, 0.1, mean.shape).astype(np.float32), rng.uniform(0.5, 1.5, variance.shape).astype(np.float32)])
+    return model
+
+
+def test_fused_model_matches():
+    image_size, filters_num, kernel_size, stride = 32, 4, 3, 2
+    model = create_random_model(image_size, filters_num, kernel_size, stride, 0.1)
+    model_fused = dn.fuse_model(model, image_size, filters_num, kernel_size, stride)
+    assert not any(isinstance(layer, (tf.keras.layers.BatchNormalization, tf.keras.layers.Dropout)) for layer in model_fused.layers)
+    imgs = np.random.default_rng(1).random((4, image_size, image_size, 1), dtype=np.float32)
+    outputs = model(imgs, training=False).numpy()
+    outputs_fused = model_fused(imgs, training=False).numpy()
+    np.testing.assert_allclose(outputs_fused, outputs, atol=1e-5)
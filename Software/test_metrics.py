@@ -0,0 +1,116 @@
+##############################################################################
+# File name:    test_metrics.py
+# Project:      Robotic Surgery Software
+# Part:         Tests of the metrics exporter
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file drives the counters of metrics.py through the
+#               traced devices, the annotations and the camera and well
+#               samples of the simulator, scrapes the local endpoint like
+#               a prometheus server and checks the exposition.
+##############################################################################
+
+
+# Modules
+import pytest
+import numpy as np
+import urllib.request
+import urllib.error
+import auxiliary as aux
+import computer_vision as vision
+import configuration
+import performance
+import simulation
+import tracing
+import metrics
+
+
+@pytest.fixture(scope='module')
+def scrape():
+    '''
+    returning the url of the endpoint, its content type and the parsed samples and types
+    '''
+
+    config = configuration.Configuration()
+    config.sim_time_scale = 0.05
+    config.metrics_port = 0
+    metrics.clear()
+    metrics.enable(config)
+    server = metrics.start_server(config)
+    url = 'http://{}:{}/metrics'.format(*server.server_address[:2])
+    try:
+        smaract, asm, pistage, gamepad, camera = simulation.create_devices(config)
+        smaract, asm, pistage = [tracing.TracedDevice(device, category) for device, category in [(smaract, 'smaract'), (asm, 'asm'), (pistage, 'pistage')]]
+        for _ in range(5):
+            smaract.get_channel_position(config.smaract_channel_x)
+            pistage.get_axis_position(config.pistage_l1)
+        asm.move(10)
+        # the annotations of a gradient without scissor
+        metrics.count_annotation('embryo', True, None)
+        metrics.count_annotation('embryo', False, config.annotation_embryo_err_no_circle)
+        metrics.count_annotation('embryo', False, config.dn_err_empty)
+        locate = metrics.annotation('scissor')(aux.locate_scissor_tip_in_frame)
+        camera.StartGrabbing()
+        shape = camera.RetrieveResult(config.camera_timeout_ms).GetArray().shape
+        locate(np.tile(np.arange(shape[1], dtype=np.uint16) % 256, (shape[0], 1)).astype(np.uint8), config, vision.Workspace())
+        for name, value in [('camera_frames', 1), ('camera_frames', 1), ('camera_skipped', 3), ('camera_drops', 1),
+                            ('well_cycle', 12.5), ('well_dissected', 1), ('well_cycle', 31.0), ('well_dissected', 0)]:
+            performance.add(name, value)
+        with urllib.request.urlopen(url) as response:
+            content_type = response.headers['Content-Type']
+            samples, types = metrics.parse_text(response.read().decode('utf-8'))
+        yield url, content_type, samples, types
+    finally:
+        server.shutdown()
+        metrics.disable()
+        metrics.clear()
+
+
+def test_exposition(scrape):
+    url, content_type, samples, types = scrape
+    assert content_type.startswith('text/plain; version=0.0.4')
+    assert all(types.get(name) == kind for name, (kind, text_help) in metrics.descriptions.items())
+
+
+@pytest.mark.parametrize('name, labels, value', [
+    ('camera_frames_grabbed_total', (), 2),
+    ('camera_frames_skipped_total', (), 3),
+    ('camera_frames_dropped_total', (), 1),
+    ('annotations_total', (('result', 'succeeded'), ('stage', 'embryo')), 1),
+    ('annotation_errors_total', (('error', 'annotation_embryo_err_no_circle'), ('stage', 'embryo')), 1),
+    ('annotation_errors_total', (('error', 'dn_err_empty'), ('stage', 'embryo')), 1),
+    ('annotation_errors_total', (('error', 'annotation_scissor_err_no_line'), ('stage', 'scissor')), 1),
+    ('device_command_seconds_count', (('command', 'get_channel_position'), ('device', 'smaract')), 5),
+    ('device_command_seconds_count', (('command', 'move'), ('device', 'asm')), 1),
+    ('automation_wells_total', (), 2),
+    ('automation_wells_dissected_total', (), 1),
+    ('automation_well_cycle_seconds_sum', (), 43.5),
+    ('automation_well_cycle_seconds_bucket', (('le', '+Inf'),), 2)])
+def test_sample(scrape, name, labels, value):
+    url, content_type, samples, types = scrape
+    assert samples.get((name, labels)) == value
+
+
+def test_histogram_buckets(scrape):
+    '''
+    the buckets of every histogram are cumulative and end with the count
+    '''
+
+    url, content_type, samples, types = scrape
+    num_histograms = 0
+    for (name, labels), value in samples.items():
+        if name.endswith('_count') and types.get(name[:-len('_count')]) == 'histogram':
+            name_base = name[:-len('_count')]
+            values = [samples[(name_bucket, labels_bucket)] for name_bucket, labels_bucket in samples
+                      if name_bucket == name_base + '_bucket' and tuple(item for item in labels_bucket if item[0] != 'le') == labels]
+            assert values == sorted(values) and values[-1] == value
+            num_histograms = num_histograms + 1
+    assert num_histograms > 0
+
+
+def test_other_path(scrape):
+    url, content_type, samples, types = scrape
+    with pytest.raises(urllib.error.HTTPError) as info:
+        urllib.request.urlopen(url.replace('/metrics', '/other'))
+    assert info.value.code == 404
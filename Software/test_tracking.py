@@ -0,0 +1,58 @@
+##############################################################################
+# File name:    test_tracking.py
+# Project:      Robotic Surgery Software
+# Part:         Tests of the trackers
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file checks that the gate of the embryo blob rejects
+#               the blobs outside the bounds learned from the first
+#               embryos, passes one after too many rejections, and learns
+#               the bounds again if the deep network annotates it.
+##############################################################################
+
+
+# Modules
+import configuration
+import tracking
+
+
+def create_gate():
+    config = configuration.Configuration()
+    config.dn_flag_gate = 1
+    gate = tracking.BlobGate(config)
+    # learning the bounds from the first embryos of the plate
+    for _ in range(config.dn_gate_samples_min):
+        assert gate.is_plausible((0, 0, 300, 300), 70000)
+        gate.update((0, 0, 300, 300), 70000)
+    return config, gate
+
+
+def test_gate_relearns_after_forced_pass():
+    config, gate = create_gate()
+    # the larger embryos of the rest of the plate are rejected by the learned bounds
+    for _ in range(config.dn_gate_rejections_max):
+        assert not gate.is_plausible((0, 0, 420, 420), 140000)
+    # the next one is passed to the deep network, which annotates it
+    assert gate.is_plausible((0, 0, 420, 420), 140000)
+    gate.update((0, 0, 420, 420), 140000)
+    assert list(gate.areas) == [140000]
+    # the static bounds apply again until the bounds are learned from the larger embryos
+    for _ in range(config.dn_gate_samples_min - 1):
+        assert gate.is_plausible((0, 0, 420, 420), 140000)
+        gate.update((0, 0, 420, 420), 140000)
+    assert gate.is_plausible((0, 0, 420, 420), 140000)
+    assert not gate.is_plausible((0, 0, 300, 300), 70000)
+    assert gate.num_rejections == config.dn_gate_rejections_max + 1
+
+
+def test_gate_keeps_bounds_after_failed_forced_pass():
+    config, gate = create_gate()
+    for _ in range(config.dn_gate_rejections_max):
+        assert not gate.is_plausible((0, 0, 420, 420), 140000)
+    # the forced blob is not annotated (no update), so the learned bounds stay
+    assert gate.is_plausible((0, 0, 420, 420), 140000)
+    assert gate.is_plausible((0, 0, 300, 300), 70000)
+    gate.update((0, 0, 300, 300), 70000)
+    assert len(gate.areas) == config.dn_gate_samples_min + 1
+    assert not gate.is_plausible((0, 0, 420, 420), 140000)
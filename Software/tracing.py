@@ -0,0 +1,254 @@
+##############################################################################
+# File name:    tracing.py
+# Project:      Robotic Surgery Software
+# Part:         Tracing of the worker threads
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file records spans (name, category, start, duration
+#               and thread) of the device calls, vision stages, inference,
+#               saves and sleeps of the workers, and exports them as a
+#               chrome trace (chrome://tracing, ui.perfetto.dev) to show
+#               the concurrency and the idle gaps of a run on a timeline.
+#               Tracing is off by default, and a traced function then
+#               only costs one flag check. The spans can also be passed to
+#               listeners (the performance panel) without being recorded.
+##############################################################################
+
+
+# Modules
+import collections
+import functools
+import threading
+import json
+import time
+import os
+
+
+flag_enabled = False                            # spans are timed (recorded and/or passed to the listeners)
+flag_recording = False
+listeners = []                                  # functions called with (name, category, start in s, end in s)
+events = collections.deque(maxlen=1000000)      # (name, category, start in s, end in s, thread id)
+thread_names = {}
+time_origin = time.perf_counter()
+
+
+def update_flag():
+    global flag_enabled
+    flag_enabled = flag_recording or len(listeners) > 0
+
+
+def enable(max_events=None):
+    global flag_recording, events
+    if max_events is not None:
+        events = collections.deque(events, maxlen=max_events)
+    flag_recording = True
+    update_flag()
+
+
+def disable():
+    global flag_recording
+    flag_recording = False
+    update_flag()
+
+
+def add_listener(listener):
+    if listener not in listeners:
+        listeners.append(listener)
+    update_flag()
+
+
+def remove_listener(listener):
+    if listener in listeners:
+        listeners.remove(listener)
+    update_flag()
+
+
+def clear():
+    events.clear()
+
+
+def add_event(name, category, time_start, time_end):
+    # deque.append is atomic, so the threads do not need a lock
+    if flag_recording:
+        thread_id = threading.get_ident()
+        if thread_id not in thread_names:
+            thread_names[thread_id] = threading.current_thread().name
+        events.append((name, category, time_start, time_end, thread_id))
+    for listener in listeners:
+        listener(name, category, time_start, time_end)
+
+
+class Span:
+    __slots__ = ('name', 'category', 'time_start')
+
+    def __init__(self, name, category):
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        self.time_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        add_event(self.name, self.category, self.time_start, time.perf_counter())
+        return False
+
+
+class NullSpan:
+    '''
+    span returned while tracing is off (shared, records nothing)
+    '''
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+null_span = NullSpan()
+
+
+def span(name, category='stage'):
+    '''
+    context manager recording the enclosed block as a span
+    '''
+
+    if not flag_enabled:
+        return null_span
+    return Span(name, category)
+
+
+def traced(category='stage', name=None):
+    '''
+    decorator recording every call of the function as a span named after the function (or name)
+    '''
+
+    def decorator(function):
+        label = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not flag_enabled:
+                return function(*args, **kwargs)
+            time_start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add_event(label, category, time_start, time.perf_counter())
+        return wrapper
+    return decorator
+
+
+class TracedDevice:
+    '''
+    proxy of a device (smaract, pistage, asm or camera) recording every method call as a span of the device category
+    the attributes that are not methods (e.g. the camera parameters) are returned as they are.
+    '''
+
+    def __init__(self, device, category):
+        object.__setattr__(self, 'device', device)
+        object.__setattr__(self, 'category', category)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.device, name)
+        if not callable(attribute):
+            return attribute
+        label = self.category + '.' + name
+        category = self.category
+
+        def method(*args, **kwargs):
+            if not flag_enabled:
+                return attribute(*args, **kwargs)
+            time_start = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                add_event(label, category, time_start, time.perf_counter())
+        return method
+
+    def __setattr__(self, name, value):
+        setattr(self.device, name, value)
+
+
+def get_chrome_trace():
+    '''
+    returning the events as a chrome trace (complete events in us, one row per thread)
+    '''
+
+    pid = os.getpid()
+    trace_events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id, 'args': {'name': thread_name}}
+                    for thread_id, thread_name in list(thread_names.items())]
+    for name, category, time_start, time_end, thread_id in list(events):
+        trace_events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': thread_id,
+                             'ts': 1e6 * (time_start - time_origin), 'dur': 1e6 * (time_end - time_start)})
+    return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+
+def export_chrome_trace(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(get_chrome_trace(), file)
+    return len(events)
+
+
+def get_summary():
+    '''
+    returning the number of calls, the total and the max time in s of every span name
+    '''
+
+    summary = {}
+    for name, category, time_start, time_end, thread_id in list(events):
+        count, total, maximum = summary.get(name, (0, 0, 0))
+        summary[name] = (count + 1, total + time_end - time_start, max(maximum, time_end - time_start))
+    return summary
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='overhead of the tracing and example trace')
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--output', default='./traces/example.json')
+    args = parser.parse_args()
+
+    def function():
+        return None
+
+    function_traced = traced()(function)
+    for label, flag in [('disabled', False), ('enabled', True)]:
+        flag_enabled = flag_recording = flag
+        results = []
+        for f in [function, function_traced]:
+            time_start = time.perf_counter()
+            for _ in range(args.calls):
+                f()
+            results.append(1e9 * (time.perf_counter() - time_start) / args.calls)
+        time_start = time.perf_counter()
+        for _ in range(args.calls):
+            with span('block'):
+                pass
+        time_span = 1e9 * (time.perf_counter() - time_start) / args.calls
+        print('{:8s}  plain call: {:6.0f} ns  traced call: {:6.0f} ns  span: {:6.0f} ns'.format(label, results[0], results[1], time_span))
+    # two threads sleeping and computing in turns
+    clear()
+    enable()
+
+    @traced('sleep')
+    def wait(time_s):
+        time.sleep(time_s)
+
+    def work(name):
+        for _ in range(5):
+            with span(name + ' compute'):
+                sum(range(200000))
+            wait(0.01)
+    threads = [threading.Thread(target=work, args=(name,), name=name) for name in ['camera', 'automation']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print('{:d} events written to {} (open in ui.perfetto.dev or chrome://tracing)'.format(export_chrome_trace(args.output), args.output))
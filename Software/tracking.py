@@ -0,0 +1,341 @@
+##############################################################################
+# File name:    tracking.py
+# Project:      Robotic Surgery Software
+# Part:         Tracking of the embryo and scissor between wells
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file contains the trackers that remember where the
+#               embryo and scissor were found in the previous wells such
+#               that the annotation can be restricted to a smaller region,
+#               the gate that learns the plausible size and shape of the
+#               embryo blob before the deep network is run, the cache that
+#               reuses the scissor tip while the scissor is not moved, and
+#               the tracker that follows the scissor tip in every camera
+#               frame.
+##############################################################################
+
+
+# Modules
+import numpy as np
+import cv2 as cv
+import collections
+import threading
+import time
+
+
+class RoiTracker:
+    '''
+    remembering the last bounding boxes of the embryo and scissor to process only a padded region of interest (roi)
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.names = [self.config.roi_name_embryo, self.config.roi_name_scissor]
+        self.bboxes = {}        # name: (x, y, w, h)
+        self.areas = {}         # name: area in px
+        self.num_attempts = 0
+        self.num_hits = 0
+
+    def reset(self):
+        self.bboxes = {}
+        self.areas = {}
+        self.num_attempts = 0
+        self.num_hits = 0
+
+    def get_roi(self, shape):
+        '''
+        returning the padded union (x, y, w, h) of the last bounding boxes or None if any of them is unknown
+        '''
+
+        if not self.config.roi_flag_enabled:
+            return None
+        if any(name not in self.bboxes for name in self.names):
+            return None
+        h_img, w_img = shape[:2]
+        x_lower = min(self.bboxes[name][0] for name in self.names) - self.config.roi_padding
+        y_lower = min(self.bboxes[name][1] for name in self.names) - self.config.roi_padding
+        x_upper = max(self.bboxes[name][0] + self.bboxes[name][2] for name in self.names) + self.config.roi_padding
+        y_upper = max(self.bboxes[name][1] + self.bboxes[name][3] for name in self.names) + self.config.roi_padding
+        x_lower, y_lower = max(x_lower, 0), max(y_lower, 0)
+        x_upper, y_upper = min(x_upper, w_img), min(y_upper, h_img)
+        return x_lower, y_lower, x_upper - x_lower, y_upper - y_lower
+
+    def is_confident(self, name, bbox, area, roi, shape):
+        '''
+        checking whether a blob found inside the roi can be trusted
+        the blob has to keep a margin to the roi borders (unless the border is also the image border) and
+        its area has to stay close to the area found in the previous well.
+        '''
+
+        h_img, w_img = shape[:2]
+        x, y, w, h = bbox
+        x_roi, y_roi, w_roi, h_roi = roi
+        margin = self.config.roi_margin
+        if x_roi > 0 and x - x_roi < margin:
+            return False
+        if y_roi > 0 and y - y_roi < margin:
+            return False
+        if x_roi + w_roi < w_img and (x_roi + w_roi) - (x + w) < margin:
+            return False
+        if y_roi + h_roi < h_img and (y_roi + h_roi) - (y + h) < margin:
+            return False
+        area_previous = self.areas.get(name)
+        if area_previous:
+            ratio = area / area_previous
+            if ratio > self.config.roi_area_ratio_max or ratio < 1 / self.config.roi_area_ratio_max:
+                return False
+        return True
+
+    def update(self, name, bbox, area):
+        self.bboxes[name] = tuple(int(value) for value in bbox)
+        self.areas[name] = int(area)
+
+    def register(self, hit):
+        self.num_attempts = self.num_attempts + 1
+        if hit:
+            self.num_hits = self.num_hits + 1
+
+    def get_hit_rate(self):
+        if self.num_attempts == 0:
+            return 0.0
+        return self.num_hits / self.num_attempts
+
+    def get_hit_rate_text(self):
+        return self.config.roi_message_hit_rate + '{:d}/{:d} ({:.1f}%)'.format(self.num_hits, self.num_attempts, 100 * self.get_hit_rate())
+
+
+class BlobGate:
+    '''
+    checking whether the embryo blob is plausible before running the deep network on it
+    until enough embryos are annotated, the area and aspect ratio (h/w) of the blob have to be inside the static bounds
+    of the configuration. afterwards they have to stay close to the medians of the last successfully annotated embryos.
+    after dn_gate_rejections_max consecutive rejections the next blob is passed to the deep network anyway. if the deep
+    network annotates it, the learned bounds did not fit the plate (e.g. larger embryos than the first ones), so the
+    history is cleared and the bounds are learned again from the following embryos.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.areas = collections.deque(maxlen=self.config.dn_gate_history)
+        self.aspects = collections.deque(maxlen=self.config.dn_gate_history)
+        self.num_checks = 0
+        self.num_rejections = 0
+        self.num_rejections_consecutive = 0
+        self.flag_forced = False    # the last checked blob was passed after too many rejections
+
+    def get_bounds(self):
+        '''
+        returning the bounds (area_min, area_max, aspect_min, aspect_max) of a plausible blob
+        '''
+
+        if len(self.areas) < self.config.dn_gate_samples_min:
+            return self.config.dn_gate_area_min, self.config.dn_gate_area_max, self.config.dn_gate_aspect_min, self.config.dn_gate_aspect_max
+        area = np.median(self.areas)
+        aspect = np.median(self.aspects)
+        return (area / self.config.dn_gate_area_ratio_max, area * self.config.dn_gate_area_ratio_max,
+                aspect / self.config.dn_gate_aspect_ratio_max, aspect * self.config.dn_gate_aspect_ratio_max)
+
+    def is_plausible(self, bbox, area):
+        if not self.config.dn_flag_gate:
+            return True
+        _, _, w, h = bbox
+        area_min, area_max, aspect_min, aspect_max = self.get_bounds()
+        plausible = area_min <= area <= area_max and aspect_min <= h / w <= aspect_max
+        self.num_checks = self.num_checks + 1
+        self.flag_forced = not plausible
+        if plausible or self.num_rejections_consecutive >= self.config.dn_gate_rejections_max:
+            self.num_rejections_consecutive = 0
+            return True
+        self.num_rejections = self.num_rejections + 1
+        self.num_rejections_consecutive = self.num_rejections_consecutive + 1
+        return False
+
+    def update(self, bbox, area):
+        _, _, w, h = bbox
+        if self.flag_forced:
+            self.areas.clear()
+            self.aspects.clear()
+            self.flag_forced = False
+        self.areas.append(int(area))
+        self.aspects.append(h / w)
+
+    def get_rejection_text(self):
+        return self.config.dn_message_gate + '{:d}/{:d} embryos rejected before inference'.format(self.num_rejections, self.num_checks)
+
+
+class ToolTipCache:
+    '''
+    reusing the scissor tip of the previous well while the smaract is back at the same pose
+    the scissor is mounted on the smaract, so at the same pose the tip is at the same pixel unless the scissor drifted
+    (e.g. bent or slipped in its holder). this is checked by matching the patch around the cached tip in a small search
+    window of the new frame: the tip is reused only if the patch is found with a high score at (almost) the same place.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.pose = None        # (x, y, z) of the smaract in nm
+        self.tip = None         # (x, y) in px
+        self.uncertainty = None # px, uncertainty of the intersection the tip was detected at
+        self.template = None    # patch around the tip
+        self.num_checks = 0
+        self.num_hits = 0
+
+    def reset(self):
+        self.pose = None
+        self.tip = None
+        self.uncertainty = None
+        self.template = None
+
+    def get_patch_bounds(self, tip, shape, margin):
+        '''
+        returning the bounds (x_lower, y_lower, x_upper, y_upper) of the patch around the tip widened by the margin,
+        or None if they do not fit in the image
+        '''
+
+        h_img, w_img = shape[:2]
+        half = self.config.tip_cache_template_size // 2 + margin
+        x_lower, y_lower, x_upper, y_upper = tip[0] - half, tip[1] - half, tip[0] + half, tip[1] + half
+        if x_lower < 0 or y_lower < 0 or x_upper > w_img or y_upper > h_img:
+            return None
+        return x_lower, y_lower, x_upper, y_upper
+
+    def is_same_pose(self, pose):
+        if self.pose is None:
+            return False
+        return max(abs(value - value_cached) for value, value_cached in zip(pose, self.pose)) <= self.config.tip_cache_pose_tolerance
+
+    def lookup(self, img, pose):
+        '''
+        returning the cached tip (x, y) if the pose matches and the scissor did not drift, otherwise None
+        '''
+
+        if not self.config.tip_cache_flag_enabled:
+            return None
+        if self.template is None or not self.is_same_pose(pose):
+            return None
+        self.num_checks = self.num_checks + 1
+        bounds = self.get_patch_bounds(self.tip, img.shape, self.config.tip_cache_search_margin)
+        if bounds is None:
+            return None
+        x_lower, y_lower, x_upper, y_upper = bounds
+        scores = cv.matchTemplate(np.float32(img[y_lower:y_upper, x_lower:x_upper]), self.template, cv.TM_CCOEFF_NORMED)
+        _, score_max, _, (x_max, y_max) = cv.minMaxLoc(scores)
+        drift = np.hypot(x_max - self.config.tip_cache_search_margin, y_max - self.config.tip_cache_search_margin)
+        if score_max < self.config.tip_cache_score_min or drift > self.config.tip_cache_drift_max:
+            return None
+        self.num_hits = self.num_hits + 1
+        return self.tip
+
+    def update(self, img, pose, tip, uncertainty=None):
+        bounds = self.get_patch_bounds(tip, img.shape, 0)
+        if bounds is None:
+            self.reset()
+            return
+        x_lower, y_lower, x_upper, y_upper = bounds
+        self.pose = tuple(pose)
+        self.tip = tuple(int(value) for value in tip)
+        self.uncertainty = uncertainty
+        self.template = np.float32(img[y_lower:y_upper, x_lower:x_upper])
+
+    def get_hit_rate_text(self):
+        rate = 100 * self.num_hits / self.num_checks if self.num_checks else 0.0
+        return self.config.tip_cache_message_hit_rate + '{:d}/{:d} ({:.1f}%)'.format(self.num_hits, self.num_checks, rate)
+
+
+class ToolTipTracker:
+    '''
+    following the scissor tip in every camera frame by normalized cross-correlation
+    the patch around the tip is taken when the tracker is anchored on a detected tip (by the automation or by a full
+    detection in the camera thread) and searched in a small window around the last tracked tip. the tracker has to be
+    anchored again when the score drops (lost) and every tip_tracker_anchor_interval frames, since the background of the
+    patch changes while the scissor moves. the camera and automation threads share the tracker, hence the lock.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.template = None
+        self.tip = None                 # (x, y) in px, last tracked tip (None if lost)
+        self.score = 0.0
+        self.num_frames_anchor = 0      # frames tracked since the last anchor
+        self.num_frames = 0
+        self.num_losses = 0
+        self.latencies_ms = collections.deque(maxlen=self.config.tip_tracker_window)
+        self.times = collections.deque(maxlen=self.config.tip_tracker_window)
+
+    def anchor(self, img, tip):
+        '''
+        taking the patch around a detected tip as the new template, returning False if it does not fit in the image
+        '''
+
+        h_img, w_img = img.shape[:2]
+        half = self.config.tip_tracker_template_size // 2
+        x, y = int(round(tip[0])), int(round(tip[1]))
+        if x - half < 0 or y - half < 0 or x + half > w_img or y + half > h_img:
+            return False
+        with self.lock:
+            self.template = np.float32(img[y-half:y+half, x-half:x+half])
+            self.tip = (float(x), float(y))
+            self.score = 1.0
+            self.num_frames_anchor = 0
+        return True
+
+    def needs_anchor(self):
+        return self.template is None or self.tip is None or self.num_frames_anchor >= self.config.tip_tracker_anchor_interval
+
+    def track(self, img):
+        '''
+        searching the template around the last tip, returning the new tip (x, y) with subpixel refinement and its score,
+        or (None, score) if the tip is lost
+        '''
+
+        with self.lock:
+            if self.template is None or self.tip is None:
+                return None, 0.0
+            time_start = time.perf_counter()
+            h_img, w_img = img.shape[:2]
+            half = self.config.tip_tracker_template_size // 2
+            margin = self.config.tip_tracker_search_margin
+            x_lower, y_lower = max(int(self.tip[0]) - half - margin, 0), max(int(self.tip[1]) - half - margin, 0)
+            x_upper, y_upper = min(int(self.tip[0]) + half + margin, w_img), min(int(self.tip[1]) + half + margin, h_img)
+            if x_upper - x_lower < 2*half or y_upper - y_lower < 2*half:
+                self.tip = None
+                self.num_losses = self.num_losses + 1
+                return None, 0.0
+            scores = cv.matchTemplate(np.float32(img[y_lower:y_upper, x_lower:x_upper]), self.template, cv.TM_CCOEFF_NORMED)
+            _, score_max, _, (x_max, y_max) = cv.minMaxLoc(scores)
+            self.score = score_max
+            self.num_frames = self.num_frames + 1
+            self.num_frames_anchor = self.num_frames_anchor + 1
+            if score_max < self.config.tip_tracker_score_min:
+                self.tip = None
+                self.num_losses = self.num_losses + 1
+                return None, score_max
+            # parabola through the scores around the maximum in x and y
+            dx, dy = 0.0, 0.0
+            if 0 < x_max < scores.shape[1] - 1:
+                left, center, right = scores[y_max, x_max-1], scores[y_max, x_max], scores[y_max, x_max+1]
+                dx = 0.5 * (left - right) / (left - 2*center + right) if left - 2*center + right < 0 else 0.0
+            if 0 < y_max < scores.shape[0] - 1:
+                top, center, bottom = scores[y_max-1, x_max], scores[y_max, x_max], scores[y_max+1, x_max]
+                dy = 0.5 * (top - bottom) / (top - 2*center + bottom) if top - 2*center + bottom < 0 else 0.0
+            self.tip = (x_lower + x_max + dx + half, y_lower + y_max + dy + half)
+            time_end = time.perf_counter()
+            self.latencies_ms.append(1000 * (time_end - time_start))
+            self.times.append(time_end)
+            return self.tip, score_max
+
+    def get_rate(self):
+        '''
+        returning the rate of the tracked frames in fps
+        '''
+
+        if len(self.times) < 2:
+            return 0.0
+        return (len(self.times) - 1) / (self.times[-1] - self.times[0])
+
+    def get_rate_text(self):
+        latency_ms = np.median(self.latencies_ms) if self.latencies_ms else 0.0
+        return self.config.tip_tracker_message + '{:.1f} fps, median {:.2f} ms per frame, lost {:d}/{:d} frames'.format(
+               self.get_rate(), latency_ms, self.num_losses, self.num_frames)
@@ -0,0 +1,116 @@
+##############################################################################
+# File name:    tune_inference.py
+# Project:      Robotic Surgery Software
+# Part:         Tuning of the deep network runtime
+# Author:       Erfan ETESAMI and Ece OZELCI, MICROBS, EPFL, 2022
+#               erfan.etesami@epfl.ch, ece.ozelci@epfl.ch
+# Version:      22.0
+# Description:  This file benchmarks the inference of the deep network
+#               across the cpu runtime settings of the configuration
+#               (threads, affinity, onednn and precision) on the current
+#               machine and writes out the best profile.
+##############################################################################
+
+
+# Modules
+import configuration
+import numpy as np
+import argparse
+import itertools
+import subprocess
+import json
+import sys
+import os
+
+
+def create_profiles(num_cores, precisions):
+    '''
+    creating the candidate runtime settings
+    the threads are swept over powers of two up to the number of cores, and every thread count below the number of
+    cores is also tried pinned to as many cores (leaving the others to the camera, gamepad and automation threads).
+    the affinity is only swept where it can be set per thread (linux).
+    '''
+
+    threads = sorted(set([2**i for i in range(int(np.log2(num_cores))+1)] + [num_cores]))
+    profiles = []
+    for intra_op, inter_op, onednn, precision in itertools.product(threads, [1, 2], [1, 0], precisions):
+        affinities = [[]] if intra_op == num_cores or not hasattr(os, 'sched_setaffinity') else [[], list(range(intra_op))]
+        for affinity in affinities:
+            profiles.append({'dn_threads_intra_op': intra_op, 'dn_threads_inter_op': inter_op, 'dn_cpu_affinity': affinity,
+                             'dn_flag_onednn': onednn, 'dn_precision': precision})
+    return profiles
+
+
+def measure_profile(profile, args):
+    '''
+    measuring one profile in a new process, since the threads and onednn can only be set before tensorflow is initialized
+    '''
+
+    command = [sys.executable, os.path.abspath(__file__), '--measure', json.dumps(profile), '--images', str(args.images),
+               '--backend', str(args.backend)]
+    if args.dn_path is not None:
+        command = command + ['--dn-path', args.dn_path]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(profile, args):
+    import inference
+    config = configuration.Configuration()
+    config.dn_flag_profile = 0
+    config.dn_backend = args.backend
+    if args.dn_path is not None:
+        config.dn_path = args.dn_path
+    for name, value in profile.items():
+        setattr(config, name, value)
+    engine = inference.create_inference_engine(config)
+    img_in_arr = np.random.default_rng(0).random(engine.input_shape, dtype=np.float32)
+    for _ in range(args.images):
+        img_out_arr = engine(img_in_arr)
+    stats = engine.get_latency_stats()
+    # the reduced precision is compared with a float32 engine such that the sweep can reject inaccurate profiles
+    deviation = 0.0
+    if config.dn_precision != 'float32':
+        config.dn_precision = 'float32'
+        deviation = float(np.max(np.abs(img_out_arr - inference.create_inference_engine(config)(img_in_arr))))
+    print(json.dumps({'median': stats['median'], 'p95': stats['p95'], 'deviation': deviation}))
+
+
+def sweep(args):
+    config = configuration.Configuration()
+    precisions = ['float32', 'mixed_bfloat16'] if args.backend == config.dn_backend_tensorflow else ['float32']
+    profiles = create_profiles(os.cpu_count(), precisions)
+    results = []
+    for i, profile in enumerate(profiles):
+        stats = measure_profile(profile, args)
+        if stats is None:
+            text = 'failed'
+        else:
+            text = 'median {:7.2f} ms, p95 {:7.2f} ms, deviation {:.4f}'.format(stats['median'], stats['p95'], stats['deviation'])
+        print('{:3d}/{:d} {}  {}'.format(i+1, len(profiles), json.dumps(profile), text))
+        if stats is not None and stats['deviation'] <= args.tolerance:
+            results.append((stats['median'], profile))
+    if len(results) == 0:
+        raise SystemExit('no profile could be measured')
+    latency_ms, profile = min(results, key=lambda result: result[0])
+    path = config.dn_profile_path if args.output is None else args.output
+    with open(path, 'w') as file:
+        json.dump(profile, file, indent=4)
+    print('best profile ({:.2f} ms) written to {}: {}'.format(latency_ms, path, json.dumps(profile)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='sweeping the cpu runtime settings of the deep network and writing the best profile')
+    parser.add_argument('--backend', type=int, default=0, help='0: tensorflow, 1: tflite, 2: onnx')
+    parser.add_argument('--images', type=int, default=30, help='predictions measured per profile')
+    parser.add_argument('--dn-path', default=None, help='keras weights (default: configuration dn_path)')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='max deviation of the output from float32')
+    parser.add_argument('--output', default=None, help='profile path (default: configuration dn_profile_path)')
+    parser.add_argument('--measure', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure is not None:
+        measure(json.loads(args.measure), args)
+    else:
+        sweep(args)
@@ -13,7 +13,14 @@
 # Modules
 import auxiliary as aux
 import computer_vision as vision
-from pypylon import pylon
+import tracking
+import tracing
+import performance
+import inference
+try:
+    from pypylon import pylon
+except ImportError:
+    from simulation import pylon     # the simulated camera (run.py --sim) on machines without pylon
 from PyQt5.QtCore import QObject, pyqtSignal, QRunnable, pyqtSlot
 import numpy as np
 import cv2 as cv
@@ -26,6 +33,7 @@ class WorkerSignalsCamera(QObject):
     '''
 
     progress = pyqtSignal()
+    progress_tip = pyqtSignal(object, float)
 
 
 class WorkerCamera(QRunnable):
@@ -33,10 +41,13 @@ class WorkerCamera(QRunnable):
     worker thread for camera
     '''
 
-    def __init__(self, camera, config):
+    def __init__(self, camera, config, tip_tracker=None):
         super().__init__()
         self.camera = camera
         self.config = config
+        self.tip_tracker = tip_tracker
+        self.workspace = vision.Workspace()
+        self.num_frames_backoff = 0     # frames left before the next full detection of the tip after a failed one
         # establishing the communication with the camera
         self.camera.Open()
         # setting the camera settings
@@ -71,9 +82,40 @@ class WorkerCamera(QRunnable):
             if grab and grab.GrabSucceeded():
                 # We get the actual data (numpy array) using the GetArray method. 
                 self.config.camera_image = grab.GetArray()
+                # the frames overwritten in the buffer since the last grab (only the latest image is kept)
+                performance.add('camera_skipped', grab.GetNumberOfSkippedImages())
                 grab.Release()
+                performance.add('camera_frames', 1)
                 self.signals.progress.emit()
-            time.sleep(self.config.camera_sleep_time_s)
+                if self.tip_tracker is not None and self.config.tip_tracker_flag_enabled:
+                    self.update_tip_tracker(self.config.camera_image)
+            else:
+                # failed grabs (e.g. incomplete frames) and timeouts
+                performance.add('camera_drops', 1)
+                if grab:
+                    grab.Release()
+            aux.sleep(self.config, self.config.camera_sleep_time_s)
+
+    @tracing.traced('tracking')
+    def update_tip_tracker(self, img):
+        '''
+        tracking the scissor tip in the new image, the tip is detected again first if it is lost or the anchor is too old
+        the full detection is slow, so after a failed one the camera waits tip_tracker_anchor_backoff_frames frames before
+        the next one (the automation can still anchor the tracker meanwhile).
+        '''
+
+        if self.tip_tracker.needs_anchor():
+            if self.num_frames_backoff > 0:
+                self.num_frames_backoff = self.num_frames_backoff - 1
+            else:
+                x_tip, y_tip, flag, err = aux.locate_scissor_tip_in_frame(img, self.config, self.workspace)
+                if flag and self.tip_tracker.anchor(img, (x_tip, y_tip)):
+                    self.num_frames_backoff = 0
+                else:
+                    self.num_frames_backoff = self.config.tip_tracker_anchor_backoff_frames
+        tip, score = self.tip_tracker.track(img)
+        self.config.tip_tracker_tip = tip
+        self.signals.progress_tip.emit(tip, score)
 
 
 class WorkerSignalsSmarActReferencing(QObject):
@@ -96,6 +138,7 @@ class WorkerSmarActReferencing(QRunnable):
         self.signals = WorkerSignalsSmarActReferencing()
 
     @pyqtSlot()
+    @tracing.traced('worker')
     def run(self):
         '''
         this function is called when the smaract referencing thread is started.
@@ -117,19 +160,19 @@ class WorkerSmarActReferencing(QRunnable):
             if (status != self.config.smaract_status_ok):
                 self.smaract.set_referencing_status(self.config.smaract_referencing_x_failed)
                 self.signals.progress.emit(self.config.smaract_referencing_x_failed)
-                time.sleep(self.config.gui_sleep_time_s)
+                aux.sleep(self.config, self.config.gui_sleep_time_s)
             else:
                 self.smaract.set_referencing_status(self.config.smaract_referencing_x_done)
                 self.signals.progress.emit(self.config.smaract_referencing_x_done)
-                time.sleep(self.config.gui_sleep_time_s)
+                aux.sleep(self.config, self.config.gui_sleep_time_s)
         elif (status != self.config.smaract_status_ok):
             self.smaract.set_referencing_status(self.config.smaract_referencing_x_failed)
             self.signals.progress.emit(self.config.smaract_referencing_x_failed)
-            time.sleep(self.config.gui_sleep_time_s)
+            aux.sleep(self.config, self.config.gui_sleep_time_s)
         elif (status == self.config.smaract_status_ok):
             self.smaract.set_referencing_status(self.config.smaract_referencing_x_done)
             self.signals.progress.emit(self.config.smaract_referencing_x_done)
-            time.sleep(self.config.gui_sleep_time_s)
+            aux.sleep(self.config, self.config.gui_sleep_time_s)
         # # y
         status = self.smaract.is_channel_referenced(self.config.smaract_channel_y)
         if (status == self.config.smaract_referencing_y_not):
@@ -137,19 +180,19 @@ class WorkerSmarActReferencing(QRunnable):
             if (status != self.config.smaract_status_ok):
                 self.smaract.set_referencing_status(self.config.smaract_referencing_y_failed)
                 self.signals.progress.emit(self.config.smaract_referencing_y_failed)
-                time.sleep(self.config.gui_sleep_time_s)
+                aux.sleep(self.config, self.config.gui_sleep_time_s)
             else:
                 self.smaract.set_referencing_status(self.config.smaract_referencing_y_done)
                 self.signals.progress.emit(self.config.smaract_referencing_y_done)
-                time.sleep(self.config.gui_sleep_time_s)
+                aux.sleep(self.config, self.config.gui_sleep_time_s)
         elif (status != self.config.smaract_status_ok):
             self.smaract.set_referencing_status(self.config.smaract_referencing_y_failed)
             self.signals.progress.emit(self.config.smaract_referencing_y_failed)
-            time.sleep(self.config.gui_sleep_time_s)
+            aux.sleep(self.config, self.config.gui_sleep_time_s)
         elif (status == self.config.smaract_status_ok):
             self.smaract.set_referencing_status(self.config.smaract_referencing_y_done)
             self.signals.progress.emit(self.config.smaract_referencing_y_done)
-            time.sleep(self.config.gui_sleep_time_s)
+            aux.sleep(self.config, self.config.gui_sleep_time_s)
         # # z
         status = self.smaract.is_channel_referenced(self.config.smaract_channel_z)
         if (status == self.config.smaract_referencing_z_not):
@@ -157,19 +200,19 @@ class WorkerSmarActReferencing(QRunnable):
             if (status != self.config.smaract_status_ok):
                 self.smaract.set_referencing_status(self.config.smaract_referencing_z_failed)
                 self.signals.progress.emit(self.config.smaract_referencing_z_failed)
-                time.sleep(self.config.gui_sleep_time_s)
+                aux.sleep(self.config, self.config.gui_sleep_time_s)
             else:
                 self.smaract.set_referencing_status(self.config.smaract_referencing_z_done)
                 self.signals.progress.emit(self.config.smaract_referencing_z_done)
-                time.sleep(self.config.gui_sleep_time_s)
+                aux.sleep(self.config, self.config.gui_sleep_time_s)
         elif (status != self.config.smaract_status_ok):
             self.smaract.set_referencing_status(self.config.smaract_referencing_z_failed)
             self.signals.progress.emit(self.config.smaract_referencing_z_failed)
-            time.sleep(self.config.gui_sleep_time_s)
+            aux.sleep(self.config, self.config.gui_sleep_time_s)
         elif (status == self.config.smaract_status_ok):
             self.smaract.set_referencing_status(self.config.smaract_referencing_z_done)
             self.signals.progress.emit(self.config.smaract_referencing_z_done)
-            time.sleep(self.config.gui_sleep_time_s)
+            aux.sleep(self.config, self.config.gui_sleep_time_s)
         # # alpha
         status = self.smaract.is_channel_referenced(self.config.smaract_channel_alpha)
         if (status == self.config.smaract_referencing_alpha_not):
@@ -177,19 +220,19 @@ class WorkerSmarActReferencing(QRunnable):
             if (status != self.config.smaract_status_ok):
                 self.smaract.set_referencing_status(self.config.smaract_referencing_alpha_failed)
                 self.signals.progress.emit(self.config.smaract_referencing_alpha_failed)
-                time.sleep(self.config.gui_sleep_time_s)
+                aux.sleep(self.config, self.config.gui_sleep_time_s)
             else:
                 self.smaract.set_referencing_status(self.config.smaract_referencing_alpha_done)
                 self.signals.progress.emit(self.config.smaract_referencing_alpha_done)
-                time.sleep(self.config.gui_sleep_time_s)
+                aux.sleep(self.config, self.config.gui_sleep_time_s)
         elif (status != self.config.smaract_status_ok):
             self.smaract.set_referencing_status(self.config.smaract_referencing_alpha_failed)
             self.signals.progress.emit(self.config.smaract_referencing_alpha_failed)
-            time.sleep(self.config.gui_sleep_time_s)
+            aux.sleep(self.config, self.config.gui_sleep_time_s)
         elif (status == self.config.smaract_status_ok):
             self.smaract.set_referencing_status(self.config.smaract_referencing_alpha_done)
             self.signals.progress.emit(self.config.smaract_referencing_alpha_done)
-            time.sleep(self.config.gui_sleep_time_s)
+            aux.sleep(self.config, self.config.gui_sleep_time_s)
         # # beta
         status = self.smaract.is_channel_referenced(self.config.smaract_channel_beta)
         if (status == self.config.smaract_referencing_beta_not):
@@ -197,23 +240,23 @@ class WorkerSmarActReferencing(QRunnable):
             if (status != self.config.smaract_status_ok):
                 self.smaract.set_referencing_status(self.config.smaract_referencing_beta_failed)
                 self.signals.progress.emit(self.config.smaract_referencing_beta_failed)
-                time.sleep(self.config.gui_sleep_time_s)
+                aux.sleep(self.config, self.config.gui_sleep_time_s)
             else:
                 self.smaract.set_referencing_status(self.config.smaract_referencing_beta_done)
                 self.signals.progress.emit(self.config.smaract_referencing_beta_done)
-                time.sleep(self.config.gui_sleep_time_s)
+                aux.sleep(self.config, self.config.gui_sleep_time_s)
         elif (status != self.config.smaract_status_ok):
             self.smaract.set_referencing_status(self.config.smaract_referencing_beta_failed)
             self.signals.progress.emit(self.config.smaract_referencing_beta_failed)
-            time.sleep(self.config.gui_sleep_time_s)
+            aux.sleep(self.config, self.config.gui_sleep_time_s)
         elif (status == self.config.smaract_status_ok):
             self.smaract.set_referencing_status(self.config.smaract_referencing_beta_done)
             self.signals.progress.emit(self.config.smaract_referencing_beta_done)
-            time.sleep(self.config.gui_sleep_time_s)
+            aux.sleep(self.config, self.config.gui_sleep_time_s)
         # # done
         self.smaract.set_referencing_status(self.config.smaract_referencing_done)
         self.signals.progress.emit(self.config.smaract_referencing_done)
-        time.sleep(self.config.gui_sleep_time_s)
+        aux.sleep(self.config, self.config.gui_sleep_time_s)
         # getting the initial position
         self.config.pos_initial_x = self.smaract.get_channel_position(self.config.smaract_channel_x)
         self.config.pos_initial_y = self.smaract.get_channel_position(self.config.smaract_channel_y)
@@ -243,6 +286,7 @@ class WorkerSmarActPositioning(QRunnable):
         self.config.control_smaract_status = self.config.control_smaract_default
 
     @pyqtSlot()
+    @tracing.traced('worker')
     def run(self):
         '''
         this function is called when the smaract positioning thread is started.
@@ -250,23 +294,23 @@ class WorkerSmarActPositioning(QRunnable):
 
         # channel x
         aux.smaract_move_channel_to_position_sleep(self.smaract, self.config.smaract_channel_x, self.config.smaract_linear_pos_desired, 
-                                                   self.config.smaract_linear_speed_positioning, self.config.smaract_linear_sleep_multiplier_positioning)
+                                                   self.config.smaract_linear_speed_positioning, self.config.smaract_linear_sleep_multiplier_positioning, self.config)
         self.signals.progress_position.emit(self.config.id_smaract_channel_x, self.smaract.get_channel_position(self.config.smaract_channel_x))
         # channel y
         aux.smaract_move_channel_to_position_sleep(self.smaract, self.config.smaract_channel_y, self.config.smaract_linear_pos_desired,
-                                                   self.config.smaract_linear_speed_positioning, self.config.smaract_linear_sleep_multiplier_positioning)
+                                                   self.config.smaract_linear_speed_positioning, self.config.smaract_linear_sleep_multiplier_positioning, self.config)
         self.signals.progress_position.emit(self.config.id_smaract_channel_y, self.smaract.get_channel_position(self.config.smaract_channel_y))
         # channel z
         aux.smaract_move_channel_to_position_sleep(self.smaract, self.config.smaract_channel_z, self.config.smaract_linear_pos_desired,
-                                                   self.config.smaract_linear_speed_positioning, self.config.smaract_linear_sleep_multiplier_positioning)
+                                                   self.config.smaract_linear_speed_positioning, self.config.smaract_linear_sleep_multiplier_positioning, self.config)
         self.signals.progress_position.emit(self.config.id_smaract_channel_z, self.smaract.get_channel_position(self.config.smaract_channel_z))
         # channel alpha
         aux.smaract_move_channel_to_position_sleep(self.smaract, self.config.smaract_channel_alpha, self.config.smaract_alpha_pos_desired, 
-                                                   self.config.smaract_angular_speed_positioning, self.config.smaract_angular_sleep_multiplier_positioning)
+                                                   self.config.smaract_angular_speed_positioning, self.config.smaract_angular_sleep_multiplier_positioning, self.config)
         self.signals.progress_position.emit(self.config.id_smaract_channel_alpha, self.smaract.get_channel_position(self.config.smaract_channel_alpha))
         # channel beta
         aux.smaract_move_channel_to_position_sleep(self.smaract, self.config.smaract_channel_beta, self.config.smaract_beta_pos_desired,
-                                                   self.config.smaract_angular_speed_positioning, self.config.smaract_angular_sleep_multiplier_positioning)
+                                                   self.config.smaract_angular_speed_positioning, self.config.smaract_angular_sleep_multiplier_positioning, self.config)
         self.signals.progress_position.emit(self.config.id_smaract_channel_beta, self.smaract.get_channel_position(self.config.smaract_channel_beta))
         # getting the initial position
         self.config.pos_initial_x = self.smaract.get_channel_position(self.config.smaract_channel_x)
@@ -298,6 +342,7 @@ class WorkerPIStageReferencing(QRunnable):
         self.signals = WorkerSignalsPIStageReferencing()
 
     @pyqtSlot()
+    @tracing.traced('worker')
     def run(self):
         '''
         this function is called when the pistage referencing thread is started.
@@ -306,7 +351,7 @@ class WorkerPIStageReferencing(QRunnable):
         # Checking whether referencing has been already done or not
         if self.pistage.get_referencing_status() == self.config.pistage_referencing_done:
             self.signals.progress.emit(self.config.pistage_referencing_done)
-            time.sleep(self.config.gui_sleep_time_s)
+            aux.sleep(self.config, self.config.gui_sleep_time_s)
             return
         # referencing the axes
 	    # # l1
@@ -316,15 +361,15 @@ class WorkerPIStageReferencing(QRunnable):
             if (status == False):
                 self.pistage.set_referencing_status(self.config.pistage_referencing_l1_failed)
                 self.signals.progress.emit(self.config.pistage_referencing_l1_failed)
-                time.sleep(self.config.gui_sleep_time_s)
+                aux.sleep(self.config, self.config.gui_sleep_time_s)
             else:
                 self.pistage.set_referencing_status(self.config.pistage_referencing_l1_done)
                 self.signals.progress.emit(self.config.pistage_referencing_l1_done)
-                time.sleep(self.config.gui_sleep_time_s)
+                aux.sleep(self.config, self.config.gui_sleep_time_s)
         else:
             self.pistage.set_referencing_status(self.config.pistage_referencing_l1_done)
             self.signals.progress.emit(self.config.pistage_referencing_l1_done)
-            time.sleep(self.config.gui_sleep_time_s)
+            aux.sleep(self.config, self.config.gui_sleep_time_s)
         # # l2
         status = self.pistage.is_axis_referenced(self.config.pistage_l2)
         if (status == False):
@@ -332,19 +377,19 @@ class WorkerPIStageReferencing(QRunnable):
             if (status == False):
                 self.pistage.set_referencing_status(self.config.pistage_referencing_l2_failed)
                 self.signals.progress.emit(self.config.pistage_referencing_l2_failed)
-                time.sleep(self.config.gui_sleep_time_s)
+                aux.sleep(self.config, self.config.gui_sleep_time_s)
             else:
                 self.pistage.set_referencing_status(self.config.pistage_referencing_l2_done)
                 self.signals.progress.emit(self.config.pistage_referencing_l2_done)
-                time.sleep(self.config.gui_sleep_time_s)
+                aux.sleep(self.config, self.config.gui_sleep_time_s)
         else:
             self.pistage.set_referencing_status(self.config.pistage_referencing_l2_done)
             self.signals.progress.emit(self.config.pistage_referencing_l2_done)
-            time.sleep(self.config.gui_sleep_time_s)
+            aux.sleep(self.config, self.config.gui_sleep_time_s)
         # # done
         self.pistage.set_referencing_status(self.config.pistage_referencing_done)
         self.signals.progress.emit(self.config.pistage_referencing_done)
-        time.sleep(self.config.gui_sleep_time_s)
+        aux.sleep(self.config, self.config.gui_sleep_time_s)
 
 
 class WorkerSignalsPIStagePositioning(QObject):
@@ -370,6 +415,7 @@ class WorkerPIStagePositioning(QRunnable):
         self.config.control_pistage_status = self.config.control_pistage_default
 
     @pyqtSlot()
+    @tracing.traced('worker')
     def run(self):
         '''
         this function is called when the pistage positioning thread is started.
@@ -377,11 +423,11 @@ class WorkerPIStagePositioning(QRunnable):
 
         # axis l1
         aux.pistage_move_axis_to_position_sleep(self.pistage, self.config.pistage_l1, self.config.pistage_pos_l1_desired, 
-                                                self.config.pistage_speed_positioning, self.config.pistage_sleep_multiplier_positioning)
+                                                self.config.pistage_speed_positioning, self.config.pistage_sleep_multiplier_positioning, self.config)
         self.signals.progress_position.emit(self.config.id_pistage_l1, self.pistage.get_axis_position(self.config.pistage_l1))
         # axis l2
         aux.pistage_move_axis_to_position_sleep(self.pistage, self.config.pistage_l2, self.config.pistage_pos_l2_desired,
-                                                self.config.pistage_speed_positioning, self.config.pistage_sleep_multiplier_positioning)
+                                                self.config.pistage_speed_positioning, self.config.pistage_sleep_multiplier_positioning, self.config)
         self.signals.progress_position.emit(self.config.id_pistage_l2, self.pistage.get_axis_position(self.config.pistage_l2))
         # updating the control status
         self.config.control_pistage_status = self.config.control_pistage_l1
@@ -441,7 +487,7 @@ class WorkerGamepad(QRunnable):
                     elif self.config.control_smaract_status == self.config.control_smaract_rotation:
                         self.config.control_smaract_status = self.config.control_smaract_translation
                     self.signals.progress_smaract_control_status.emit(self.config.control_smaract_status)
-                    time.sleep(self.config.gamepad_polling_time_button_s)
+                    aux.sleep(self.config, self.config.gamepad_polling_time_button_s)
                 # RB button is responsible for changing the control mode of pistage (L1 or L2)
                 if self.gamepad.is_button_pressed(self.config.gamepad_buttons['RB']):
                     if self.config.control_pistage_status == self.config.control_pistage_l1:
@@ -449,15 +495,15 @@ class WorkerGamepad(QRunnable):
                     elif self.config.control_pistage_status == self.config.control_pistage_l2:
                         self.config.control_pistage_status = self.config.control_pistage_l1
                     self.signals.progress_pistage_control_status.emit(self.config.control_pistage_status)
-                    time.sleep(self.config.gamepad_polling_time_button_s)
+                    aux.sleep(self.config, self.config.gamepad_polling_time_button_s)
                 # A button is responsible for decreasing the pistage speed multiplier
                 if self.gamepad.is_button_pressed(self.config.gamepad_buttons['A']):
                     self.signals.progress_pistage_speed_multiplier.emit(self.config.pistage_speed_multiplier_decrease)
-                    time.sleep(self.config.gamepad_polling_time_button_s)
+                    aux.sleep(self.config, self.config.gamepad_polling_time_button_s)
                 # Y button is responsible for increasing the pistage speed multiplier
                 if self.gamepad.is_button_pressed(self.config.gamepad_buttons['Y']):
                     self.signals.progress_pistage_speed_multiplier.emit(self.config.pistage_speed_multiplier_increase)
-                    time.sleep(self.config.gamepad_polling_time_button_s)
+                    aux.sleep(self.config, self.config.gamepad_polling_time_button_s)
                 # B button is responsible for moving the smaract gamma channel counter-clockwise
                 if self.gamepad.is_button_pressed(self.config.gamepad_buttons['B']):
                     gamma_movement = self.config.smaract_gamma_steps_base
@@ -468,7 +514,7 @@ class WorkerGamepad(QRunnable):
                         self.smaract.move_channel(self.config.smaract_channel_gamma, gamma_movement, gamma_frequency)
                         self.config.smaract_gamma_steps = self.config.smaract_gamma_steps + gamma_movement
                         self.signals.progress_position.emit(self.config.id_smaract_channel_gamma, self.config.smaract_gamma_steps)
-                    time.sleep(self.config.gamepad_polling_time_button_s)
+                    aux.sleep(self.config, self.config.gamepad_polling_time_button_s)
                 # X button is responsible for moving the smaract gamma channel clockwise
                 if self.gamepad.is_button_pressed(self.config.gamepad_buttons['X']):
                     gamma_movement = -self.config.smaract_gamma_steps_base
@@ -479,25 +525,25 @@ class WorkerGamepad(QRunnable):
                         self.smaract.move_channel(self.config.smaract_channel_gamma, gamma_movement, gamma_frequency)
                         self.config.smaract_gamma_steps = self.config.smaract_gamma_steps + gamma_movement
                         self.signals.progress_position.emit(self.config.id_smaract_channel_gamma, self.config.smaract_gamma_steps)
-                    time.sleep(self.config.gamepad_polling_time_button_s)
+                    aux.sleep(self.config, self.config.gamepad_polling_time_button_s)
                 # Left in D-Pad is responsible for moving the Arduino stepper motor (ASM) clockwise
                 if self.gamepad.is_button_pressed(self.config.gamepad_buttons['DPAD_LEFT']):
                     self.asm.move(-self.config.asm_steps_base)
                     self.signals.progress_position.emit(self.config.id_asm, float(self.asm.get_position()))
-                    time.sleep(self.config.gamepad_polling_time_button_s)
+                    aux.sleep(self.config, self.config.gamepad_polling_time_button_s)
                 # Right in D-Pad is responsible for moving the Arduino stepper motor (ASM) counter-clockwise
                 if self.gamepad.is_button_pressed(self.config.gamepad_buttons['DPAD_RIGHT']):
                     self.asm.move(self.config.asm_steps_base)
                     self.signals.progress_position.emit(self.config.id_asm, float(self.asm.get_position()))
-                    time.sleep(self.config.gamepad_polling_time_button_s)
+                    aux.sleep(self.config, self.config.gamepad_polling_time_button_s)
                 # Up in D-Pad is responsible for  increasing the smaract speed multiplier
                 if self.gamepad.is_button_pressed(self.config.gamepad_buttons['DPAD_UP']):
                     self.signals.progress_smaract_speed_multiplier.emit(self.config.smaract_speed_multiplier_increase)
-                    time.sleep(self.config.gamepad_polling_time_button_s)
+                    aux.sleep(self.config, self.config.gamepad_polling_time_button_s)
                 # Down in D-Pad is responsible for decreasing the smaract speed multiplier
                 if self.gamepad.is_button_pressed(self.config.gamepad_buttons['DPAD_DOWN']):
                     self.signals.progress_smaract_speed_multiplier.emit(self.config.smaract_speed_multiplier_decrease)
-                    time.sleep(self.config.gamepad_polling_time_button_s)
+                    aux.sleep(self.config, self.config.gamepad_polling_time_button_s)
                 # Left stick X (horizontal) is responsible for moving the smaract channels x (in translation mode) and alpha (in rotation mode)
                 lsx = self.gamepad.get_stick_value(self.config.gamepad_sticks['LS_X'])
                 if abs(lsx - self.axis_LX) > self.config.gamepad_sensitivity: 
@@ -638,7 +684,7 @@ class WorkerGamepad(QRunnable):
                             else:
                                 self.pistage.move_axis(self.config.pistage_l2, l2_movement, l2_speed)
                                 self.signals.progress_position.emit(self.config.id_pistage_l2, self.pistage.get_axis_position(self.config.pistage_l2))
-            time.sleep(self.config.gamepad_polling_time_s)
+            aux.sleep(self.config, self.config.gamepad_polling_time_s)
 
 
 class WorkerSignalsSequenceInitialize(QObject):
@@ -662,6 +708,7 @@ class WorkerSequenceInitialize(QRunnable):
         self.signals = WorkerSignalsSequenceInitialize()
 
     @pyqtSlot()
+    @tracing.traced('worker')
     def run(self):
         '''
         this function is called when the sequence-initialize thread is started.
@@ -669,15 +716,15 @@ class WorkerSequenceInitialize(QRunnable):
 
         # channel alpha
         aux.smaract_move_channel_to_position_sleep(self.smaract, self.config.smaract_channel_alpha, self.config.sequence_initial_alpha,
-                                                   self.config.sequence_angular_speed, self.config.sequence_sleep_multiplier_initialize)
+                                                   self.config.sequence_angular_speed, self.config.sequence_sleep_multiplier_initialize, self.config)
         self.signals.progress_position.emit(self.config.id_smaract_channel_alpha, self.smaract.get_channel_position(self.config.smaract_channel_alpha))
         # channel beta
         aux.smaract_move_channel_to_position_sleep(self.smaract, self.config.smaract_channel_beta, self.config.sequence_initial_beta,
-                                                   self.config.sequence_angular_speed, self.config.sequence_sleep_multiplier_initialize)
+                                                   self.config.sequence_angular_speed, self.config.sequence_sleep_multiplier_initialize, self.config)
         self.signals.progress_position.emit(self.config.id_smaract_channel_beta, self.smaract.get_channel_position(self.config.smaract_channel_beta))
         # channel z
         aux.smaract_move_channel_to_position_sleep(self.smaract, self.config.smaract_channel_z, self.config.sequence_initial_z,
-                                                   self.config.sequence_linear_speed, self.config.sequence_sleep_multiplier_initialize)
+                                                   self.config.sequence_linear_speed, self.config.sequence_sleep_multiplier_initialize, self.config)
         self.signals.progress_position.emit(self.config.id_smaract_channel_z, self.smaract.get_channel_position(self.config.smaract_channel_z))
         # getting the initial position
         self.config.pos_initial_x = self.smaract.get_channel_position(self.config.smaract_channel_x)
@@ -708,6 +755,7 @@ class WorkerSequenceDo(QRunnable):
         self.signals = WorkerSignalsSequenceDo()
 
     @pyqtSlot()
+    @tracing.traced('worker')
     def run(self):
         '''
         this function is called when the sequence-do thread is started.
@@ -718,11 +766,11 @@ class WorkerSequenceDo(QRunnable):
         for i in range(len(self.config.sequence_delta_z)):
             # moving for delta z
             aux.smaract_move_channel_sleep(self.smaract, self.config.smaract_channel_z, self.config.sequence_delta_z[i]*self.config.micro_to_nano,
-                                           self.config.sequence_linear_speed, self.config.sequence_sleep_multiplier_do)
+                                           self.config.sequence_linear_speed, self.config.sequence_sleep_multiplier_do, self.config)
             self.signals.progress_position.emit(self.config.id_smaract_channel_z, self.smaract.get_channel_position(self.config.smaract_channel_z))
             # moving for delta y
             aux.smaract_move_channel_sleep(self.smaract, self.config.smaract_channel_y, self.config.sequence_delta_y[i]*self.config.micro_to_nano,
-                                           self.config.sequence_linear_speed, self.config.sequence_sleep_multiplier_do)
+                                           self.config.sequence_linear_speed, self.config.sequence_sleep_multiplier_do, self.config)
             self.signals.progress_position.emit(self.config.id_smaract_channel_y, self.smaract.get_channel_position(self.config.smaract_channel_y))
             # cutting
             aux.scissor_close(self.asm, self.config)
@@ -732,15 +780,15 @@ class WorkerSequenceDo(QRunnable):
             self.signals.progress_position.emit(self.config.id_asm, float(self.asm.get_position()))
         # moving to initial z (to avoid the scissor jump)
         aux.smaract_move_channel_to_position_sleep(self.smaract, self.config.smaract_channel_z, self.config.pos_initial_z,
-                                                   self.config.sequence_linear_speed, self.config.sequence_sleep_multiplier_do)
+                                                   self.config.sequence_linear_speed, self.config.sequence_sleep_multiplier_do, self.config)
         self.signals.progress_position.emit(self.config.id_smaract_channel_z, self.smaract.get_channel_position(self.config.smaract_channel_z))
         # moving to initial x (to avoid the scissor jump)
         aux.smaract_move_channel_to_position_sleep(self.smaract, self.config.smaract_channel_x, self.config.pos_initial_x,
-                                                   self.config.sequence_linear_speed, self.config.sequence_sleep_multiplier_do)
+                                                   self.config.sequence_linear_speed, self.config.sequence_sleep_multiplier_do, self.config)
         self.signals.progress_position.emit(self.config.id_smaract_channel_x, self.smaract.get_channel_position(self.config.smaract_channel_x))
         # moving to initial y (to avoid the scissor jump)
         aux.smaract_move_channel_to_position_sleep(self.smaract, self.config.smaract_channel_y, self.config.pos_initial_y,
-                                                   self.config.sequence_linear_speed, self.config.sequence_sleep_multiplier_do)
+                                                   self.config.sequence_linear_speed, self.config.sequence_sleep_multiplier_do, self.config)
         self.signals.progress_position.emit(self.config.id_smaract_channel_y, self.smaract.get_channel_position(self.config.smaract_channel_y))
         if self.config.sequence_flag_release_debris:
             aux.scissor_close(self.asm, self.config)
@@ -767,7 +815,7 @@ class WorkerAutomation(QRunnable):
     worker thread for developing embryo experiment
     '''
 
-    def __init__(self, smaract, asm, pistage, camera, config, model):
+    def __init__(self, smaract, asm, pistage, camera, config, model, tip_tracker=None):
         super().__init__()
         self.smaract = smaract
         self.asm = asm
@@ -775,9 +823,18 @@ class WorkerAutomation(QRunnable):
         self.camera = camera
         self.config = config
         self.model = model
+        self.tip_tracker = tip_tracker
         self.signals = WorkerSignalsAutomation()
+        self.roi_tracker = tracking.RoiTracker(self.config)
+        self.blob_gate = tracking.BlobGate(self.config)
+        self.tip_cache = tracking.ToolTipCache(self.config)
+        self.workspace = vision.Workspace()
+        self.workspace_servo = vision.Workspace()       # for the tip detections of the approach (the annotation buffers stay valid)
+        self.servo_log = []                             # (iterations, time in s, final error in px, converged) of every approach
+        self.well_log = []                              # (time in s per phase of automation_phases, dissected) of every well
         #self.worker_camera = WorkerCamera(self.camera, self.config)
 
+    @tracing.traced('automation')
     def go_to_next_embryo(self, l1, l2):
         if self.config.automation_flag_stopped:
             return
@@ -790,7 +847,7 @@ class WorkerAutomation(QRunnable):
                 # wait until the next somite forms
                 if self.config.pistage_development_wait != 0:
                     self.camera.StopGrabbing()
-                    time.sleep(self.config.pistage_development_wait)
+                    aux.sleep(self.config, self.config.pistage_development_wait)
                     self.camera.StartGrabbing(1)
                     l2_movement = self.config.automation_step_l2
                 else:
@@ -804,13 +861,108 @@ class WorkerAutomation(QRunnable):
         if l2*self.config.automation_num_l1+l1+2 <= self.config.automation_num_l1*self.config.automation_num_l2:
             self.signals.progress_text_edit.emit(self.config.automation_message_next+str(l2*self.config.automation_num_l1+l1+2), self.config.text_edit_mode_info)
         # axis L1
-        aux.pistage_move_axis_sleep(self.pistage, self.config.pistage_l1, l1_movement, self.config.automation_speed_pistage, self.config.automation_sleep_multiplier_pistage)
+        aux.pistage_move_axis_sleep(self.pistage, self.config.pistage_l1, l1_movement, self.config.automation_speed_pistage, self.config.automation_sleep_multiplier_pistage, self.config)
         self.signals.progress_position.emit(self.config.id_pistage_l1, self.pistage.get_axis_position(self.config.pistage_l1))
         # axis L2
-        aux.pistage_move_axis_sleep(self.pistage, self.config.pistage_l2, l2_movement, self.config.automation_speed_pistage, self.config.automation_sleep_multiplier_pistage)
+        aux.pistage_move_axis_sleep(self.pistage, self.config.pistage_l2, l2_movement, self.config.automation_speed_pistage, self.config.automation_sleep_multiplier_pistage, self.config)
         self.signals.progress_position.emit(self.config.id_pistage_l2, self.pistage.get_axis_position(self.config.pistage_l2))
 
+    @tracing.traced('automation')
+    def measure_tip(self, num_frames_start, time_start):
+        '''
+        returning the scissor tip in a camera image taken after the last move
+        the tip of the tracker is used once it has processed a new image, otherwise the tip is detected in the last image.
+        '''
+
+        if self.tip_tracker is not None and self.config.tip_tracker_flag_enabled and not self.config.camera_flag_off:
+            while time.perf_counter() - time_start < self.config.servo_frame_timeout_s * self.config.sim_time_scale:
+                if self.tip_tracker.num_frames > num_frames_start and self.tip_tracker.tip is not None:
+                    return self.tip_tracker.tip
+                aux.sleep(self.config, self.config.servo_poll_time_s)
+        x_tip, y_tip, flag, err = aux.locate_scissor_tip_in_frame(self.config.camera_image, self.config, self.workspace_servo)
+        if flag == False:
+            return None
+        return x_tip, y_tip
+
+    @tracing.traced('automation')
+    def approach_target(self):
+        '''
+        moving the scissor tip onto the target keypoint by visual servoing
+        every iteration moves the smaract by the pixel error between the tip and the target (scaled by the gain) and
+        measures the tip again, until the error is below servo_threshold or servo_iterations_max moves are done. the
+        first move is the open-loop move, so the remaining iterations correct the errors of the calibration and the stage.
+        '''
+
+        time_start = time.perf_counter()
+        x_target, y_target = self.config.coords_target[-1]
+        x_tool, y_tool = self.config.coords_tool[-1]
+        error = np.hypot(x_target - x_tool, y_target - y_tool)
+        iterations_max = self.config.servo_iterations_max if self.config.servo_flag_enabled else 1
+        iterations = 0
+        while iterations < iterations_max and (iterations == 0 or error > self.config.servo_threshold):
+            if self.config.automation_flag_stopped:
+                return
+            x_movement, y_movement = aux.pixel_to_stage(self.config, self.config.servo_gain * (x_target - x_tool), self.config.servo_gain * (y_target - y_tool))
+            aux.smaract_move_channel_sleep(self.smaract, self.config.smaract_channel_x, x_movement,
+                                           self.config.automation_speed_smaract, self.config.automation_sleep_multiplier_smaract, self.config)
+            self.signals.progress_position.emit(self.config.id_smaract_channel_x, self.smaract.get_channel_position(self.config.smaract_channel_x))
+            aux.smaract_move_channel_sleep(self.smaract, self.config.smaract_channel_y, y_movement,
+                                           self.config.automation_speed_smaract, self.config.automation_sleep_multiplier_smaract, self.config)
+            self.signals.progress_position.emit(self.config.id_smaract_channel_y, self.smaract.get_channel_position(self.config.smaract_channel_y))
+            iterations = iterations + 1
+            if not self.config.servo_flag_enabled:
+                break
+            # measuring the tip after the stage has settled, in a frame tracked after the settling (frames tracked during it
+            # may still show the stage moving)
+            aux.sleep(self.config, self.config.servo_settle_time_s)
+            num_frames_start = self.tip_tracker.num_frames if self.tip_tracker is not None else 0
+            tip = self.measure_tip(num_frames_start, time.perf_counter())
+            if tip is None:
+                self.signals.progress_text_edit.emit(self.config.servo_err_lost, self.config.text_edit_mode_err)
+                break
+            x_tool, y_tool = tip
+            error = np.hypot(x_target - x_tool, y_target - y_tool)
+            self.config.coords_tool.append((x_tool, y_tool))
+            self.signals.progress_coord.emit()
+        time_approach = time.perf_counter() - time_start
+        # logging the approach
+        converged = self.config.servo_flag_enabled and error <= self.config.servo_threshold
+        self.servo_log.append((iterations, time_approach, error, converged))
+        if self.config.servo_flag_enabled:
+            text = self.config.servo_message + '{:d} iterations, {:.2f} s, error {:.1f} px'.format(iterations, time_approach, error)
+            self.signals.progress_text_edit.emit(text, self.config.text_edit_mode_info if converged else self.config.text_edit_mode_err)
+
+    def log_phase(self, times, phase, time_start):
+        '''
+        adding the time since time_start to the phase and returning the current time (the start of the next phase)
+        the times are taken by aux.get_time, so they are the times of the rig also when the simulator runs faster.
+        '''
+
+        time_now = aux.get_time()
+        times[phase] = times.get(phase, 0) + time_now - time_start
+        return time_now
+
+    def log_well(self, times, flag_dissected):
+        self.well_log.append(([times.get(phase, 0) for phase in self.config.automation_phases], flag_dissected))
+        performance.add('well_cycle', sum(times.values()))
+        performance.add('well_dissected', int(flag_dissected))
+
+    def get_phase_text(self):
+        if len(self.well_log) == 0:
+            return self.config.automation_message_phases + self.config.gui_empty_text
+        times = np.array([times for times, flag_dissected in self.well_log])
+        texts = ['{} {:.2f} s'.format(phase, time_phase) for phase, time_phase in zip(self.config.automation_phases, np.mean(times, axis=0))]
+        return self.config.automation_message_phases + ', '.join(texts) + ' ({:.0f} wells/hour)'.format(3600 * len(times) / np.sum(times))
+
+    def get_servo_text(self):
+        if len(self.servo_log) == 0:
+            return self.config.servo_message + self.config.gui_empty_text
+        iterations, times, errors, converged = zip(*self.servo_log)
+        return self.config.servo_message + 'median {:.0f} iterations, median {:.2f} s, median error {:.1f} px, converged {:d}/{:d}'.format(
+               np.median(iterations), np.median(times), np.median(errors), sum(converged), len(self.servo_log))
+
     @pyqtSlot()
+    @tracing.traced('worker')
     def run(self):
         '''
         this function is called when the automation thread is started.
@@ -822,33 +974,63 @@ class WorkerAutomation(QRunnable):
             for l1 in range(self.config.automation_num_l1):
                 if self.config.automation_flag_stopped:
                     return
+                times = {}
+                time_phase = aux.get_time()
                 # annotating
                 self.signals.progress_text_edit.emit(self.config.automation_message_annotating+str(l2*self.config.automation_num_l1+l1+1), self.config.text_edit_mode_info)
                 # # taking the current image of the camera
                 img = aux.normalize_image(self.config.camera_image)
+                time_phase = self.log_phase(times, 'annotation', time_phase)
                 vision.save_image(img, str(self.config.automation_counter), self.config.automation_directory)
+                time_phase = self.log_phase(times, 'saves', time_phase)
+                # # extracting embryo and scissor (inside the roi of the previous well if possible)
+                img_bl, img_th_emb, bbox_emb, img_th_scs, bbox_scs, flag, err = aux.automation_extract_from_image(img, self.config, self.roi_tracker, self.workspace)
+                if flag == False:
+                    self.config.annotation_embryo_points, self.config.annotation_scissor_points, self.config.annotation_points = [], [], []
+                    self.signals.progress_text_edit.emit(err, self.config.text_edit_mode_err)
+                    if self.config.automation_flag_stopped:
+                        return 
+                    time_phase = self.log_phase(times, 'annotation', time_phase)
+                    self.go_to_next_embryo(l1, l2)
+                    self.log_phase(times, 'travel', time_phase)
+                    self.log_well(times, False)
+                    self.config.automation_counter = self.config.automation_counter + 1
+                    continue
                 # # annotating embryo
-                flag, err = aux.automation_annotate_embryo(img, self.config, self.model)
+                flag, err = aux.automation_annotate_embryo(img, img_bl, img_th_emb, bbox_emb, self.config, self.model, self.blob_gate, self.workspace)
                 if flag == False:
                     self.config.annotation_embryo_points, self.config.annotation_scissor_points, self.config.annotation_points = [], [], []
                     self.signals.progress_text_edit.emit(err, self.config.text_edit_mode_err)
                     if self.config.automation_flag_stopped:
                         return 
+                    time_phase = self.log_phase(times, 'annotation', time_phase)
                     self.go_to_next_embryo(l1, l2)
+                    self.log_phase(times, 'travel', time_phase)
+                    self.log_well(times, False)
                     self.config.automation_counter = self.config.automation_counter + 1
                     continue
-                # # annotating scissor
-                flag, err = aux.automation_annotate_scissor(img, self.config)
+                # # annotating scissor (the tip of the previous well is reused while the smaract is at the same pose)
+                pose = (self.smaract.get_channel_position(self.config.smaract_channel_x), self.smaract.get_channel_position(self.config.smaract_channel_y),
+                        self.smaract.get_channel_position(self.config.smaract_channel_z))
+                flag, err = aux.automation_annotate_scissor(img_bl, img_th_scs, bbox_scs, self.config, self.workspace, self.tip_cache, pose)
                 if flag == False:
                     self.config.annotation_embryo_points, self.config.annotation_scissor_points, self.config.annotation_points = [], [], []
                     self.signals.progress_text_edit.emit(err, self.config.text_edit_mode_err)
                     if self.config.automation_flag_stopped:
                         return 
+                    time_phase = self.log_phase(times, 'annotation', time_phase)
                     self.go_to_next_embryo(l1, l2)
+                    self.log_phase(times, 'travel', time_phase)
+                    self.log_well(times, False)
                     self.config.automation_counter = self.config.automation_counter + 1
                     continue
+                time_phase = self.log_phase(times, 'annotation', time_phase)
                 img_drawn = vision.draw_points(np.float32(img), self.config.annotation_points, self.config.annotation_point_offset)
                 vision.save_image(img_drawn, str(self.config.automation_counter)+'_ann', self.config.automation_directory)
+                time_phase = self.log_phase(times, 'saves', time_phase)
+                # re-anchoring the tip tracker of the camera thread on the annotated tip
+                if self.tip_tracker is not None:
+                    self.tip_tracker.anchor(img, self.config.annotation_scissor_points[-1][:2])
                 # updating the coordinates
                 if self.config.automation_flag_cv_dn:
                     self.config.coords_target.append((self.config.annotation_embryo_points[self.config.dn_somite_target-1][0],
@@ -863,25 +1045,22 @@ class WorkerAutomation(QRunnable):
                 self.config.pos_initial_z = self.smaract.get_channel_position(self.config.smaract_channel_z)
                 # moving the scissor to the embryo keypoint
                 self.signals.progress_text_edit.emit(self.config.automation_message_sequence+str(l2*self.config.automation_num_l1+l1+1), self.config.text_edit_mode_info)
-                x_movement = -(self.config.coords_target[-1][0] -  self.config.coords_tool[-1][0]) * self.config.pixel_to_mili * self.config.mili_to_nano
-                aux.smaract_move_channel_sleep(self.smaract, self.config.smaract_channel_x, x_movement, 
-                                               self.config.automation_speed_smaract, self.config.automation_sleep_multiplier_smaract)
-                self.signals.progress_position.emit(self.config.id_smaract_channel_x, self.smaract.get_channel_position(self.config.smaract_channel_x))
-                y_movement = -(self.config.coords_target[-1][1] -  self.config.coords_tool[-1][1]) * self.config.pixel_to_mili * self.config.mili_to_nano 
-                aux.smaract_move_channel_sleep(self.smaract, self.config.smaract_channel_y, y_movement,
-                                               self.config.automation_speed_smaract, self.config.automation_sleep_multiplier_smaract)
-                self.signals.progress_position.emit(self.config.id_smaract_channel_y, self.smaract.get_channel_position(self.config.smaract_channel_y))
+                time_phase = self.log_phase(times, 'annotation', time_phase)
+                self.approach_target()
+                if self.config.automation_flag_stopped:
+                    return
+                time_phase = self.log_phase(times, 'approach', time_phase)
                 # performing the cutting sequence
                 for i in range(len(self.config.sequence_delta_z)):
                     if self.config.automation_flag_stopped:
                         return
                     # # moving for delta z
                     aux.smaract_move_channel_sleep(self.smaract, self.config.smaract_channel_z, self.config.sequence_delta_z[i]*self.config.micro_to_nano,
-                                                   self.config.automation_speed_smaract, self.config.automation_sleep_multiplier_smaract)
+                                                   self.config.automation_speed_smaract, self.config.automation_sleep_multiplier_smaract, self.config)
                     self.signals.progress_position.emit(self.config.id_smaract_channel_z, self.smaract.get_channel_position(self.config.smaract_channel_z))
                     # # moving for delta y
                     aux.smaract_move_channel_sleep(self.smaract, self.config.smaract_channel_y, self.config.sequence_delta_y[i]*self.config.micro_to_nano,
-                                                   self.config.automation_speed_smaract, self.config.automation_sleep_multiplier_smaract)
+                                                   self.config.automation_speed_smaract, self.config.automation_sleep_multiplier_smaract, self.config)
                     self.signals.progress_position.emit(self.config.id_smaract_channel_y, self.smaract.get_channel_position(self.config.smaract_channel_y))
                     # # cutting
                     aux.scissor_close(self.asm, self.config)
@@ -889,32 +1068,47 @@ class WorkerAutomation(QRunnable):
                     # # opening
                     aux.scissor_open(self.asm, self.config)
                     self.signals.progress_position.emit(self.config.id_asm, float(self.asm.get_position()))
+                time_phase = self.log_phase(times, 'cut', time_phase)
                 # # moving to initial z (to avoid the scissor jump)
                 aux.smaract_move_channel_to_position_sleep(self.smaract, self.config.smaract_channel_z, self.config.pos_initial_z,
-                                                           self.config.automation_speed_smaract, self.config.automation_sleep_multiplier_smaract)
+                                                           self.config.automation_speed_smaract, self.config.automation_sleep_multiplier_smaract, self.config)
                 self.signals.progress_position.emit(self.config.id_smaract_channel_z, self.smaract.get_channel_position(self.config.smaract_channel_z))
                 # # moving to initial x (to avoid the scissor jump)
                 aux.smaract_move_channel_to_position_sleep(self.smaract, self.config.smaract_channel_x, self.config.pos_initial_x,
-                                                           self.config.automation_speed_smaract, self.config.automation_sleep_multiplier_smaract)
+                                                           self.config.automation_speed_smaract, self.config.automation_sleep_multiplier_smaract, self.config)
                 self.signals.progress_position.emit(self.config.id_smaract_channel_x, self.smaract.get_channel_position(self.config.smaract_channel_x))
                 # # moving to initial y (to avoid the scissor jump)
                 aux.smaract_move_channel_to_position_sleep(self.smaract, self.config.smaract_channel_y, self.config.pos_initial_y,
-                                                           self.config.automation_speed_smaract, self.config.automation_sleep_multiplier_smaract)
+                                                           self.config.automation_speed_smaract, self.config.automation_sleep_multiplier_smaract, self.config)
                 self.signals.progress_position.emit(self.config.id_smaract_channel_y, self.smaract.get_channel_position(self.config.smaract_channel_y))
                 if self.config.automation_flag_release_debris:
                     if self.config.automation_flag_stopped:
                         return
                     aux.scissor_close(self.asm, self.config)
                     aux.scissor_open(self.asm, self.config)
+                time_phase = self.log_phase(times, 'retract', time_phase)
                 # going to the next embryo
                 img = aux.normalize_image(self.config.camera_image)
                 vision.save_image(img, str(self.config.automation_counter)+'_done', self.config.automation_directory)
+                time_phase = self.log_phase(times, 'saves', time_phase)
                 self.config.automation_counter = self.config.automation_counter + 1
                 self.config.annotation_embryo_points, self.config.annotation_scissor_points, self.config.annotation_points = [], [], []
                 if self.config.automation_flag_stopped:
                     return 
                 self.go_to_next_embryo(l1, l2)
+                self.log_phase(times, 'travel', time_phase)
+                self.log_well(times, True)
         # Done
+        self.signals.progress_text_edit.emit(self.get_phase_text(), self.config.text_edit_mode_info)
+        self.signals.progress_text_edit.emit(self.roi_tracker.get_hit_rate_text(), self.config.text_edit_mode_info)
+        self.signals.progress_text_edit.emit(self.tip_cache.get_hit_rate_text(), self.config.text_edit_mode_info)
+        if self.tip_tracker is not None and self.config.tip_tracker_flag_enabled:
+            self.signals.progress_text_edit.emit(self.tip_tracker.get_rate_text(), self.config.text_edit_mode_info)
+        if self.config.servo_flag_enabled:
+            self.signals.progress_text_edit.emit(self.get_servo_text(), self.config.text_edit_mode_info)
+        if self.config.automation_flag_cv_dn:
+            self.signals.progress_text_edit.emit(self.model.get_latency_text(), self.config.text_edit_mode_info)
+            self.signals.progress_text_edit.emit(self.blob_gate.get_rejection_text(), self.config.text_edit_mode_info)
         self.signals.progress_text_edit.emit(self.config.automation_message_done, self.config.text_edit_mode_info)
         self.signals.progress_button.emit()
 
@@ -940,23 +1134,134 @@ class WorkerReconnection(QRunnable):
         self.signals = WorkerSignalsReconnection()
 
     @pyqtSlot()
+    @tracing.traced('worker')
     def run(self):
         '''
         this function is called when the reconnection thread is started.
         '''
 
         status = self.smaract.initialize()
-        time.sleep(self.config.gui_sleep_time_s)
+        aux.sleep(self.config, self.config.gui_sleep_time_s)
         if status != self.config.smaract_status_ok:
             self.signals.progress.emit(self.config.reconnection_message_failed_smaract+str(status)+'!', self.config.text_edit_mode_err)
             return
         else:
             self.signals.progress.emit(self.config.reconnection_message_done_smaract, self.config.text_edit_mode_info)
         status = self.asm.initialize()
-        time.sleep(self.config.gui_sleep_time_s)
+        aux.sleep(self.config, self.config.gui_sleep_time_s)
         if status != self.asm.status_ok:
             self.signals.progress.emit(self.config.reconnection_message_failed_asm+str(status)+'!', self.config.text_edit_mode_err)
             return
         else:
             self.signals.progress.emit(self.config.reconnection_message_done_asm, self.config.text_edit_mode_info)
             self.asm.set_delay(self.config.asm_delay_ms)
+
+
+class WorkerSignalsModelLoading(QObject):
+    '''
+    defining the signals available from the model loading worker thread
+    '''
+
+    progress_model = pyqtSignal(object)
+    progress_text_edit = pyqtSignal(str, int)
+
+
+class WorkerModelLoading(QRunnable):
+    '''
+    worker thread for loading the deep network (tensorflow is only imported here, not at the startup of the gui)
+    '''
+
+    def __init__(self, config):
+        super().__init__()
+        self.config = config
+        self.signals = WorkerSignalsModelLoading()
+
+    @pyqtSlot()
+    @tracing.traced('worker')
+    def run(self):
+        '''
+        this function is called when the model loading thread is started.
+        '''
+
+        time_start = time.perf_counter()
+        try:
+            model = inference.create_inference_engine(self.config)
+        except Exception as err:
+            self.signals.progress_text_edit.emit(self.config.dn_err_loading+str(err), self.config.text_edit_mode_err)
+            self.signals.progress_model.emit(None)
+            return
+        self.signals.progress_text_edit.emit(self.config.dn_message_loaded+'{:.1f} s'.format(time.perf_counter()-time_start), self.config.text_edit_mode_info)
+        self.signals.progress_model.emit(model)
+
+
+class WorkerSignalsCalibration(QObject):
+    '''
+    defining the signals available from the calibration worker thread
+    '''
+
+    progress_position = pyqtSignal(int, float)
+    progress_text_edit = pyqtSignal(str, int)
+    progress_button = pyqtSignal()
+
+
+class WorkerCalibration(QRunnable):
+    '''
+    worker thread for calibrating the transform between the pixels and the smaract x/y positions
+    the smaract jogs the scissor through a small pattern around its current position, the tip is detected in the image
+    at every position, and an affine transform is fitted and saved for the current objective.
+    '''
+
+    def __init__(self, smaract, config):
+        super().__init__()
+        self.smaract = smaract
+        self.config = config
+        self.signals = WorkerSignalsCalibration()
+        self.workspace = vision.Workspace()
+
+    @tracing.traced('automation')
+    def move_to(self, x, y):
+        for channel, id_channel, position in [(self.config.smaract_channel_x, self.config.id_smaract_channel_x, x),
+                                              (self.config.smaract_channel_y, self.config.id_smaract_channel_y, y)]:
+            aux.smaract_move_channel_to_position_sleep(self.smaract, channel, position, self.config.automation_speed_smaract,
+                                                       self.config.automation_sleep_multiplier_smaract, self.config)
+            self.signals.progress_position.emit(id_channel, self.smaract.get_channel_position(channel))
+
+    @pyqtSlot()
+    @tracing.traced('worker')
+    def run(self):
+        '''
+        this function is called when the calibration thread is started.
+        '''
+
+        self.signals.progress_text_edit.emit(self.config.calibration_message_start, self.config.text_edit_mode_info)
+        x_start = self.smaract.get_channel_position(self.config.smaract_channel_x)
+        y_start = self.smaract.get_channel_position(self.config.smaract_channel_y)
+        span = self.config.calibration_step * max(max(abs(i), abs(j)) for i, j in self.config.calibration_pattern)
+        for channel, position in [(self.config.smaract_channel_x, x_start), (self.config.smaract_channel_y, y_start)]:
+            if not (aux.smaract_is_valid_relative_movement(self.config, channel, position, span) and
+                    aux.smaract_is_valid_relative_movement(self.config, channel, position, -span)):
+                self.signals.progress_text_edit.emit(self.config.calibration_err_not_reachable, self.config.text_edit_mode_err)
+                self.signals.progress_button.emit()
+                return
+        stage_points, pixel_points = [], []
+        for i, j in self.config.calibration_pattern:
+            self.move_to(x_start + i*self.config.calibration_step, y_start + j*self.config.calibration_step)
+            aux.sleep(self.config, self.config.calibration_settle_time_s)
+            x_tip, y_tip, flag, err = aux.locate_scissor_tip_in_frame(self.config.camera_image, self.config, self.workspace)
+            if flag:
+                stage_points.append((self.smaract.get_channel_position(self.config.smaract_channel_x),
+                                     self.smaract.get_channel_position(self.config.smaract_channel_y)))
+                pixel_points.append((x_tip, y_tip))
+        self.move_to(x_start, y_start)
+        if len(stage_points) < self.config.calibration_points_min:
+            self.signals.progress_text_edit.emit(self.config.calibration_err_points, self.config.text_edit_mode_err)
+            self.signals.progress_button.emit()
+            return
+        matrix, residual = aux.fit_calibration(stage_points, pixel_points)
+        if residual > self.config.calibration_residual_max:
+            self.signals.progress_text_edit.emit(self.config.calibration_err_residual+aux.get_calibration_text(matrix, residual), self.config.text_edit_mode_err)
+            self.signals.progress_button.emit()
+            return
+        aux.save_calibration(self.config, matrix, residual)
+        self.signals.progress_text_edit.emit(self.config.calibration_message_done+aux.get_calibration_text(matrix, residual), self.config.text_edit_mode_info)
+        self.signals.progress_button.emit()